@@ -13,13 +13,16 @@ import numpy as np
 
 from src.neuralClosures.configModel import initNeuralClosure
 from src import utils
+from src import benchmark
+from src import dataGenerator
+from src import distributed
+from src import sweep
+from src.neuralClosures import numpyClosure
 
 # python modules
 import tensorflow as tf
 import os
 from optparse import OptionParser
-import time
-import statistics
 
 
 ### global variable ###
@@ -49,6 +52,10 @@ def initModelCpp(input):
     neuralClosureModel = initNeuralClosure(modelNumber, maxDegree_N, folderName)
     neuralClosureModel.loadModel()
     neuralClosureModel.model.summary()
+
+    # --- Trace the batchwise gradient graph once, so solver steps do not rebuild it --- #
+    global batchwiseGradient
+    batchwiseGradient = neuralClosureModel.createBatchwiseGradientFunction()
     print("|")
     print("| Tensorflow neural closure initialized.")
     print("|")
@@ -57,7 +64,7 @@ def initModelCpp(input):
 
 ### function definitions ###
 def initModel(modelNumber=1, polyDegree=0, spatialDim=3, folderName="testFolder", lossCombi=0, width=10, depth=5,
-              normalized=False):
+              normalized=False, precision=1, strategy=None):
     '''
     modelNumber : Defines the used network model, i.e. MK1, MK2...
     maxDegree_N : Defines the maximal Degree of the moment basis, i.e. the "N" of "M_N"
@@ -66,7 +73,10 @@ def initModel(modelNumber=1, polyDegree=0, spatialDim=3, folderName="testFolder"
     global neuralClosureModel
     neuralClosureModel = initNeuralClosure(modelNumber=modelNumber, polyDegree=polyDegree, spatialDim=spatialDim,
                                            folderName=folderName, lossCombi=lossCombi, depth=depth,
-                                           width=width, normalized=normalized)
+                                           width=width, normalized=normalized, precision=precision,
+                                           strategy=strategy)
+    global batchwiseGradient
+    batchwiseGradient = neuralClosureModel.createBatchwiseGradientFunction()
 
     return 0
 
@@ -91,28 +101,29 @@ def callNetwork(input):
 
 
 def callNetworkBatchwise(inputNetwork):
-    # Transform npArray to tfEagerTensor
-    x_model = tf.Variable(inputNetwork)
-
-    # Compute Autodiff tape
-    with tf.GradientTape() as tape:
-        # training=True is only needed if there are layers with different
-        # behavior during training versus inference (e.g. Dropout).
-        predictions = neuralClosureModel.model(x_model, training=False)  # same as model.predict(x)
+    # Note: Use inputNetwork as array, since a newly generated npArray seems to cause a Segfault in cpp
+    callNetworkBatchwiseInplace(inputNetwork)
 
-    # Compute the gradients
-    gradients = tape.gradient(predictions, x_model)
+    return inputNetwork
 
-    # ---- Convert gradients from eagerTensor to numpy array and then to flattened c array ----
 
-    # Note: Use inputNetwork as array, since a newly generated npArray seems to cause a Segfault in cpp
-    (dimCell, dimBase) = inputNetwork.shape
+def callNetworkBatchwiseInplace(inputNetwork, hNetwork=None):
+    '''
+    Zero-copy batchwise entry point for the KiT-RT C++ bridge.
+    input: inputNetwork, caller owned np array, dims = (nCells, inputDim). Is overwritten with alpha = d(network)/du
+           hNetwork, optional caller owned np array, dims = (nCells, 1). Is overwritten with the network output h
+    returns: 0
+    '''
+    # The traced graph has a fixed input signature in the network dtype, so no eager tape is built per call
+    [predictions, gradients] = batchwiseGradient(
+        tf.convert_to_tensor(inputNetwork, dtype=neuralClosureModel.networkDtype))
 
-    for i in range(0, dimCell):
-        for j in range(0, dimBase):
-            inputNetwork[i, j] = gradients[i, j]
+    # Single vectorized write into the caller owned buffers (no per element python loop)
+    np.copyto(inputNetwork, np.reshape(gradients.numpy(), inputNetwork.shape), casting='unsafe')
+    if hNetwork is not None:
+        np.copyto(hNetwork, np.reshape(predictions.numpy(), hNetwork.shape), casting='unsafe')
 
-    return inputNetwork
+    return 0
 
 
 def main():
@@ -126,8 +137,13 @@ def main():
                       help="batch size", metavar="BATCH")
     parser.add_option("-c", "--curriculum", dest="curriculum", default=1,
                       help="training curriculum", metavar="EPOCHCHUNK")
+    parser.add_option("--checkpointFrequency", dest="checkpointFrequency", default=1,
+                      help="epochs between two resumable training checkpoints", metavar="FREQUENCY")
     parser.add_option("-d", "--degree", dest="degree", default=0,
                       help="max degree of moment", metavar="DEGREE")
+    parser.add_option("--distributed", dest="distributed", default=0,
+                      help="multi worker data parallel training (1), cluster from TF_CONFIG or SLURM. --batch is the "
+                           "batch size per replica", metavar="DISTRIBUTED")
     parser.add_option("-e", "--epoch", dest="epoch", default=1000,
                       help="epoch count for neural network", metavar="EPOCH")
     parser.add_option("-f", "--folder", dest="folder", default="testFolder",
@@ -143,10 +159,23 @@ def main():
                       metavar="OBJECTIVE")
     parser.add_option("-p", "--processingmode", dest="processingmode", default=1,
                       help="gpu mode (1). cpu mode (0) ", metavar="PROCESSINGMODE")
+    parser.add_option("--precision", dest="precision", default=1,
+                      help="precision policy of MK11, MK13 and MK14: float32 (0), mixed: float32 network and float64 "
+                           "quadrature reconstruction (1), float64 (2)", metavar="PRECISION")
+    parser.add_option("--resume", dest="resume", default=0,
+                      help="continue training from the last checkpoint of the model folder (1), including optimizer "
+                           "state, epoch and callback states", metavar="RESUME")
     parser.add_option("-s", "--spatialDimension", dest="spatialDimension", default=3,
                       help="spatial dimension of closure", metavar="SPATIALDIM")
+    parser.add_option("--fusedCore", dest="fusedCore", default=0,
+                      help="compute h and alpha of the icnn core in one fused pass instead of a GradientTape (1), "
+                           "MK11, MK13 and MK14 only", metavar="FUSEDCORE")
+    parser.add_option("--streaming", dest="streaming", default=0,
+                      help="stream training data shards from disk with tf.data (1) or load them into memory (0)",
+                      metavar="STREAMING")
     parser.add_option("-t", "--training", dest="training", default=1,
-                      help="execution mode (0) training mode (1)  analysis mode (2) re-save mode (3)",
+                      help="execution mode (0) training mode (1)  analysis mode (2) re-save mode (3) benchmark mode (4) "
+                           "data conversion mode (5) numpy export mode (6) sweep mode (7) data generation mode (8)",
                       metavar="TRAINING")
     parser.add_option("-v", "--verbosity", dest="verbosity", default=1,
                       help="output verbosity keras (0 or 1)", metavar="VERBOSITY")
@@ -154,6 +183,59 @@ def main():
                       help="width of each network layer", metavar="WIDTH")
     parser.add_option("-x", "--networkdepth", dest="networkdepth", default=5,
                       help="height of the network", metavar="HEIGHT")
+    parser.add_option("--benchmarkBatches", dest="benchmarkBatches", default="1000,10000,100000",
+                      help="benchmark mode: comma separated batch sizes", metavar="BATCHES")
+    parser.add_option("--benchmarkModels", dest="benchmarkModels", default="",
+                      help="benchmark mode: comma separated model versions (default: --model)", metavar="MODELS")
+    parser.add_option("--benchmarkWidths", dest="benchmarkWidths", default="",
+                      help="benchmark mode: comma separated network widths (default: --networkwidth)",
+                      metavar="WIDTHS")
+    parser.add_option("--benchmarkDepths", dest="benchmarkDepths", default="",
+                      help="benchmark mode: comma separated network depths (default: --networkdepth)",
+                      metavar="DEPTHS")
+    parser.add_option("--benchmarkClosures", dest="benchmarkClosures", default="call_scaled,call_scaled_64",
+                      help="benchmark mode: comma separated closures, i.e. call_scaled (float32) and call_scaled_64 "
+                           "(float64 post processing)", metavar="CLOSURES")
+    parser.add_option("--benchmarkWarmup", dest="benchmarkWarmup", default=10,
+                      help="benchmark mode: untimed calls after tracing", metavar="WARMUP")
+    parser.add_option("--benchmarkRepetitions", dest="benchmarkRepetitions", default=100,
+                      help="benchmark mode: timed calls per configuration", metavar="REPETITIONS")
+    parser.add_option("--benchmarkOutput", dest="benchmarkOutput", default="benchmark/benchmark",
+                      help="benchmark mode: results are written to <BENCHMARKOUTPUT>.json and .csv",
+                      metavar="BENCHMARKOUTPUT")
+
+    parser.add_option("--sweepModels", dest="sweepModels", default="",
+                      help="sweep mode: comma separated model versions (default: --model)", metavar="MODELS")
+    parser.add_option("--sweepWidths", dest="sweepWidths", default="",
+                      help="sweep mode: comma separated network widths (default: --networkwidth)", metavar="WIDTHS")
+    parser.add_option("--sweepDepths", dest="sweepDepths", default="",
+                      help="sweep mode: comma separated network depths (default: --networkdepth)", metavar="DEPTHS")
+    parser.add_option("--sweepObjectives", dest="sweepObjectives", default="",
+                      help="sweep mode: comma separated objectives (default: --objective)", metavar="OBJECTIVES")
+    parser.add_option("--sweepDegrees", dest="sweepDegrees", default="",
+                      help="sweep mode: comma separated moment degrees (default: --degree)", metavar="DEGREES")
+    parser.add_option("--sweepConfigFile", dest="sweepConfigFile", default="",
+                      help="sweep mode: csv file with the columns model,width,depth,objective,degree. Replaces the "
+                           "grid of the sweep options", metavar="CONFIGFILE")
+    parser.add_option("--sweepWorkers", dest="sweepWorkers", default=2,
+                      help="sweep mode: number of concurrently trained configurations", metavar="WORKERS")
+    parser.add_option("--sweepThreads", dest="sweepThreads", default=1,
+                      help="sweep mode: threads per configuration", metavar="THREADS")
+
+    parser.add_option("--samples", dest="samples", default=1000000,
+                      help="data generation mode: number of samples", metavar="SAMPLES")
+    parser.add_option("--sobol", dest="sobol", default=0,
+                      help="data generation mode: sample alpha with a Sobol sequence (1) instead of uniformly (0), "
+                           "alphasampling=1 only", metavar="SOBOL")
+    parser.add_option("--alphaBound", dest="alphaBound", default=3.0,
+                      help="data generation mode: bound of the sampled multipliers alpha_1..alpha_N", metavar="BOUND")
+    parser.add_option("--momentSampling", dest="momentSampling", default="convex",
+                      help="data generation mode, alphasampling=0: realizable moments as convex combinations of point "
+                           "evaluations (convex), uniform on the realizable set (uniform) or stratified by the "
+                           "distance to its boundary (boundary). uniform and boundary for 1D and 2D M1",
+                      metavar="MOMENTSAMPLING")
+    parser.add_option("--dataWorkers", dest="dataWorkers", default=1,
+                      help="data generation mode: number of worker processes", metavar="WORKERS")
 
     (options, args) = parser.parse_args()
     options.objective = int(options.objective)
@@ -168,9 +250,35 @@ def main():
     options.loadmodel = int(options.loadmodel)
     options.training = int(options.training)
     options.processingmode = int(options.processingmode)
+    options.precision = int(options.precision)
+    options.distributed = int(options.distributed)
+    options.resume = int(options.resume)
+    options.checkpointFrequency = int(options.checkpointFrequency)
     options.normalized = bool(int(options.normalized))
     options.networkwidth = int(options.networkwidth)
     options.networkdepth = int(options.networkdepth)
+    options.streaming = int(options.streaming)
+    options.fusedCore = int(options.fusedCore)
+    options.benchmarkBatches = [int(x) for x in str(options.benchmarkBatches).split(",") if x]
+    options.benchmarkModels = [int(x) for x in str(options.benchmarkModels).split(",") if x] or [options.model]
+    options.benchmarkWidths = [int(x) for x in str(options.benchmarkWidths).split(",") if x] or [
+        options.networkwidth]
+    options.benchmarkDepths = [int(x) for x in str(options.benchmarkDepths).split(",") if x] or [
+        options.networkdepth]
+    options.benchmarkClosures = [x for x in str(options.benchmarkClosures).split(",") if x]
+    options.benchmarkWarmup = int(options.benchmarkWarmup)
+    options.benchmarkRepetitions = int(options.benchmarkRepetitions)
+    options.sweepModels = [int(x) for x in str(options.sweepModels).split(",") if x] or [options.model]
+    options.sweepWidths = [int(x) for x in str(options.sweepWidths).split(",") if x] or [options.networkwidth]
+    options.sweepDepths = [int(x) for x in str(options.sweepDepths).split(",") if x] or [options.networkdepth]
+    options.sweepObjectives = [int(x) for x in str(options.sweepObjectives).split(",") if x] or [options.objective]
+    options.sweepDegrees = [int(x) for x in str(options.sweepDegrees).split(",") if x] or [options.degree]
+    options.sweepWorkers = int(options.sweepWorkers)
+    options.samples = int(options.samples)
+    options.sobol = bool(int(options.sobol))
+    options.alphaBound = float(options.alphaBound)
+    options.dataWorkers = int(options.dataWorkers)
+    options.sweepThreads = int(options.sweepThreads)
 
     # --- End Option Parsing ---
 
@@ -184,18 +292,28 @@ def main():
         else:
             print("Disabled GPU. Using CPU")
 
+    # create the distribution strategy before any other tensorflow operation
+    strategy = None
+    if options.distributed == 1:
+        strategy = distributed.createDistributionStrategy(processingMode=options.processingmode)
+
     # --- initialize model
     print("Initialize model")
     initModel(modelNumber=options.model, polyDegree=options.degree, spatialDim=options.spatialDimension,
               folderName=options.folder, normalized=options.normalized,
-              lossCombi=options.objective, width=options.networkwidth, depth=options.networkdepth)
+              lossCombi=options.objective, width=options.networkwidth, depth=options.networkdepth,
+              precision=options.precision, strategy=strategy)
+    if options.fusedCore == 1:
+        # weight layout is unchanged, so existing .h5 files can be loaded afterwards
+        neuralClosureModel.useFusedCore()
     neuralClosureModel.model.summary()
 
     # Save options and runscript to file
-    utils.writeConfigFile(options, neuralClosureModel)
+    if distributed.isChief(strategy):
+        utils.writeConfigFile(options, neuralClosureModel)
 
-    if options.loadmodel == 1 or options.training == 0 or options.training == 2:
-        # in execution mode the model must be loaded.
+    if (options.loadmodel == 1 and options.training not in [4, 7, 8]) or options.training in [0, 2, 6]:
+        # in execution mode the model must be loaded. The benchmark and sweep modes use freshly initialized models.
         # load model weights
         neuralClosureModel.loadModel()
     else:
@@ -204,16 +322,22 @@ def main():
     if options.training == 1:
         # create training Data
         trainingMode = True
-        neuralClosureModel.loadTrainingData(shuffleMode=trainingMode,
-                                            alphasampling=options.alphasampling,
-                                            normalizedData=neuralClosureModel.normalized)  # normalizedData=False)
+        if options.streaming == 1:
+            neuralClosureModel.loadTrainingDataStreaming(alphasampling=options.alphasampling,
+                                                         normalizedData=neuralClosureModel.normalized)
+        else:
+            neuralClosureModel.loadTrainingData(shuffleMode=trainingMode,
+                                                alphasampling=options.alphasampling,
+                                                normalizedData=neuralClosureModel.normalized)  # normalizedData=False)
 
         # normalize data (experimental)
         # neuralClosureModel.normalizeData()
         # train model
         neuralClosureModel.config_start_training(valSplit=0.1, epochCount=options.epoch, curriculum=options.curriculum,
                                                  batchSize=options.batch, verbosity=options.verbosity,
-                                                 processingMode=options.processingmode)
+                                                 processingMode=options.processingmode,
+                                                 resume=options.resume == 1,
+                                                 checkpointFrequency=options.checkpointFrequency)
         # save model
         neuralClosureModel.saveModel()
 
@@ -243,28 +367,40 @@ def main():
         neuralClosureModel.saveModel()
 
     elif options.training == 4:
-        # timing measurement
-        # startup
-        u_in = tf.zeros([2, neuralClosureModel.inputDim], tf.float32)
-        [u, alpha, h] = neuralClosureModel.model(u_in)
-
-        u_in = tf.ones([1000000, neuralClosureModel.inputDim], tf.float32)
-
-        # u_tf = tf.constant(u_in)
-        totduration = 0
-        durations = []
-        for i in range(0, 100):
-            print("Start computation")
-            start = time.perf_counter()
-            [u, alpha, h] = neuralClosureModel.model(u_in)
-            end = time.perf_counter()
-            totduration += end - start
-            durations.append(end - start)
-            print("Model executed. Elapsed time: " + str(end - start) + " in iteration " + str(i) + ".")
-        avg = totduration / 100
-        print("Average duration: " + str(avg) + " seconds")
-        stddev = statistics.stdev(durations)
-        print("Standard deviation:" + str(stddev) + "")
+        print("Benchmark mode entered.")  # inference timings of freshly initialized models
+        benchmark.runBenchmark(models=options.benchmarkModels, widths=options.benchmarkWidths,
+                               depths=options.benchmarkDepths, batchSizes=options.benchmarkBatches,
+                               closures=options.benchmarkClosures, polyDegree=options.degree,
+                               spatialDim=options.spatialDimension, warmUp=options.benchmarkWarmup,
+                               repetitions=options.benchmarkRepetitions, outputFile=options.benchmarkOutput)
+    elif options.training == 5:
+        print("Data conversion mode entered.")  # one-time conversion of the training csv to memory mappable .npy
+        neuralClosureModel.convertTrainingData(alphasampling=options.alphasampling,
+                                               normalizedData=neuralClosureModel.normalized)
+    elif options.training == 6:
+        print("Numpy export mode entered.")  # weights of the ICNN core for the tensorflow free numpy closure
+        numpyClosure.exportNumpyClosure(neuralClosureModel)
+    elif options.training == 7:
+        print("Sweep mode entered.")  # concurrent training of a grid of configurations on shared training data
+        if options.sweepConfigFile:
+            configs = sweep.loadSweepConfigs(options.sweepConfigFile)
+        else:
+            configs = sweep.expandGrid(models=options.sweepModels, widths=options.sweepWidths,
+                                       depths=options.sweepDepths, objectives=options.sweepObjectives,
+                                       degrees=options.sweepDegrees)
+        sweep.runSweep(configs, nWorkers=options.sweepWorkers, threadsPerJob=options.sweepThreads,
+                       sweepFolder=options.folder, spatialDim=options.spatialDimension, normalized=options.normalized,
+                       alphasampling=options.alphasampling, epochs=options.epoch, batchSize=options.batch,
+                       curriculum=options.curriculum, precision=options.precision, verbosity=options.verbosity)
+    elif options.training == 8:
+        print("Data generation mode entered.")  # sharded training data of the chosen degree and sampling
+        dataGenerator.generateTrainingData(
+            neuralClosureModel.getTrainingDataFilename(alphasampling=options.alphasampling,
+                                                       normalizedData=neuralClosureModel.normalized),
+            options.samples, polyDegree=options.degree, spatialDim=options.spatialDimension,
+            alphaSampling=options.alphasampling, sobol=options.sobol, alphaBound=options.alphaBound,
+            momentSampling=options.momentSampling,
+            normalized=neuralClosureModel.normalized, nWorkers=options.dataWorkers)
     else:
         # --- in execution mode,  callNetwork or callNetworkBatchwise get called from c++ directly ---
         print("pure execution mode")
@@ -0,0 +1,36 @@
+#!/bin/bash
+#SBATCH --nodes=4
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=24
+#SBATCH --time=24:00:00
+#SBATCH --mem=20gb
+#SBATCH --partition=multiple
+#SBATCH --job-name=EntropyTrainerMultiWorker
+#SBATCH --output=0_CPU_multiworker_out_%j
+#SBATCH --error=0_CPU_multiworker_err_%j
+
+# one training process per node, each uses all cores of its node. The cluster is read from the SLURM environment.
+# --resume=1: a requeued job continues from the last checkpoint
+export OMP_NUM_THREADS=${SLURM_CPUS_PER_TASK}
+export TF_NUM_INTRAOP_THREADS=${SLURM_CPUS_PER_TASK}
+
+srun python callNeuralClosure.py \
+  --alphasampling=0 \
+  --batch=128 \
+  --curriculum=1 \
+  --degree=2 \
+  --distributed=1 \
+  --epoch=1000 \
+  --folder=002_sim_M2_1D_multiworker \
+  --loadModel=0 \
+  --model=11 \
+  --normalized=1 \
+  --objective=2 \
+  --processingmode=0 \
+  --resume=1 \
+  --spatialDimension=1 \
+  --streaming=1 \
+  --training=1 \
+  --verbosity=1 \
+  --networkwidth=15 \
+  --networkdepth=7
@@ -0,0 +1,18 @@
+python callNeuralClosure.py \
+--alphasampling=0 \
+--batch=128 \
+--curriculum=1 \
+--degree=1 \
+--epoch=2 \
+--folder=00_comp_study \
+--model=11 \
+--normalized=1 \
+--objective=2 \
+--processingmode=0 \
+--spatialDimension=1 \
+--training=7 \
+--verbosity=1 \
+--networkdepth=5 \
+--sweepWidths=10,20,30,40 \
+--sweepWorkers=4 \
+--sweepThreads=1
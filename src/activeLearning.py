@@ -0,0 +1,218 @@
+'''
+Active learning of the neural entropy closures during a solver run.
+The solver passes its cells, labeled with the reference (Newton) closure, to the buffer. Only the error hotspots,
+i.e. cells where the u or alpha error of the network exceeds a tolerance, are kept. They are deduplicated with a
+spatial hash of the normalized moments and buffered in memory. Every few solver steps, the neural closure is
+fine tuned on the buffered samples, continuing from its last resumable checkpoint. A random sample of the original
+training data is replayed in each fine tuning, so the network does not forget the rest of the moment space.
+'''
+
+### imports ###
+# python modules
+import os
+
+import numpy as np
+import pandas as pd
+
+# inpackage imports
+from src import utils
+
+
+### function definitions ###
+def normalizeSamples(u, alpha):
+    '''
+    Scales moments to u_0 = 1. alpha_0 is shifted by -ln(u_0), the other multipliers are unchanged
+    input: u, alpha, dims = (nS x N)
+    returns: [u, alpha, h] of the normalized moments, dims = (nS x N), (nS x N), (nS x 1)
+    '''
+    u0 = u[:, 0:1]
+    uNormal = u / u0
+    alphaNormal = np.concatenate([alpha[:, 0:1] - np.log(u0), alpha[:, 1:]], axis=1)
+    h = np.sum(alphaNormal * uNormal, axis=1, keepdims=True) - 1.0  # alpha*u - <exp(alpha*m)>, <exp(alpha*m)> = 1
+    return [uNormal, alphaNormal, h]
+
+
+def spatialHash(uNormal, resolution):
+    '''
+    returns: integer grid cell of the normalized moments u_1..u_N with edge length resolution, dims = (nS x N-1)
+    '''
+    return np.floor(uNormal[:, 1:] / resolution).astype(np.int64)
+
+
+### class definitions ###
+class activeLearningBuffer:
+
+    def __init__(self, neuralClosure, uTol=1e-3, alphaTol=1e-2, resolution=1e-3, retrainInterval=100,
+                 minSamples=64, maxSamples=100000, epochs=50, batchSize=32, valSplit=0.1, sampleFile=None,
+                 replayData=None, replayFile=None, replayRatio=1.0, seed=0):
+        '''
+        input: neuralClosure = loaded normalized closure (e.g. neuralMK11) that is fine tuned
+               uTol = cells with ||u_theta - u|| / u_0 > uTol are kept
+               alphaTol = cells with ||alpha_theta - alpha|| > alphaTol are kept
+               resolution = edge length of the hash cells in the normalized moment space. One sample per hash cell
+               retrainInterval = solver steps between two fine tunings
+               minSamples = minimal number of new samples that triggers a fine tuning
+               maxSamples = capacity of the buffer, the oldest samples are dropped first
+               epochs = epochs per fine tuning
+               sampleFile = csv file of the buffered samples (training data format), written before each fine tuning.
+                            Default: <model folder>/active_learning_samples.csv
+               replayData = original normalized training data [u, alpha, h], replayed in each fine tuning
+               replayFile = training data file of the replay data, loaded at the first fine tuning, if replayData is
+                            not given. Default: normalized training data of the closure, see getTrainingDataFilename
+               replayRatio = replayed original samples per buffered sample
+        '''
+        self.neuralClosure = neuralClosure
+        self.uTol = uTol
+        self.alphaTol = alphaTol
+        self.resolution = resolution
+        self.retrainInterval = retrainInterval
+        self.minSamples = minSamples
+        self.maxSamples = maxSamples
+        self.epochs = epochs
+        self.batchSize = batchSize
+        self.valSplit = valSplit
+        self.sampleFile = sampleFile
+        if self.sampleFile is None:
+            self.sampleFile = neuralClosure.filename + "/active_learning_samples.csv"
+        self.replayData = replayData
+        self.replayFile = replayFile
+        if self.replayFile is None:
+            self.replayFile = neuralClosure.getTrainingDataFilename(normalizedData=True)
+        if self.replayData is None and not (os.path.isfile(self.replayFile) or utils.binaryDataExists(
+                self.replayFile) or utils.getBinaryShardStems(self.replayFile)):
+            raise FileNotFoundError("Replay data of the active learning not found: " + self.replayFile)
+        self.replayRatio = replayRatio
+        self.rng = np.random.default_rng(seed)
+
+        # buffered normalized samples and their hash keys
+        self.u = None
+        self.alpha = None
+        self.h = None
+        self.keys = set()
+        self.sampleKeys = []  # hash key of each buffered sample, in buffer order
+
+        self.steps = 0
+        self.newSamples = 0  # samples added since the last fine tuning
+        self.hotspotRates = []  # fraction of hotspot cells per step
+        self.fineTunings = 0
+
+    def __len__(self):
+        return 0 if self.u is None else self.u.shape[0]
+
+    def getHotspots(self, u, alpha, uTheta, alphaTheta):
+        '''
+        returns: mask of the cells whose network prediction exceeds the u or alpha tolerance, dims = nS
+        '''
+        uError = np.linalg.norm(uTheta - u, axis=1) / u[:, 0]
+        alphaError = np.linalg.norm(alphaTheta - alpha, axis=1)  # the ln(u_0) shift of alpha_0 cancels
+        return (uError > self.uTol) | (alphaError > self.alphaTol)
+
+    def addCells(self, u, alpha, uTheta, alphaTheta):
+        '''
+        brief: adds the error hotspots of one solver step and fine tunes the network, if it is due
+        input: u, alpha = moments and reference multipliers of the cells, dims = (nS x N)
+               uTheta, alphaTheta = reconstructed moments and multipliers of the network, dims = (nS x N)
+        returns: True, if the network was fine tuned
+        '''
+        self.steps += 1
+        hotspots = self.getHotspots(u, alpha, uTheta, alphaTheta)
+        self.hotspotRates.append(np.count_nonzero(hotspots) / max(u.shape[0], 1))
+        if hotspots.any():
+            self.addSamples(*normalizeSamples(u[hotspots], alpha[hotspots]))
+
+        if self.steps % self.retrainInterval == 0 and self.newSamples >= self.minSamples:
+            self.fineTune()
+            return True
+        return False
+
+    def addSamples(self, uNormal, alphaNormal, h):
+        '''
+        brief: buffers the normalized samples, whose hash cell is not occupied yet
+        returns: number of added samples
+        '''
+        hashes = spatialHash(uNormal, self.resolution)
+        # first sample per hash cell within the batch, then skip the cells that are already buffered
+        [_, firstIdx] = np.unique(hashes, axis=0, return_index=True)
+        firstIdx = np.sort(firstIdx)
+        batchKeys = [hashes[idx].tobytes() for idx in firstIdx]
+        newIdx = [idx for idx, key in zip(firstIdx, batchKeys) if key not in self.keys]
+        newKeys = [key for key in batchKeys if key not in self.keys]
+        if not newIdx:
+            return 0
+
+        self.keys.update(newKeys)
+        self.sampleKeys.extend(newKeys)
+        if self.u is None:
+            [self.u, self.alpha, self.h] = [uNormal[newIdx], alphaNormal[newIdx], h[newIdx]]
+        else:
+            self.u = np.concatenate([self.u, uNormal[newIdx]], axis=0)
+            self.alpha = np.concatenate([self.alpha, alphaNormal[newIdx]], axis=0)
+            self.h = np.concatenate([self.h, h[newIdx]], axis=0)
+        self.newSamples += len(newIdx)
+
+        # drop the oldest samples and free their hash cells
+        nDrop = len(self) - self.maxSamples
+        if nDrop > 0:
+            self.keys.difference_update(self.sampleKeys[:nDrop])
+            del self.sampleKeys[:nDrop]
+            [self.u, self.alpha, self.h] = [self.u[nDrop:], self.alpha[nDrop:], self.h[nDrop:]]
+        return len(newIdx)
+
+    def saveSamples(self, filename=None):
+        '''
+        brief: writes the buffered samples in the csv format of the training data (idx, u_0..u_N, a_0..a_N, h)
+        '''
+        if filename is None:
+            filename = self.sampleFile
+        nSystem = self.u.shape[1]
+        columns = ["u" + str(i) for i in range(nSystem)] + ["a" + str(i) for i in range(nSystem)] + ["h"]
+        df = pd.DataFrame(np.concatenate([self.u, self.alpha, self.h], axis=1), columns=columns)
+        df.index.name = "idx"
+        df.to_csv(filename)
+        return 0
+
+    def getReplaySamples(self):
+        '''
+        returns: [u, alpha, h] of replayRatio * len(self) random samples of the original training data
+        '''
+        if self.replayData is None:
+            self.replayData = utils.loadData(self.replayFile, self.neuralClosure.csvInputDim)
+        nData = self.replayData[0].shape[0]
+        nReplay = int(self.replayRatio * len(self))
+        # ascending indices keep the reads of memory mapped data local
+        indices = np.sort(self.rng.choice(nData, size=nReplay, replace=nReplay > nData))
+        return [np.asarray(data[indices], dtype=np.float64) for data in self.replayData]
+
+    def fineTune(self):
+        '''
+        brief: continues the training of the neural closure from its last checkpoint on the buffered samples and a
+               replayed sample of the original training data for the given number of epochs. The learning rate
+               schedule continues at the checkpoint epoch.
+        '''
+        utils.make_directory(self.neuralClosure.filename)
+        self.saveSamples()
+        replaySamples = self.getReplaySamples()
+        print("Active learning: fine tuning on " + str(len(self)) + " samples (" + str(self.newSamples)
+              + " new) and " + str(replaySamples[0].shape[0]) + " replayed training samples after "
+              + str(self.steps) + " solver steps")
+        trainingData = [np.concatenate([bufferData, replayData], axis=0) for bufferData, replayData in
+                        zip([self.u, self.alpha, self.h], replaySamples)]
+        self.neuralClosure.setTrainingData(trainingData, shuffleMode=True, normalizedData=True)
+        initialEpoch = self.neuralClosure.getCheckpointEpoch()
+        self.neuralClosure.config_start_training(valSplit=self.valSplit, epochCount=initialEpoch + self.epochs,
+                                                 curriculum=1, batchSize=self.batchSize, verbosity=1, resume=True,
+                                                 checkpointFrequency=self.epochs)
+        self.newSamples = 0
+        self.fineTunings += 1
+        return 0
+
+    def report(self):
+        '''
+        brief: prints the hotspot fraction of the last step and the buffer state
+        '''
+        if len(self.hotspotRates) == 0:
+            return 0
+        print("Active learning: " + str(self.hotspotRates[-1]) + " hotspot cells in the last step, "
+              + str(np.mean(self.hotspotRates)) + " on average. " + str(len(self)) + " buffered samples, "
+              + str(self.fineTunings) + " fine tunings")
+        return 0
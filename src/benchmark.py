@@ -0,0 +1,126 @@
+'''
+Inference benchmark suite for the neural entropy closures.
+Sweeps batch sizes, model versions, network widths/depths and the float32 (call_scaled) and float64
+(call_scaled_64) post processing paths. Every configuration is traced once, warmed up and then timed in
+steady state on realizable normalized moments. Results are written as JSON and CSV.
+'''
+
+### imports ###
+# python modules
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+# inpackage imports
+from src import math
+from src import utils
+from src.neuralClosures.configModel import initNeuralClosure
+from src.neuralClosures.inferenceEngine import inferenceEngine
+
+
+### function definitions ###
+def sampleNormalizedMoments(nS, mBasis, quadWeights, alphaBound=3.0, seed=0):
+    '''
+    Samples realizable normalized moments (u_0 = 1) by sampling the Lagrange multipliers alpha_1..alpha_N uniformly
+    in [-alphaBound, alphaBound] and reconstructing u from the Maxwell-Boltzmann ansatz.
+    input: nS = number of samples
+           mBasis = moment basis, dims = (N x nq)
+           quadWeights = quadrature weights, dims = nq
+    returns: u, dims = (nS x N)
+    '''
+    rng = np.random.default_rng(seed)
+    alpha = np.zeros((nS, mBasis.shape[0]))
+    alpha[:, 1:] = rng.uniform(-alphaBound, alphaBound, size=(nS, mBasis.shape[0] - 1))
+    u = np.matmul(math.entropyDualPrime(np.matmul(alpha, mBasis)) * quadWeights, mBasis.T)  # <m exp(alpha*m)>
+    return u / u[:, 0:1]
+
+
+def timeClosure(engine, u, warmUp=10, repetitions=100):
+    '''
+    Times a compiled closure. The first call traces the graph and is reported separately, then warmUp calls are
+    discarded and repetitions calls are timed.
+    returns: [traceTime, durations], durations dims = repetitions
+    '''
+    start = time.perf_counter()
+    outputs = engine(u)
+    outputs[-1].numpy()  # wait for the result
+    traceTime = time.perf_counter() - start
+
+    for i in range(warmUp):
+        engine(u)[-1].numpy()
+
+    durations = np.zeros(repetitions)
+    for i in range(repetitions):
+        start = time.perf_counter()
+        engine(u)[-1].numpy()
+        durations[i] = time.perf_counter() - start
+    return [traceTime, durations]
+
+
+def runBenchmark(models=[11], widths=[10], depths=[5], batchSizes=[1000, 10000, 100000],
+                 closures=["call_scaled", "call_scaled_64"], polyDegree=1, spatialDim=1, warmUp=10, repetitions=100,
+                 outputFile="benchmark/benchmark"):
+    '''
+    Runs the inference benchmark sweep. Models are freshly initialized, since the timings do not depend on the
+    weights. Closures a model version does not implement are skipped.
+    input: models = list of model versions (normalized sobolev models, i.e. 11, 13, 14)
+           widths, depths = lists of network widths and depths
+           batchSizes = list of batch sizes
+           closures = list of closure methods to time
+           outputFile = results are written to outputFile.json and outputFile.csv
+    returns: list of result records (dicts)
+    '''
+    results = []
+    for modelNumber in models:
+        for width in widths:
+            for depth in depths:
+                neuralClosure = initNeuralClosure(modelNumber=modelNumber, polyDegree=polyDegree,
+                                                  spatialDim=spatialDim, folderName="benchmark", width=width,
+                                                  depth=depth, normalized=True)
+                mBasis = neuralClosure.model.momentBasis64.numpy()
+                quadWeights = np.reshape(neuralClosure.model.quadWeights64.numpy(), (-1,))
+                u = sampleNormalizedMoments(max(batchSizes), mBasis, quadWeights)
+
+                for closureName in closures:
+                    if not hasattr(neuralClosure, closureName):
+                        print("MK" + str(modelNumber) + " has no closure " + closureName + ". Skipped.")
+                        continue
+                    for batchSize in batchSizes:
+                        # one bucket of exactly batchSize, so no padding enters the timings
+                        engine = inferenceEngine(neuralClosure, closureName=closureName, minBucketSize=batchSize,
+                                                 maxBucketSize=batchSize)
+                        [traceTime, durations] = timeClosure(engine, u[:batchSize], warmUp, repetitions)
+                        record = {"model": modelNumber, "width": width, "depth": depth, "polyDegree": polyDegree,
+                                  "spatialDim": spatialDim, "closure": closureName, "batchSize": batchSize,
+                                  "warmUp": warmUp, "repetitions": repetitions, "traceTime": traceTime,
+                                  "mean": float(np.mean(durations)), "std": float(np.std(durations)),
+                                  "min": float(np.min(durations)), "p50": float(np.percentile(durations, 50)),
+                                  "p90": float(np.percentile(durations, 90)),
+                                  "p99": float(np.percentile(durations, 99)), "max": float(np.max(durations)),
+                                  "samplesPerSecond": batchSize / float(np.percentile(durations, 50))}
+                        results.append(record)
+                        print("MK" + str(modelNumber) + " width " + str(width) + " depth " + str(depth) + " "
+                              + closureName + " batch " + str(batchSize) + ": median " + str(record["p50"])
+                              + " s, p99 " + str(record["p99"]) + " s")
+                tf.keras.backend.clear_session()
+
+    writeBenchmarkResults(results, outputFile)
+    return results
+
+
+def writeBenchmarkResults(results, outputFile):
+    '''
+    Writes the benchmark records to outputFile.json and outputFile.csv
+    '''
+    folder = outputFile.rsplit('/', 1)[0] if '/' in outputFile else ''
+    if folder:
+        utils.make_directory(folder)
+
+    with open(outputFile + '.json', 'w') as f:
+        json.dump(results, f, indent=2)
+    pd.DataFrame(results).to_csv(outputFile + '.csv', index=False)
+    print("Benchmark results written to " + outputFile + ".json and " + outputFile + ".csv")
+    return 0
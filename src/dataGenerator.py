@@ -0,0 +1,276 @@
+'''
+Training data generator for the neural entropy closures (Maxwell-Boltzmann entropy, monomial basis).
+Samples either the Lagrange multipliers alpha (uniform or Sobol, alphasampling = 1) and reconstructs u, or
+realizable moments u and solves the dual entropy problem with the batched Newton solver (alphasampling = 0). Moments
+are sampled as convex combinations of point evaluations, or with the samplers of src.realizability (uniform or
+stratified by boundary distance).
+Samples are computed in vectorized batches by a pool of worker processes and written as binary shards
+<stem>_shard<idx>_u.npy, _alpha.npy, _h.npy, which are read by utils.loadData and the streaming pipeline.
+'''
+
+### imports ###
+# python modules
+import glob
+import multiprocessing
+import os
+import time
+import warnings
+
+import numpy as np
+from scipy.stats import qmc
+
+# inpackage imports
+from src import math
+from src import realizability
+from src.neuralClosures.numpyClosure import reconstructScaled
+
+
+### function definitions ###
+def sampleMultipliers(nS, basisSize, alphaBound=3.0, sobol=False, rng=None, seed=0, offset=0):
+    '''
+    Samples the multipliers alpha_1..alpha_N of normalized moments in [-alphaBound, alphaBound]^(N-1)
+    input: nS = number of samples
+           basisSize = N
+           sobol = scrambled Sobol sequence (True) or uniform random samples (False, drawn from rng)
+           seed, offset = Sobol only. All shards use the same sequence, a shard starts at its offset
+    returns: alpha_reduced, dims = (nS x N-1)
+    '''
+    if sobol:
+        sampler = qmc.Sobol(d=basisSize - 1, scramble=True, seed=seed)
+        if offset > 0:
+            sampler.fast_forward(offset)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # balance warning for sample counts that are not a power of 2
+            samples = sampler.random(nS)
+    else:
+        samples = rng.random((nS, basisSize - 1))
+    return alphaBound * (2.0 * samples - 1.0)
+
+
+def sampleVelocities(nS, nPoints, spatialDim, rng):
+    '''
+    Samples velocities uniformly on the velocity domain of the quadrature, i.e. [-1, 1] in 1D, the unit sphere in 3D
+    and the unit sphere projected to the x-y plane in 2D
+    returns: velocities, dims = (nS * nPoints x spatialDim)
+    '''
+    if spatialDim == 1:
+        return rng.uniform(-1.0, 1.0, size=(nS * nPoints, 1))
+    directions = rng.standard_normal((nS * nPoints, 3))
+    directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+    return directions[:, :spatialDim]
+
+
+def sampleRealizableMoments(nS, polyDegree, spatialDim, rng, nPoints=None):
+    '''
+    Samples normalized realizable moments as convex combinations of the basis at random velocities,
+    u = sum_k lambda_k m(v_k) with Dirichlet distributed weights lambda. Every convex combination of point
+    evaluations is realizable, so no sample is rejected.
+    input: nPoints = number of velocities per sample. Default: basis size + 1
+    returns: u, dims = (nS x N), u_0 = 1
+    '''
+    basisSize = math.getBasisSize(polyDegree, spatialDim)
+    if nPoints is None:
+        nPoints = basisSize + 1
+    velocities = sampleVelocities(nS, nPoints, spatialDim, rng)
+    pointMoments = math.computeMonomialBasis(velocities, polyDegree, spatialDim).reshape((basisSize, nS, nPoints))
+    weights = rng.dirichlet(np.ones(nPoints), size=nS)
+    return np.einsum('nsk,sk->sn', pointMoments, weights)
+
+
+def scaleMoments(u, alpha, u0):
+    '''
+    Scales normalized moments to the density u_0. alpha_0 is shifted by ln(u_0), the other multipliers are unchanged
+    input: u, alpha = normalized moments and multipliers, dims = (nS x N)
+           u0, dims = (nS x 1)
+    returns: [u, alpha, h], dims = (nS x N), (nS x N), (nS x 1)
+    '''
+    u = u * u0
+    alpha = np.concatenate([alpha[:, 0:1] + np.log(u0), alpha[:, 1:]], axis=1)
+    h = np.sum(alpha * u, axis=1, keepdims=True) - u0  # alpha*u - <exp(alpha*m)>, <exp(alpha*m)> = u_0
+    return [u, alpha, h]
+
+
+def computeFromMultipliers(alphaReduced, mBasis, quadWeights, u0):
+    '''
+    returns: [u, alpha, h] of the multipliers alpha_1..alpha_N, scaled to the densities u0, dims = (nS x N),
+             (nS x N), (nS x 1)
+    '''
+    uNonNormal = np.zeros((alphaReduced.shape[0], mBasis.shape[0]))
+    uNonNormal[:, 0:1] = u0
+    return reconstructScaled(uNonNormal, alphaReduced, mBasis, quadWeights)
+
+
+def computeFromMoments(uNormal, mBasis, quadWeights, u0, tol=1e-7, maxIter=100):
+    '''
+    Solves the dual entropy problem of normalized moments with the batched Newton solver. Samples that do not
+    converge (close to the realizable boundary) are dropped.
+    returns: [[u, alpha, h] of the converged samples, scaled to the densities u0], mask of the converged samples
+    '''
+    alphaStart = np.zeros(uNormal.shape)
+    alphaStart[:, 0] = -np.log(np.sum(quadWeights))  # isotropic density with u_0 = 1
+    [alpha, _, converged] = math.minimizeEntropyNewtonBatch(uNormal, alphaStart, mBasis, quadWeights, tol=tol,
+                                                            maxIter=maxIter)
+    return [scaleMoments(uNormal[converged], alpha[converged], u0[converged]), converged]
+
+
+def getDataStem(filename):
+    '''
+    returns: filename of the training data without the .csv ending
+    '''
+    return filename[:-4] if filename.endswith(".csv") else filename
+
+
+def getShardFilenames(filename, shardIdx):
+    '''
+    returns: [u_file, alpha_file, h_file] of shard shardIdx of training data file <filename>
+    '''
+    shardStem = getDataStem(filename) + "_shard" + str(shardIdx).zfill(3)
+    return [shardStem + "_u.npy", shardStem + "_alpha.npy", shardStem + "_h.npy"]
+
+
+def initWorker(threadsPerWorker):
+    '''
+    Pool initializer, limits the threads of the tensorflow runtime imported by src.math
+    '''
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threadsPerWorker)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def generateShard(job):
+    '''
+    Generates one shard in batches and writes it to disk
+    input: job = (shardIdx, nSamples, settings)
+    returns: [shardIdx, number of written samples, number of dropped samples, dropped samples per boundary distance
+             stratum (momentSampling = "boundary", else None)]
+    '''
+    (shardIdx, nSamples, settings) = job
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(settings["spatialDim"], settings["polyDegree"],
+                                                       settings["quadOrder"])
+    rng = np.random.default_rng([settings["seed"], shardIdx])
+    # the quadrature only realizes velocities in the convex hull of its nodes. Sampling on the realizable set of
+    # [-1, 1] (unit sphere) would put the boundary strata outside of the discrete realizable set
+    radius = realizability.supportRadius(mBasis, settings["spatialDim"])
+    strataDropped = None
+    if settings["alphaSampling"] == 0 and settings["momentSampling"] == "boundary":
+        strataDropped = np.zeros(len(realizability.defaultStrata) - 1, dtype=np.int64)
+    shardData = [[], [], []]
+    for start in range(0, nSamples, settings["batchSize"]):
+        nBatch = min(settings["batchSize"], nSamples - start)
+        u0 = np.ones((nBatch, 1))
+        if not settings["normalized"]:
+            u0 = rng.uniform(settings["u0Bounds"][0], settings["u0Bounds"][1], size=(nBatch, 1))
+
+        if settings["alphaSampling"] == 1:
+            alphaReduced = sampleMultipliers(nBatch, mBasis.shape[0], alphaBound=settings["alphaBound"],
+                                             sobol=settings["sobol"], rng=rng, seed=settings["seed"],
+                                             offset=shardIdx * settings["shardSize"] + start)
+            batchData = computeFromMultipliers(alphaReduced, mBasis, quadWeights, u0)
+        else:
+            strataIdx = None
+            if settings["momentSampling"] == "convex":
+                uNormal = sampleRealizableMoments(nBatch, settings["polyDegree"], settings["spatialDim"], rng)
+            elif settings["momentSampling"] == "boundary":
+                [uNormal, strataIdx] = realizability.sampleRealizable(nBatch, settings["polyDegree"],
+                                                                      settings["spatialDim"], rng, mode="boundary",
+                                                                      radius=radius, returnStrata=True)
+            else:
+                uNormal = realizability.sampleRealizable(nBatch, settings["polyDegree"], settings["spatialDim"], rng,
+                                                         mode=settings["momentSampling"], radius=radius)
+            [batchData, converged] = computeFromMoments(uNormal, mBasis, quadWeights, u0, tol=settings["tol"])
+            if strataIdx is not None:
+                strataDropped += np.bincount(strataIdx[np.logical_not(converged)], minlength=len(strataDropped))
+        for data, batch in zip(shardData, batchData):
+            data.append(batch)
+
+    shardData = [np.concatenate(data, axis=0) for data in shardData]
+    for shardFile, data in zip(getShardFilenames(settings["filename"], shardIdx), shardData):
+        # write to a temporary file first, so readers never see a partial shard
+        np.save(shardFile[:-4] + ".tmp.npy", data)
+        os.replace(shardFile[:-4] + ".tmp.npy", shardFile)
+    return [shardIdx, shardData[0].shape[0], nSamples - shardData[0].shape[0], strataDropped]
+
+
+def generateTrainingData(filename, nSamples, polyDegree=1, spatialDim=1, alphaSampling=1, sobol=False,
+                         alphaBound=3.0, momentSampling="convex", normalized=True, u0Bounds=(1e-3, 10.0),
+                         shardSize=1048576, batchSize=100000, nWorkers=1, threadsPerWorker=1, quadOrder=None, tol=1e-7, seed=0):
+    '''
+    Generates a training data set and writes it as binary shards next to <filename>, e.g.
+    data/1D/Monomial_M1_1D_normal_shard000_u.npy. Existing shards of <filename> are replaced.
+    input: filename = training data file name, see neuralBase.getTrainingDataFilename
+           nSamples = number of samples
+           alphaSampling = sample alpha (1) or realizable u (0)
+           sobol = alpha sampling only, Sobol sequence instead of uniform random samples
+           alphaBound = alpha sampling only, bound of the multipliers alpha_1..alpha_N
+           momentSampling = u sampling only, convex combinations of point evaluations ("convex"), uniform on the
+                            realizable set ("uniform") or stratified by boundary distance ("boundary"), see
+                            src.realizability (1D and 2D M1). The samples are taken relative to the realizable set
+                            of the quadrature, see realizability.supportRadius
+           normalized = u_0 = 1 (True) or u_0 uniform in u0Bounds (False)
+           shardSize = samples per shard, a power of 2 keeps the balance of the Sobol sequence
+           batchSize = samples per vectorized batch
+           nWorkers = number of worker processes, threadsPerWorker = threads per worker
+           quadOrder = quadrature order. Default: 10 * polyDegree as in the sobolev models
+           tol = u sampling only, tolerance of the Newton solver. Samples that do not converge are dropped
+    returns: list of the written shards [u_file, alpha_file, h_file]
+    '''
+    if quadOrder is None:
+        quadOrder = 10 * max(polyDegree, 1)
+    if alphaSampling == 0 and momentSampling != "convex":
+        realizability.checkSupport(polyDegree, spatialDim)
+    stem = getDataStem(filename)
+    folder = os.path.dirname(stem)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    oldShards = glob.glob(stem + "_shard*_u.npy") + glob.glob(stem + "_shard*_alpha.npy") + glob.glob(
+        stem + "_shard*_h.npy")
+    if oldShards:
+        print("Replacing " + str(len(oldShards)) + " existing shard files of " + stem)
+        for oldShard in oldShards:
+            os.remove(oldShard)
+
+    settings = {"filename": filename, "polyDegree": polyDegree, "spatialDim": spatialDim,
+                "alphaSampling": alphaSampling, "sobol": sobol, "alphaBound": alphaBound,
+                "momentSampling": momentSampling, "normalized": normalized,
+                "u0Bounds": u0Bounds, "shardSize": shardSize, "batchSize": batchSize, "quadOrder": quadOrder,
+                "tol": tol, "seed": seed}
+    jobs = [(shardIdx, min(shardSize, nSamples - start), settings) for shardIdx, start in
+            enumerate(range(0, nSamples, shardSize))]
+
+    print("Generating " + str(nSamples) + " samples in " + str(len(jobs)) + " shards with " + str(nWorkers)
+          + " workers")
+    start = time.perf_counter()
+    results = []
+    if min(nWorkers, len(jobs)) <= 1:
+        results = [generateShard(job) for job in jobs]
+    else:
+        # the thread limits of numpy are read at import, i.e. when the spawned workers start
+        threadVariables = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+        savedEnviron = {variable: os.environ.get(variable) for variable in threadVariables}
+        for variable in threadVariables:
+            os.environ[variable] = str(threadsPerWorker)
+        try:
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(processes=min(nWorkers, len(jobs)), initializer=initWorker,
+                              initargs=(threadsPerWorker,)) as pool:
+                for result in pool.imap_unordered(generateShard, jobs):
+                    results.append(result)
+                    print("Shard " + str(result[0]) + " written: " + str(result[1]) + " samples")
+        finally:
+            for variable, value in savedEnviron.items():
+                if value is None:
+                    os.environ.pop(variable, None)
+                else:
+                    os.environ[variable] = value
+
+    nWritten = sum([result[1] for result in results])
+    nDropped = sum([result[2] for result in results])
+    print("Generated " + str(nWritten) + " samples (" + str(nDropped) + " not converged, dropped). Elapsed time: "
+          + str(time.perf_counter() - start))
+    if alphaSampling == 0 and momentSampling == "boundary":
+        strataDropped = np.sum([result[3] for result in results], axis=0)
+        strata = realizability.defaultStrata
+        for i in range(len(strataDropped)):
+            print("Boundary distance in [" + str(strata[i]) + ", " + str(strata[i + 1]) + "): " + str(strataDropped[i])
+                  + " dropped")
+    return [getShardFilenames(filename, result[0]) for result in sorted(results, key=lambda result: result[0])]
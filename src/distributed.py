@@ -0,0 +1,67 @@
+'''
+Multi worker data parallel training for the neural entropy closures.
+Creates a MultiWorkerMirroredStrategy from TF_CONFIG or from the SLURM environment (one task per node) and
+provides the rank information used for sharding the training data and for chief only logging.
+'''
+
+### imports ###
+# python modules
+import os
+
+import tensorflow as tf
+
+
+### function definitions ###
+def createDistributionStrategy(processingMode=0, portBase=8888):
+    '''
+    Creates the strategy for multi worker training. Must be called before any other tensorflow operation.
+    The cluster is read from TF_CONFIG if set, else from SLURM (srun with one task per node). Without both, the
+    strategy runs with a single worker on the local devices.
+    input: processingMode = cpu mode (0) uses ring all-reduce, gpu mode (1) lets tensorflow choose
+           portBase = first port of the workers (SLURM only)
+    returns: strategy
+    '''
+    if processingMode == 0:
+        communication = tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING)
+    else:
+        communication = tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.AUTO)
+
+    clusterResolver = None
+    if "TF_CONFIG" not in os.environ and int(os.environ.get("SLURM_NTASKS", 1)) > 1:
+        clusterResolver = tf.distribute.cluster_resolver.SlurmClusterResolver(
+            port_base=portBase, gpus_per_node=0 if processingMode == 0 else None)
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(cluster_resolver=clusterResolver,
+                                                         communication_options=communication)
+    [numWorkers, workerIndex] = getWorkerInfo(strategy)
+    print("Distributed training: worker " + str(workerIndex) + " of " + str(numWorkers) + ", "
+          + str(strategy.num_replicas_in_sync) + " replicas in sync")
+    return strategy
+
+
+def getWorkerInfo(strategy):
+    '''
+    returns: [numWorkers, workerIndex], the chief (or worker 0 without chief) has index 0.
+             [1, 0] without strategy or cluster
+    '''
+    if strategy is None or getattr(strategy, "cluster_resolver", None) is None:
+        return [1, 0]
+    resolver = strategy.cluster_resolver
+    clusterSpec = resolver.cluster_spec().as_dict()
+    if not clusterSpec:
+        return [1, 0]
+    numChiefs = len(clusterSpec.get("chief", []))
+    numWorkers = numChiefs + len(clusterSpec.get("worker", []))
+    if resolver.task_type == "chief":
+        return [numWorkers, 0]
+    return [numWorkers, numChiefs + resolver.task_id]
+
+
+def isChief(strategy):
+    '''
+    returns: True, if this process writes checkpoints, logs and configs. Always true without strategy
+    '''
+    return getWorkerInfo(strategy)[1] == 0
+
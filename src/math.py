@@ -4,11 +4,16 @@ Author:  Steffen Schotthöfer
 Date: 16.03.21
 """
 
+import os
+from math import comb
+
 from numpy.polynomial.legendre import leggauss
 import numpy as np
 import tensorflow as tf
 import scipy
 
+from src import reductions
+
 
 class EntropyTools:
     """
@@ -25,14 +30,10 @@ class EntropyTools:
         # Create quadrature and momentBasis. Currently only for 1D problems
         self.polyDegree = N
         self.nq = 100
-        [quadPts, quadWeights] = qGaussLegendre1D(self.nq)  # dims = nq
-        self.quadPts = tf.constant(quadPts, shape=(1, self.nq), dtype=tf.float32)  # dims = (batchSIze x N x nq)
-        self.quadWeights = tf.constant(quadWeights, shape=(1, self.nq),
-                                       dtype=tf.float32)  # dims = (batchSIze x N x nq)
-        mBasis = computeMonomialBasis1D(quadPts, self.polyDegree)  # dims = (N x nq)
-        self.inputDim = mBasis.shape[0]
-        self.momentBasis = tf.constant(mBasis, shape=(self.inputDim, self.nq),
-                                       dtype=tf.float32)  # dims = (batchSIze x N x nq)
+        [quadPts, self.quadWeights, self.momentBasis] = getQuadratureBasisTF(1, self.polyDegree, self.nq,
+                                                                            dtype=tf.float32)  # shared constants
+        self.quadPts = tf.reshape(quadPts, shape=(1, self.nq))  # dims = (1 x nq)
+        self.inputDim = self.momentBasis.shape[0]
         self.opti_u = 0
         self.opti_m = 0
         self.opti_w = 0
@@ -50,8 +51,7 @@ class EntropyTools:
                w    , dims = nq
         returns alpha_complete = [alpha_0,alpha], dim = (nS x N), where alpha_0 = - ln(<exp(alpha*m)>)
         """
-        tmp = tf.math.exp(tf.tensordot(alpha, self.momentBasis[1:, :], axes=([1], [0])))  # tmp = alpha * m
-        alpha_0 = -tf.math.log(tf.tensordot(tmp, self.quadWeights, axes=([1], [1])))  # ln(<tmp>)
+        alpha_0 = reductions.reconstructAlpha0(alpha, self.momentBasis, self.quadWeights)  # log-sum-exp
         return tf.concat([alpha_0, alpha], axis=1)  # concat [alpha_0,alpha]
 
     def reconstruct_u(self, alpha):
@@ -68,9 +68,7 @@ class EntropyTools:
         returns u = <m*eta_*'(alpha*m)>, dim = (nS x N)
         """
         # Currently only for maxwell Boltzmann entropy
-        f_quad = tf.math.exp(tf.tensordot(alpha, self.momentBasis, axes=([1], [0])))  # alpha*m
-        tmp = tf.math.multiply(f_quad, self.quadWeights)  # f*w
-        return tf.tensordot(tmp, self.momentBasis[:, :], axes=([1], [1]))  # f * w * momentBasis
+        return reductions.reconstructU(alpha, self.momentBasis, self.quadWeights)  # max shifted exponentials
 
     def compute_h(self, u, alpha):
         """
@@ -88,11 +86,7 @@ class EntropyTools:
         returns h = alpha*u - <eta_*(alpha*m)>
         """
         # Currently only for maxwell Boltzmann entropy
-        f_quad = tf.math.exp(tf.tensordot(alpha, self.momentBasis, axes=([1], [0])))  # alpha*m
-        tmp = tf.tensordot(f_quad, self.quadWeights, axes=([1], [1]))  # f*w
-        # tmp2 = tf.tensordot(alpha, u, axes=([1], [1]))
-        tmp2 = tf.math.reduce_sum(tf.math.multiply(alpha, u), axis=1, keepdims=True)
-        return tmp2 - tmp
+        return reductions.computeH(u, alpha, self.momentBasis, self.quadWeights)  # log-sum-exp
 
     def convert_to_tensorf(self, vector):
         """
@@ -183,6 +177,60 @@ class EntropyTools:
         res = tf.tensordot(integrand, self.quadWeights, axes=([1], [1]))
         return res
 
+    def minimize_entropy_batch(self, u, start, tol=1e-7, maxIter=100, maxLineSearch=30):
+        """
+        brief: computes the minimal entropy for a batch of moments at once with a damped Newton method (tensorflow
+               version of minimizeEntropyNewtonBatch). Converged samples are masked out of further updates.
+        input: u = dims (nS,N)
+               start = start value of alpha, dims (nS,N)
+        returns: [alpha, h, converged], dims (nS,N), (nS,1), (nS,)
+                 h = <eta_*(alpha*m)> - alpha*u, the minimized dual objective. This is the negative of the entropy
+                 h = alpha*u - <eta_*(alpha*m)> of the neural closures
+        """
+        m = tf.cast(self.momentBasis, dtype=tf.float64)
+        w = tf.cast(self.quadWeights, dtype=tf.float64)
+        u = tf.cast(u, dtype=tf.float64)
+        alpha = tf.cast(start, dtype=tf.float64)
+
+        def dualObjective(alpha):
+            f_w = tf.math.multiply(tf.math.exp(tf.tensordot(alpha, m, axes=([1], [0]))), w)  # f*w, dims = (nS x nq)
+            return [tf.reduce_sum(f_w, axis=1) - tf.reduce_sum(alpha * u, axis=1), f_w]
+
+        [objective, f_w] = dualObjective(alpha)
+        converged = tf.zeros(u.shape[0], dtype=tf.bool)
+        singular = tf.zeros(u.shape[0], dtype=tf.bool)
+        for i in range(maxIter + 1):
+            grad = tf.tensordot(f_w, m, axes=([1], [1])) - u  # <m f> - u
+            converged = tf.norm(grad, axis=1) < tol
+            if tf.reduce_all(tf.logical_or(converged, singular)) or i == maxIter:
+                break
+            hessian = tf.einsum('sq,nq,kq->snk', f_w, m, m)  # <m m^T f>
+            # samples with a numerically singular Hessian (moments at or outside the realizable set of the
+            # quadrature) are frozen unconverged
+            finite = tf.reduce_all(tf.math.is_finite(hessian), axis=[1, 2])
+            hessian = tf.where(finite[:, tf.newaxis, tf.newaxis], hessian, tf.eye(m.shape[0], dtype=tf.float64))
+            singularValues = tf.linalg.svd(hessian, compute_uv=False)
+            regular = tf.logical_and(finite, singularValues[:, 0] < 1e14 * singularValues[:, -1])
+            singular = tf.logical_or(singular, tf.logical_and(tf.logical_not(converged), tf.logical_not(regular)))
+            hessian = tf.where(regular[:, tf.newaxis, tf.newaxis], hessian, tf.eye(m.shape[0], dtype=tf.float64))
+            direction = -tf.linalg.solve(hessian, grad[:, :, tf.newaxis])[:, :, 0]
+            direction = tf.where(tf.logical_or(converged, singular)[:, tf.newaxis], tf.zeros_like(direction),
+                                 direction)
+            slope = tf.reduce_sum(grad * direction, axis=1)
+
+            # backtracking line search (Armijo), per sample
+            stepSize = tf.ones_like(objective)
+            for j in range(maxLineSearch):
+                [objectiveNew, f_wNew] = dualObjective(alpha + stepSize[:, tf.newaxis] * direction)
+                accepted = objectiveNew <= objective + 1e-4 * stepSize * slope
+                if tf.reduce_all(accepted):
+                    break
+                stepSize = tf.where(accepted, stepSize, 0.5 * stepSize)
+            alpha = alpha + stepSize[:, tf.newaxis] * direction
+            [objective, f_w] = dualObjective(alpha)
+
+        return [alpha, objective[:, tf.newaxis], converged]
+
     ### Standalone features
 
 
@@ -197,49 +245,150 @@ def qGaussLegendre1D(order):
     return leggauss(order)
 
 
+def qGaussLegendreSphere(order):
+    """
+    brief: product quadrature on the unit sphere. Gauss Legendre in mu = cos(theta) (order points) times
+           uniform azimuth phi (2*order points). Points are ordered with mu outer and phi inner.
+    params: order = order of the Gauss Legendre quadrature in mu
+    returns: [mu, phi, weights], dims = nq, nq, nq with nq = 2 * order * order. The weights sum up to 4*pi
+    """
+    [muGauss, weightsGauss] = leggauss(order)
+    phiUniform = np.pi * (np.arange(2 * order) + 0.5) / order
+    mu = np.repeat(muGauss, 2 * order)
+    phi = np.tile(phiUniform, order)
+    weights = np.repeat(weightsGauss * np.pi / order, 2 * order)  # sum = 2 * 2 * order * pi / order = 4 * pi
+    return [mu, phi, weights]
+
+
 def qGaussLegendre2D(Qorder):
     """
+       brief: spherical product quadrature projected to the x-y plane
        order: order of quadrature, uses all quadpts... inefficient
        returns: [pts, weights] : quadrature points and weights, dim(pts) = nq x 2
     """
+    [mu, phi, weights] = qGaussLegendreSphere(Qorder)
+    sinTheta = np.sqrt(1 - mu ** 2)
+    pts = np.stack([sinTheta * np.cos(phi), sinTheta * np.sin(phi)], axis=1)
+    return [pts, weights]
 
-    def computequadpoints(order):
-        """Quadrature points for GaussLegendre quadrature. Read from file."""
-        mu, _ = leggauss(order)
-        phi = [np.pi * (k + 1 / 2) / order for k in range(2 * order)]
-        xy = np.zeros((2 * order * order, 2))
-        count = 0
-        for i in range(order):
-            for j in range(2 * order):
-                mui = mu[i]
-                phij = phi[j]
-                xy[count, 0] = np.sqrt(1 - mui ** 2) * np.cos(phij)
-                xy[count, 1] = np.sqrt(1 - mui ** 2) * np.sin(phij)
-                # xyz[count, 2] = mui
-                count += 1
-
-        return xy
-
-    def computequadweights(order):
-        """Quadrature weights for GaussLegendre quadrature. Read from file."""
-        _, leggaussweights = leggauss(order)
-        w = np.zeros(2 * order * order)
-        count = 0
-        for i in range(order):
-            for j in range(2 * order):
-                w[count] = 2 * np.pi / order * leggaussweights[i]
-                count += 1
-
-        w /= sum(w)
-        w *= 4 * np.pi
-        return w
-
-    pts = computequadpoints(Qorder)
-    weights = computequadweights(Qorder)
 
+def qGaussLegendre3D(Qorder):
+    """
+       brief: spherical product quadrature
+       order: order of quadrature
+       returns: [pts, weights] : quadrature points and weights, dim(pts) = nq x 3
+    """
+    [mu, phi, weights] = qGaussLegendreSphere(Qorder)
+    sinTheta = np.sqrt(1 - mu ** 2)
+    pts = np.stack([sinTheta * np.cos(phi), sinTheta * np.sin(phi), mu], axis=1)
     return [pts, weights]
 
 
+### Quadrature and basis registry
+# process wide cache of quadratures and moment bases, shared by all models and solvers of a process.
+# key = (spatialDim, polyDegree, quadOrder, dtype name)
+_quadratureRegistry = {}
+_quadratureRegistryTF = {}
+# quadratures with at least this many points are additionally cached on disk
+quadratureDiskCacheSize = 5000
+quadratureCacheFolder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data",
+                                     "quadrature")
+
+
+def computeQuadratureBasis(spatialDim, polyDegree, quadOrder):
+    """
+    brief: computes the quadrature and the monomial basis in float64
+    params: spatialDim = spatial dimension (1, 2 or 3)
+            polyDegree = maximum degree of the basis
+            quadOrder = order of the quadrature
+    returns: [quadPts, quadWeights, mBasis], dims = nq (1D) or (nq x spatialDim), nq, (N x nq)
+    """
+    if spatialDim == 1:
+        [quadPts, quadWeights] = qGaussLegendre1D(quadOrder)
+    elif spatialDim == 2:
+        [quadPts, quadWeights] = qGaussLegendre2D(quadOrder)
+    elif spatialDim == 3:
+        [quadPts, quadWeights] = qGaussLegendre3D(quadOrder)
+    else:
+        raise ValueError("No quadrature available for spatial dimension " + str(spatialDim))
+    mBasis = computeMonomialBasis(quadPts, polyDegree, spatialDim)
+    return [quadPts, quadWeights, mBasis]
+
+
+def getQuadratureBasis(spatialDim, polyDegree, quadOrder, dtype=np.float64):
+    """
+    brief: returns the quadrature and the monomial basis from the process wide registry. They are computed once
+           per key (or loaded from the disk cache for large orders). The arrays are read only and shared by all
+           callers, copy them before modifying.
+    params: spatialDim = spatial dimension (1, 2 or 3)
+            polyDegree = maximum degree of the basis
+            quadOrder = order of the quadrature
+            dtype = numpy dtype of the arrays
+    returns: [quadPts, quadWeights, mBasis], dims = nq (1D) or (nq x spatialDim), nq, (N x nq)
+    """
+    key = (spatialDim, polyDegree, quadOrder, np.dtype(dtype).name)
+    if key in _quadratureRegistry:
+        return _quadratureRegistry[key]
+
+    keyDouble = (spatialDim, polyDegree, quadOrder, np.dtype(np.float64).name)
+    if keyDouble in _quadratureRegistry:
+        arrays = _quadratureRegistry[keyDouble]
+    else:
+        arrays = loadQuadratureBasis(spatialDim, polyDegree, quadOrder)
+    arrays = [np.array(array, dtype=dtype) for array in arrays]
+    for array in arrays:
+        array.setflags(write=False)
+    _quadratureRegistry[key] = arrays
+    return arrays
+
+
+def getQuadratureBasisTF(spatialDim, polyDegree, quadOrder, dtype=tf.float64):
+    """
+    brief: tensorflow constants of the registry quadrature, in the layout of the sobolev models
+    params: spatialDim = spatial dimension (1, 2 or 3)
+            polyDegree = maximum degree of the basis
+            quadOrder = order of the quadrature
+            dtype = tensorflow dtype of the constants
+    returns: [quadPts, quadWeights, mBasis], dims = (nq x spatialDim), (1 x nq), (N x nq)
+    """
+    key = (spatialDim, polyDegree, quadOrder, tf.as_dtype(dtype).name)
+    if key not in _quadratureRegistryTF:
+        [quadPts, quadWeights, mBasis] = getQuadratureBasis(spatialDim, polyDegree, quadOrder)
+        nq = quadWeights.size
+        _quadratureRegistryTF[key] = [tf.constant(quadPts, shape=(nq, spatialDim), dtype=dtype),
+                                      tf.constant(quadWeights, shape=(1, nq), dtype=dtype),
+                                      tf.constant(mBasis, shape=mBasis.shape, dtype=dtype)]
+    return _quadratureRegistryTF[key]
+
+
+def loadQuadratureBasis(spatialDim, polyDegree, quadOrder):
+    """
+    brief: computes the float64 quadrature and basis. Quadratures with at least quadratureDiskCacheSize points are
+           read from (or written to) quadratureCacheFolder
+    returns: [quadPts, quadWeights, mBasis]
+    """
+    nq = quadOrder if spatialDim == 1 else 2 * quadOrder * quadOrder
+    if nq < quadratureDiskCacheSize:
+        return computeQuadratureBasis(spatialDim, polyDegree, quadOrder)
+
+    filename = os.path.join(quadratureCacheFolder,
+                            "quad_" + str(spatialDim) + "D_deg" + str(polyDegree) + "_order" + str(quadOrder) + ".npz")
+    if os.path.isfile(filename):
+        cache = np.load(filename)
+        return [cache["quadPts"], cache["quadWeights"], cache["mBasis"]]
+
+    [quadPts, quadWeights, mBasis] = computeQuadratureBasis(spatialDim, polyDegree, quadOrder)
+    try:
+        os.makedirs(quadratureCacheFolder, exist_ok=True)
+        # write to a temporary file first, so concurrent processes never read a partial cache file
+        tmpFilename = filename[:-4] + "_" + str(os.getpid()) + ".tmp.npz"
+        np.savez(tmpFilename, quadPts=quadPts, quadWeights=quadWeights, mBasis=mBasis)
+        os.replace(tmpFilename, filename)
+    except OSError:
+        print("Could not write the quadrature cache " + filename)
+    return [quadPts, quadWeights, mBasis]
+
+
 def integrate(integrand, weights):
     """
     params: weights = quadweights vector (at quadpoints) (dim = nq)
@@ -321,42 +470,169 @@ def reconstructUSingleCell(alpha, m, w):
     return integrate(res, w)
 
 
+def minimizeEntropyNewtonBatch(u, alphaStart, m, w, tol=1e-7, maxIter=100, maxLineSearch=30):
+    """
+    brief: solves the dual minimal entropy problem min_alpha <eta_*(alpha*m)> - alpha*u for a batch of moments at once
+           with Newton's method, the analytic Hessian <m m^T eta_*''(alpha*m)> and a backtracking line search.
+           Converged samples and samples with a singular Hessian are removed from the active set. Only for maxwell
+           Boltzmann entropy so far.
+    input: u, dims = (nS x N)
+           alphaStart = start value of alpha, dims = (nS x N)
+           m    , dims = (N x nq)
+           w    , dims = nq
+    returns: [alpha, h, converged], where
+             alpha, dims = (nS x N)
+             h = <eta_*(alpha*m)> - alpha*u, the minimized dual objective, dims = nS. This is the negative of the
+                 entropy h = alpha*u - <eta_*(alpha*m)> of the neural closures, callers comparing with a network
+                 (e.g. hybridClosure) negate it
+             converged = mask of samples with |<m eta_*'(alpha*m)> - u| < tol, dims = nS
+    """
+    alpha = np.array(alphaStart, dtype=float, copy=True)
+    converged = np.zeros(u.shape[0], dtype=bool)
+
+    def dualObjective(alpha_a, u_a):
+        f_w = entropyDual(np.matmul(alpha_a, m)) * w  # f*w, dims = (nA x nq)
+        return [f_w.sum(axis=1) - np.sum(alpha_a * u_a, axis=1), f_w]
+
+    active = np.arange(u.shape[0])
+    for i in range(maxIter + 1):
+        u_a = u[active]
+        alpha_a = alpha[active]
+        [objective, f_w] = dualObjective(alpha_a, u_a)
+        grad = np.matmul(f_w, m.T) - u_a  # <m f> - u
+
+        # per cell convergence mask
+        done = np.linalg.norm(grad, axis=1) < tol
+        converged[active[done]] = True
+        keep = np.logical_not(done)
+        active = active[keep]
+        if active.size == 0 or i == maxIter:
+            break
+        [u_a, alpha_a, objective, f_w, grad] = [u_a[keep], alpha_a[keep], objective[keep], f_w[keep], grad[keep]]
+
+        hessian = np.einsum('sq,nq,kq->snk', f_w, m, m)  # <m m^T f>
+        # cells with a numerically singular Hessian (moments at or outside the realizable set of the quadrature)
+        # leave the active set unconverged
+        regular = np.isfinite(hessian).all(axis=(1, 2))
+        regular[regular] = np.linalg.cond(hessian[regular]) < 1e14
+        if not regular.all():
+            active = active[regular]
+            if active.size == 0:
+                break
+            [u_a, alpha_a, objective, hessian, grad] = [u_a[regular], alpha_a[regular], objective[regular],
+                                                        hessian[regular], grad[regular]]
+        direction = -np.linalg.solve(hessian, grad[:, :, np.newaxis])[:, :, 0]
+        slope = np.sum(grad * direction, axis=1)
+
+        # backtracking line search (Armijo), per cell
+        stepSize = np.ones(active.size)
+        for j in range(maxLineSearch):
+            [objectiveNew, _] = dualObjective(alpha_a + stepSize[:, np.newaxis] * direction, u_a)
+            accepted = objectiveNew <= objective + 1e-4 * stepSize * slope
+            if accepted.all():
+                break
+            stepSize[np.logical_not(accepted)] *= 0.5
+        alpha[active] = alpha_a + stepSize[:, np.newaxis] * direction
+
+    [h, _] = dualObjective(alpha, u)
+    return [alpha, h, converged]
+
+
+def reconstructScaledFused(u_non_normal, alpha_reduced, mBasis, quadWeights, dtype=tf.float64,
+                           accumulationDtype=None, chunkSize=None):
+    """
+    brief: fused post processing of the normalized closures (tensorflow). The quadrature exponentials are evaluated
+           once per sample, and alpha_0, u, the upscaled alpha and h are derived from this single evaluation.
+           The exponentials are shifted by their maximum s over the quadrature points (log-sum-exp), so the float32
+           path neither overflows nor underflows. Only for maxwell Boltzmann entropy.
+           With alpha_r = [alpha_1,...,alpha_N] and E = <m exp(alpha_r*m_r - s)>:
+           alpha_0 = ln(u_0) - ln(E_0) - s, u = u_0 * E / E_0, h = alpha*u - u_0
+    input: u_non_normal, dims = (nS x N)
+           alpha_reduced = predicted [alpha_1,...,alpha_N] of the normalized moments, dims = (nS x N-1)
+           mBasis, dims = (N x nq)
+           quadWeights, dims = (1 x nq)
+           dtype = dtype of the exponentials
+           accumulationDtype = dtype of the quadrature sums and the outputs (e.g. tf.float64). Default: dtype
+           chunkSize = quadrature points per chunk, see reductions.shiftedReduction
+    returns: [u, alpha, h], dims = (nS x N), (nS x N), (nS x 1)
+    """
+    if accumulationDtype is None:
+        accumulationDtype = dtype
+    alpha_reduced = tf.cast(alpha_reduced, dtype=dtype)
+    mBasis = tf.cast(mBasis, dtype=dtype)
+
+    # the only pass over the quadrature: E = <m exp(alpha_r*m_r - s)>
+    [moments, shift] = reductions.shiftedReduction(alpha_reduced, mBasis[1:, :], quadWeights, mBasis, chunkSize,
+                                                   accumulationDtype)
+
+    u_0 = tf.cast(u_non_normal[:, 0:1], dtype=accumulationDtype)
+    scaling = u_0 / moments[:, 0:1]  # u_0 / E_0
+    u = moments * scaling  # reconstructed and upscaled u, the shift cancels
+    alpha_0 = tf.math.log(scaling) - shift
+    alpha = tf.concat([alpha_0, tf.cast(alpha_reduced, dtype=accumulationDtype)], axis=1)
+    h = tf.math.reduce_sum(alpha * u, axis=1, keepdims=True) - u_0  # <exp(alpha*m)> = u_0
+    return [u, alpha, h]
+
+
 ### Basis Computation
+def getMonomialExponents(polyDegree, spatialDim):
+    """
+    brief: multi indices of the monomial basis. Ordered by total degree, within one degree by descending exponents
+           of the leading coordinates, e.g. 2D degree 2: 1, x, y, x^2, xy, y^2
+    params: polyDegree = maximum total degree of the basis
+            spatialDim = spatial dimension of the basis
+    returns: exponents, dims = (N x spatialDim), N = getBasisSize(polyDegree, spatialDim)
+    """
+
+    def degreeExponents(degree, dim):
+        # all exponents of dim coordinates with sum = degree, in descending order of the first exponent
+        if dim == 1:
+            return [[degree]]
+        return [[first] + rest for first in range(degree, -1, -1) for rest in degreeExponents(degree - first, dim - 1)]
+
+    exponents = [exponent for degree in range(0, polyDegree + 1) for exponent in degreeExponents(degree, spatialDim)]
+    return np.array(exponents, dtype=int).reshape((-1, spatialDim))
+
+
+def computeMonomialBasis(quadPts, polyDegree, spatialDim):
+    """
+    brief: monomial basis of arbitrary total degree in 1D, 2D or 3D, ordered as in getMonomialExponents
+    params: quadPts = quadrature points to evaluate, dims = nq (1D) or (nq x spatialDim)
+            polyDegree = maximum degree of the basis
+            spatialDim = spatial dimension of the basis
+    return: monomial basis evaluated at quadrature points, dims = (N x nq)
+    """
+    quadPts = np.reshape(quadPts, (-1, spatialDim))
+    exponents = getMonomialExponents(polyDegree, spatialDim)
+    # prod_d v_d^k_d, dims = (N x nq x spatialDim) -> (N x nq)
+    return np.prod(np.power(quadPts[np.newaxis, :, :], exponents[:, np.newaxis, :]), axis=2)
+
+
 def computeMonomialBasis1D(quadPts, polyDegree):
     """
     params: quadPts = quadrature points to evaluate
             polyDegree = maximum degree of the basis
     return: monomial basis evaluated at quadrature points
     """
-    basisLen = getBasisSize(polyDegree, 1)
-    nq = quadPts.shape[0]
-    monomialBasis = np.zeros((basisLen, nq))
-
-    for idx_quad in range(0, nq):
-        for idx_degree in range(0, polyDegree + 1):
-            monomialBasis[idx_degree, idx_quad] = np.power(quadPts[idx_quad], idx_degree)
-    return monomialBasis
+    return computeMonomialBasis(quadPts, polyDegree, 1)
 
 
 def computeMonomialBasis2D(quadPts, polyDegree):
     """
-    brief: hardcoded for polyDegree 1 right now ! # TODO
-    params: quadPts = quadrature points to evaluate
+    params: quadPts = quadrature points to evaluate, dims = (nq x 2)
             polyDegree = maximum degree of the basis
     return: monomial basis evaluated at quadrature points
     """
-    basisLen = getBasisSize(polyDegree, 2)
-    nq = quadPts.shape[0]
-    monomialBasis = np.zeros((basisLen, nq))
+    return computeMonomialBasis(quadPts, polyDegree, 2)
 
-    for idx_quad in range(0, nq):
-        # Hardcoded for degree 1
-        monomialBasis[0, idx_quad] = 1.0
-        monomialBasis[1, idx_quad] = quadPts[idx_quad, 0]
-        monomialBasis[2, idx_quad] = quadPts[idx_quad, 1]
-    # for idx_degree in range(0, polyDegree + 1):
-    #    monomialBasis[idx_degree, idx_quad] = np.power(quadPts[idx_quad], idx_degree)
-    return monomialBasis
+
+def computeMonomialBasis3D(quadPts, polyDegree):
+    """
+    params: quadPts = quadrature points to evaluate, dims = (nq x 3)
+            polyDegree = maximum degree of the basis
+    return: monomial basis evaluated at quadrature points
+    """
+    return computeMonomialBasis(quadPts, polyDegree, 3)
 
 
 def getBasisSize(polyDegree, spatialDim):
@@ -379,5 +655,4 @@ def getCurrDegreeSize(currDegree, spatialDim):
     """
     Computes the number of polynomials of the current spatial dimension
     """
-    return np.math.factorial(currDegree + spatialDim - 1) / (
-            np.math.factorial(currDegree) * np.math.factorial(spatialDim - 1))
+    return comb(currDegree + spatialDim - 1, spatialDim - 1)
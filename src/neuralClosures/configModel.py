@@ -19,15 +19,28 @@ from .neuralMK10 import neuralMK10
 from .neuralMK11 import neuralMK11
 from .neuralMK12 import neuralMK12
 from .neuralMK13 import neuralMK13
+from .neuralMK14 import neuralMK14
 
 
 ### global functions ###
 def initNeuralClosure(modelNumber=1, polyDegree=0, spatialDim=3, folderName="testFolder", lossCombi=0, width=10,
-                      depth=5, normalized=False):
+                      depth=5, normalized=False, precision=1, strategy=None):
     '''
     modelNumber : Defines the used network model, i.e. MK1, MK2...
     maxDegree_N : Defines the maximal Degree of the moment basis, i.e. the "N" of "M_N"
+    precision : precision policy of the sobolev closures MK11, MK13 and MK14. 0 = float32, 1 = mixed (float32
+                network, float64 quadrature reconstruction), 2 = float64
+    strategy : distribution strategy of multi worker training. The model is created in its scope
     '''
+    if strategy is not None:
+        # variables and optimizer slots are mirrored over all replicas
+        with strategy.scope():
+            neuralClosureModel = initNeuralClosure(modelNumber=modelNumber, polyDegree=polyDegree,
+                                                   spatialDim=spatialDim, folderName=folderName, lossCombi=lossCombi,
+                                                   width=width, depth=depth, normalized=normalized,
+                                                   precision=precision)
+        neuralClosureModel.strategy = strategy
+        return neuralClosureModel
 
     # Catch obvious errors
     if (polyDegree < 0):
@@ -75,13 +88,19 @@ def initNeuralClosure(modelNumber=1, polyDegree=0, spatialDim=3, folderName="tes
                                         lossCombi=lossCombi, width=width, depth=depth, normalized=normalized)
     elif (modelNumber == 11):
         neuralClosureModel = neuralMK11(polyDegree=polyDegree, spatialDim=spatialDim, folderName=folderName,
-                                        lossCombi=lossCombi, width=width, depth=depth, normalized=normalized)
+                                        lossCombi=lossCombi, width=width, depth=depth, normalized=normalized,
+                                        precision=precision)
     elif (modelNumber == 12):
         neuralClosureModel = neuralMK12(polyDegree=polyDegree, spatialDim=spatialDim, folderName=folderName,
                                         lossCombi=lossCombi, width=width, depth=depth, normalized=normalized)
     elif (modelNumber == 13):
         neuralClosureModel = neuralMK13(polyDegree=polyDegree, spatialDim=spatialDim, folderName=folderName,
-                                        lossCombi=lossCombi, width=width, depth=depth, normalized=normalized)
+                                        lossCombi=lossCombi, width=width, depth=depth, normalized=normalized,
+                                        precision=precision)
+    elif (modelNumber == 14):
+        neuralClosureModel = neuralMK14(polyDegree=polyDegree, spatialDim=spatialDim, folderName=folderName,
+                                        lossCombi=lossCombi, width=width, depth=depth, normalized=normalized,
+                                        precision=precision)
     else:
         ValueError("No network fits your preferences!")
 
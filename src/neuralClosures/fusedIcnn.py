@@ -0,0 +1,102 @@
+'''
+Fused ICNN core for the sobolev closures (MK11, MK13, MK14).
+Drop-in replacement of the functional "Icnn_closure" core model, that computes the entropy h and its input
+gradient alpha = dh/du in one pass. The backward recurrence through the convex layers uses
+softplus' = sigmoid of the stored pre-activations, instead of a GradientTape around the core model.
+'''
+
+### imports ###
+# python modules
+import tensorflow as tf
+from tensorflow.keras import layers
+
+
+### class definitions ###
+class fusedIcnn(tf.keras.Model):
+
+    def __init__(self, layerConfigs, outputLayerNames, **opts):
+        """
+        input: layerConfigs = configs of the dense layers of the functional core model, in the order of its layers
+                              (keeps the weight order, so .h5 weights of the functional core load into this core)
+               outputLayerNames = [z component, x component] names of the dense layers of the output convex layer,
+                                  see getOutputLayerNames
+        """
+        super(fusedIcnn, self).__init__(**opts)
+        self.coreLayers = []
+        for config in layerConfigs:
+            config = dict(config)
+            if config["name"] == "first_dense":
+                config["activation"] = "linear"  # softplus is applied in call, the pre-activation is needed
+            self.coreLayers.append(layers.Dense.from_config(config))
+
+        # sort layers by their role in the icnn
+        layerDict = {layer.name: layer for layer in self.coreLayers}
+        self.firstLayer = layerDict["first_dense"]
+        layerIdxs = sorted(int(name.rsplit('_', 1)[1]) for name in layerDict if name.startswith("non_neg_component_"))
+        self.nonNegLayers = [layerDict["non_neg_component_" + str(idx)] for idx in layerIdxs]
+        self.denseLayers = [layerDict["dense_component_" + str(idx)] for idx in layerIdxs]
+        self.outputLayer_z = layerDict[outputLayerNames[0]]
+        self.outputLayer_x = layerDict[outputLayerNames[1]]
+
+    @classmethod
+    def fromCore(cls, coreModel):
+        """
+        brief: creates a fused core with the layer configs and the weights of a functional icnn core model
+        """
+        denseLayers = [layer for layer in coreModel.layers if isinstance(layer, layers.Dense)]
+        fusedCore = cls([layer.get_config() for layer in denseLayers], cls.getOutputLayerNames(coreModel),
+                        name=coreModel.name)
+        fusedCore(tf.zeros((1,) + tuple(coreModel.input_shape[1:])))  # build
+        for layer, fusedLayer in zip(denseLayers, fusedCore.coreLayers):
+            fusedLayer.set_weights(layer.get_weights())
+        return fusedCore
+
+    @staticmethod
+    def getOutputLayerNames(coreModel):
+        """
+        brief: finds the dense layers of the output convex layer in the graph of a functional icnn core model. They
+               are the inputs of the final Add layer. The x component is applied to the network input, the z
+               component to the last hidden layer
+        returns: [name of the z component, name of the x component]
+        """
+        outputAdd = coreModel.get_layer(coreModel.output_names[0])
+        outputDense = outputAdd.inbound_nodes[0].inbound_layers
+        inputLayers = [layer.inbound_nodes[0].inbound_layers for layer in outputDense]
+        outputLayer_x = [layer for layer, inbound in zip(outputDense, inputLayers)
+                         if isinstance(inbound, layers.InputLayer)]
+        outputLayer_z = [layer for layer in outputDense if layer not in outputLayer_x]
+        if len(outputDense) != 2 or len(outputLayer_x) != 1:
+            raise ValueError("Core model " + coreModel.name + " does not end with an icnn output layer.")
+        return [outputLayer_z[0].name, outputLayer_x[0].name]
+
+    def call(self, x, training=False):
+        z = tf.math.softplus(self.firstLayer(x))
+        for nonNegLayer, denseLayer in zip(self.nonNegLayers, self.denseLayers):
+            z = tf.math.softplus(nonNegLayer(z) + denseLayer(x))
+        return self.outputLayer_z(z) + self.outputLayer_x(x)
+
+    def call_with_derivative(self, x, training=False):
+        """
+        brief: evaluates the icnn and its input gradient
+        input: x = [u_1,...,u_N], dims = (nS x N)
+        returns: [h, alpha], where h, dims = (nS x 1), alpha = dh/dx, dims = (nS x N)
+        """
+        # forward pass, keep softplus'(pre-activation) = sigmoid(pre-activation) for the backward pass
+        preActivation = self.firstLayer(x)
+        z = tf.math.softplus(preActivation)
+        derivatives = [tf.math.sigmoid(preActivation)]
+        for nonNegLayer, denseLayer in zip(self.nonNegLayers, self.denseLayers):
+            preActivation = nonNegLayer(z) + denseLayer(x)
+            z = tf.math.softplus(preActivation)
+            derivatives.append(tf.math.sigmoid(preActivation))
+        h = self.outputLayer_z(z) + self.outputLayer_x(x)
+
+        # backward pass, dh/dz_last = W_out_z
+        alpha = tf.transpose(self.outputLayer_x.kernel)  # dims = (1 x N), broadcast over the batch
+        grad_z = tf.transpose(self.outputLayer_z.kernel)
+        for idx in reversed(range(len(self.nonNegLayers))):
+            grad_pre = grad_z * derivatives[idx + 1]
+            alpha = alpha + tf.matmul(grad_pre, self.denseLayers[idx].kernel, transpose_b=True)
+            grad_z = tf.matmul(grad_pre, self.nonNegLayers[idx].kernel, transpose_b=True)
+        alpha = alpha + tf.matmul(grad_z * derivatives[0], self.firstLayer.kernel, transpose_b=True)
+        return [h, alpha]
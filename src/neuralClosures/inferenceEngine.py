@@ -0,0 +1,97 @@
+'''
+Compiled inference engine for the neural entropy closures.
+Traces a closure (e.g. call_scaled_64) once per (batch bucket, dtype) into a tf.function and keeps the
+traced graphs in a bounded LRU cache. Batches are padded up to the bucket size, so repeated solver steps
+never retrace or fall back to eager execution.
+'''
+
+### imports ###
+# python modules
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+
+### class definitions ###
+class inferenceEngine:
+
+    def __init__(self, neuralClosure, closureName="call_scaled_64", minBucketSize=64, maxBucketSize=2 ** 20,
+                 maxCacheSize=8):
+        """
+        input: neuralClosure = initialized neuralBase derived closure (e.g. neuralMK11)
+               closureName = name of the closure method to compile, i.e. callNetwork, call_scaled, call_scaled_64
+               minBucketSize = smallest batch bucket. Buckets are powers of two >= minBucketSize
+               maxBucketSize = largest batch bucket. Bigger batches are processed in chunks of this size
+               maxCacheSize = maximal number of traced graphs kept in memory
+        """
+        self.neuralClosure = neuralClosure
+        self.closureName = closureName
+        self.closure = getattr(neuralClosure, closureName)
+        self.minBucketSize = minBucketSize
+        self.maxBucketSize = maxBucketSize
+        self.maxCacheSize = maxCacheSize
+
+        self.graphCache = OrderedDict()  # key = (bucketSize, dtype, inputDim)
+        self.traceCount = 0
+
+    def __call__(self, u, dtype=tf.float32):
+        return self.call(u, dtype)
+
+    def call(self, u, dtype=tf.float32):
+        """
+        brief: evaluates the compiled closure on a batch of moments
+        input: u, dims = (nS x inputDim)
+               dtype = dtype of the traced input signature
+        returns: outputs of the closure, each sliced to the original batch size nS
+        """
+        u = np.asarray(u, dtype=dtype.as_numpy_dtype)
+        nS = u.shape[0]
+
+        if nS <= self.maxBucketSize:
+            return self.callBucket(u, dtype)
+
+        # split very large batches in chunks of the largest bucket
+        chunkOutputs = [self.callBucket(u[start:start + self.maxBucketSize], dtype) for start in
+                        range(0, nS, self.maxBucketSize)]
+        return [tf.concat(list(outputs), axis=0) for outputs in zip(*chunkOutputs)]
+
+    def callBucket(self, u, dtype):
+        nS = u.shape[0]
+        bucketSize = self.getBucketSize(nS)
+        graph = self.getGraph(bucketSize, dtype, u.shape[1])
+
+        # pad with copies of the last moment, so the padded rows stay realizable (u_0 > 0)
+        if bucketSize > nS:
+            u = np.concatenate([u, np.repeat(u[-1:], bucketSize - nS, axis=0)], axis=0)
+
+        outputs = graph(tf.constant(u, dtype=dtype))
+        return [output[:nS] for output in outputs]
+
+    def getBucketSize(self, nS):
+        """
+        returns: smallest power of two >= max(nS, minBucketSize), capped at maxBucketSize
+        """
+        bucketSize = self.minBucketSize
+        while bucketSize < nS:
+            bucketSize = 2 * bucketSize
+        return min(bucketSize, self.maxBucketSize)
+
+    def getGraph(self, bucketSize, dtype, inputDim):
+        """
+        returns: traced tf.function for the given bucket. Least recently used graphs are evicted.
+        """
+        key = (bucketSize, dtype.name, inputDim)
+        if key in self.graphCache:
+            self.graphCache.move_to_end(key)
+            return self.graphCache[key]
+
+        def tracedClosure(u):
+            self.traceCount += 1  # only executed while tracing
+            return self.closure(u)
+
+        graph = tf.function(tracedClosure, input_signature=[tf.TensorSpec(shape=[bucketSize, inputDim], dtype=dtype)])
+        self.graphCache[key] = graph
+        if len(self.graphCache) > self.maxCacheSize:
+            self.graphCache.popitem(last=False)
+        return graph
@@ -10,17 +10,31 @@ Date 29.10.2020
 import tensorflow as tf
 import numpy as np
 import pandas as pd
+import contextlib
+import json
+import os
 from os import path, makedirs, walk
+import shutil
+import tempfile
 import time
 
 # intern modules
+from src import distributed
+from src import math
 from src import utils
+from src.neuralClosures.fusedIcnn import fusedIcnn
+
+
+# precision policies: [network dtype, dtype of the quadrature reconstruction in the sobolev wrapper]
+precisionPolicies = {0: [tf.float32, tf.float32],
+                     1: [tf.float32, tf.float64],
+                     2: [tf.float64, tf.float64]}
 
 
 ### class definitions ###
 class neuralBase:
 
-    def __init__(self, normalized, polyDegree, spatialDim, width, depth, lossCombi, customFolderName):
+    def __init__(self, normalized, polyDegree, spatialDim, width, depth, lossCombi, customFolderName, precision=1):
         self.normalized = normalized
         self.polyDegree = polyDegree
         self.spatialDim = spatialDim
@@ -29,6 +43,10 @@ class neuralBase:
         self.optimizer = 'adam'
         self.filename = "models/" + customFolderName
         self.history = []
+        self.trainingDataShards = None  # set by loadTrainingDataStreaming
+        self.trainingIndices = None  # sample order of the in-memory data, set by setTrainingData with shuffleMode
+        self.strategy = None  # distribution strategy of multi worker training, set by initNeuralClosure
+        self.trainingTargetLayout = None  # outputs of multi output models, see trainingTargets
 
         # --- Determine loss combination ---
         if lossCombi == 0:
@@ -43,33 +61,39 @@ class neuralBase:
             self.lossWeights = [1, 0, 0, 0]
 
         # --- Determine inputDim by MaxDegree ---
-        if (spatialDim == 1):
-            self.inputDim = polyDegree + 1
-        elif (spatialDim == 3):
-            if (self.polyDegree == 0):
-                self.inputDim = 1
-            elif (self.polyDegree == 1):
-                self.inputDim = 4
-            else:
-                raise ValueError("Polynomial degeree higher than 1 not supported atm")
-        elif (spatialDim == 2):
-            if (self.polyDegree == 0):
-                self.inputDim = 1
-            elif (self.polyDegree == 1):
-                self.inputDim = 3
-            else:
-                raise ValueError("Polynomial degeree higher than 1 not supported atm")
-        else:
+        if spatialDim not in [1, 2, 3]:
             raise ValueError("Saptial dimension other than 1,2 or 3 not supported atm")
+        self.inputDim = math.getBasisSize(polyDegree, spatialDim)
 
         self.csvInputDim = self.inputDim  # only for reading csv data
 
+        # --- Precision policy ---
+        # 0 = float32, 1 = mixed (float32 network, float64 quadrature reconstruction), 2 = float64
+        # floatx is only set while the model is created, see networkFloatx
+        if precision not in precisionPolicies:
+            raise ValueError("Precision policy must be 0 (float32), 1 (mixed) or 2 (float64)")
+        self.precision = precision
+        [self.networkDtype, self.reconstructionDtype] = precisionPolicies[precision]
+
         if normalized:
             self.inputDim = self.inputDim - 1
 
     def createModel(self):
         pass
 
+    @contextlib.contextmanager
+    def networkFloatx(self):
+        '''
+        Sets floatx to the network dtype of the precision policy while the layers of this model are created and
+        restores it afterwards, so models created later in the same process keep their own precision
+        '''
+        previousFloatx = tf.keras.backend.floatx()
+        tf.keras.backend.set_floatx(self.networkDtype.name)
+        try:
+            yield
+        finally:
+            tf.keras.backend.set_floatx(previousFloatx)
+
     def callNetwork(self, u):
         """
         Brief: This does not reconstruct u, but returns original u. Careful here!
@@ -77,9 +101,10 @@ class neuralBase:
         # Input: input.shape = (nCells, nMaxMoment), nMaxMoment = 9 in case of MK3
         # Output: Gradient of the network wrt input
         """
-        x_model = tf.Variable(u)
+        x_model = tf.convert_to_tensor(u)
 
         with tf.GradientTape() as tape:
+            tape.watch(x_model)
             # training=True is only needed if there are layers with different
             # behavior during training versus inference (e.g. Dropout).
             predictions = self.model(x_model, training=False)  # same as neuralClosureModel.model.predict(x)
@@ -88,6 +113,28 @@ class neuralBase:
 
         return [x_model, gradients, predictions]
 
+    def createBatchwiseGradientFunction(self):
+        """
+        Brief: Traces the network and its input gradient once into a graph with fixed input signature.
+               Used by the KiT-RT C++ bridge, so that no eager GradientTape is rebuilt on each solver step.
+
+        # Input of returned function: u, shape = (nCells, inputDim), dtype = networkDtype of the precision policy
+        # Output of returned function: [h, alpha], where alpha = gradient of the network wrt u
+        """
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=[None, self.inputDim], dtype=self.networkDtype)])
+        def batchwiseGradient(u):
+            with tf.GradientTape() as tape:
+                tape.watch(u)
+                predictions = self.model(u, training=False)
+            if isinstance(predictions, (list, tuple)):
+                # models with several outputs (MK10 and newer) return [h, alpha, ...], alpha = dh/du is computed by
+                # the model. The gradient of the whole output list would sum over all outputs
+                return [predictions[0], predictions[1]]
+            return [predictions, tape.gradient(predictions, u)]
+
+        return batchwiseGradient
+
     def call_scaled(self, u_non_normal):
         """
         Brief: By default the same behaviour as callNetwork.
@@ -102,21 +149,30 @@ class neuralBase:
         return self.model.predict(input)
 
     def config_start_training(self, valSplit=0.1, epochCount=2, curriculum=1, batchSize=500, verbosity=1,
-                              processingMode=0):
+                              processingMode=0, resume=False, checkpointFrequency=1):
         '''
         Method to train network
+        resume: continue from the last checkpoint in <model folder>/checkpoints (weights, optimizer state, epoch
+                and callback states), if there is one
+        checkpointFrequency: epochs between two resumable checkpoints
         '''
 
-        # Set double precision training for CPU training #TODO
-        if processingMode == 0:
-            tf.keras.backend.set_floatx('float32')
-        elif processingMode == 1:
-            tf.keras.backend.set_floatx('float32')
+        # the precision policy (floatx) is set at model creation, see networkFloatx
+
+        # multi worker training: batchSize is the batch size per replica. Only the chief writes checkpoints and logs
+        chief = distributed.isChief(self.strategy)
+        if self.strategy is not None:
+            batchSize = batchSize * self.strategy.num_replicas_in_sync
+            print("Global batch size: " + str(batchSize))
+            if not chief:
+                verbosity = 0
 
         # Create callbacks
-        mc_best = tf.keras.callbacks.ModelCheckpoint(self.filename + '/best_model.h5', monitor='loss', mode='min',
-                                                     save_best_only=True,
-                                                     verbose=verbosity)  # , save_weights_only = True, save_freq = 50, verbose=0)
+        # weights only: the sobolev models are subclassed and cannot be saved as .h5 model, loadModel reads weights
+        # in multi worker training, keras redirects the checkpoints of non chief workers to temporary files
+        mc_best = tf.keras.callbacks.ModelCheckpoint(self.filename + '/best_model.h5', monitor='loss',
+                                                     mode='min', save_best_only=True, save_weights_only=True,
+                                                     verbose=verbosity)  # save_freq = 50, verbose=0)
         es = tf.keras.callbacks.EarlyStopping(monitor='loss', mode='min', min_delta=0.0001, patience=10,
                                               verbose=1)
 
@@ -134,19 +190,25 @@ class neuralBase:
                 print("Current Batch Size: " + str(batchSize))
 
                 # assemble callbacks
-                callbackList = []
-                csv_logger = self.createCSVLoggerCallback()
-                if verbosity == 1:
-                    callbackList = [mc_best, csv_logger]
-                else:
-                    callbackList = [mc_best, LossAndErrorPrintingCallback(), csv_logger]
+                callbackList = [mc_best]
+                if chief:
+                    callbackList.append(self.createCSVLoggerCallback())
+                    if verbosity != 1:
+                        callbackList.append(LossAndErrorPrintingCallback())
+
+                # the checkpoint callback comes last, it restores the callback states after their on_train_begin
+                [checkpointCallback, initialEpoch] = self.createCheckpointCallback(callbackList, resume,
+                                                                                   checkpointFrequency)
+                callbackList.append(checkpointCallback)
 
                 # start Training
-                self.history = self.call_training(val_split=valSplit, epoch_size=epochCount, batch_size=batchSize,
-                                                  verbosity_mode=verbosity, callback_list=callbackList)
+                self.history = self.start_training(val_split=valSplit, epoch_size=epochCount, batch_size=batchSize,
+                                                   verbosity_mode=verbosity, callback_list=callbackList,
+                                                   initial_epoch=initialEpoch)
                 batchSize = 2 * batchSize
 
-            self.concatHistoryFiles()
+            if chief:
+                self.concatHistoryFiles()
 
         elif curriculum == 1:  # learning rate scheduler
             print("Training with learning rate scheduler")
@@ -166,29 +228,282 @@ class neuralBase:
             HW = HaltWhenCallback('val_loss', stop_tol)
             ES = tf.keras.callbacks.EarlyStopping(monitor='val_loss', mode='min',
                                                   verbose=1, patience=mt_patience, min_delta=min_delta)
-            csv_logger = self.createCSVLoggerCallback()
-
-            if verbosity == 1:
-                callbackList = [mc_best, csv_logger, LR, HW, ES]
-            else:
-                callbackList = [mc_best, LossAndErrorPrintingCallback(), csv_logger, LR, HW, ES]
-
-            # start Training
-            self.history = self.call_training(val_split=valSplit, epoch_size=epochCount, batch_size=batchSize,
-                                              verbosity_mode=verbosity, callback_list=callbackList)
+            # the stopping callbacks run on all workers. They see the all-reduced logs, so all workers stop together
+            callbackList = [mc_best, LR, HW, ES]
+            if chief:
+                callbackList.append(self.createCSVLoggerCallback())
+                if verbosity != 1:
+                    callbackList.append(LossAndErrorPrintingCallback())
+
+            # the checkpoint callback comes last, it restores the callback states after their on_train_begin
+            [checkpointCallback, initialEpoch] = self.createCheckpointCallback(callbackList, resume,
+                                                                               checkpointFrequency)
+            callbackList.append(checkpointCallback)
+
+            # start Training, the learning rate schedule continues at initialEpoch
+            self.history = self.start_training(val_split=valSplit, epoch_size=epochCount, batch_size=batchSize,
+                                               verbosity_mode=verbosity, callback_list=callbackList,
+                                               initial_epoch=initialEpoch)
 
         return self.history
 
-    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[]):
+    def createCheckpointCallback(self, callbackList, resume=False, checkpointFrequency=1):
+        '''
+        Creates the resumable checkpoint callback of the training in <model folder>/checkpoints and restores the
+        last checkpoint, if resume is set
+        returns: [checkpointCallback, initialEpoch]
+        '''
+        checkpointCallback = ResumableCheckpointCallback(self.filename + '/checkpoints', trackedCallbacks=callbackList,
+                                                         frequency=checkpointFrequency,
+                                                         chief=distributed.isChief(self.strategy))
+        initialEpoch = 0
+        if resume and self.strategy is not None:
+            with self.strategy.scope():  # the optimizer slots are mirrored variables
+                initialEpoch = checkpointCallback.restore(self.model)
+        elif resume:
+            initialEpoch = checkpointCallback.restore(self.model)
+        return [checkpointCallback, initialEpoch]
+
+    def getCheckpointEpoch(self):
+        '''
+        returns: number of finished epochs of the last resumable checkpoint in <model folder>/checkpoints.
+                 0 without checkpoint
+        '''
+        stateFile = self.filename + '/checkpoints/trainingState.json'
+        if not path.exists(stateFile):
+            return 0
+        with open(stateFile, 'r') as file:
+            return json.load(file)["epoch"]
+
+    def start_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[],
+                       initial_epoch=0):
+        '''
+        Trains on the streamed data shards, if loadTrainingDataStreaming was called, else on the in-memory data.
+        Shuffled in-memory data is gathered by index in the input pipeline, see createInMemoryDatasets
+        '''
+        if self.strategy is not None:
+            return self.call_training_distributed(val_split=val_split, epoch_size=epoch_size, batch_size=batch_size,
+                                                  verbosity_mode=verbosity_mode, callback_list=callback_list,
+                                                initial_epoch=initial_epoch)
+        if self.trainingDataShards is not None:
+            return self.call_training_streaming(val_split=val_split, epoch_size=epoch_size, batch_size=batch_size,
+                                                verbosity_mode=verbosity_mode, callback_list=callback_list,
+                                                initial_epoch=initial_epoch)
+        if self.trainingIndices is not None:
+            [trainDataset, valDataset] = self.createInMemoryDatasets(val_split=val_split, batch_size=batch_size)
+            self.history = self.model.fit(trainDataset, validation_data=valDataset, epochs=epoch_size,
+                                          verbose=verbosity_mode, callbacks=callback_list,
+                                          initial_epoch=initial_epoch)
+            return self.history
+        # keras casts numpy training data to floatx
+        with self.networkFloatx():
+            return self.call_training(val_split=val_split, epoch_size=epoch_size, batch_size=batch_size,
+                                      verbosity_mode=verbosity_mode, callback_list=callback_list,
+                                      initial_epoch=initial_epoch)
+
+    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[],
+                      initial_epoch=0):
         '''
         Calls training depending on the MK model
         '''
         xData = self.trainingData[0]
-        yData = self.trainingData[1]
+        yData = self.getTrainingTargets()
         self.model.fit(x=xData, y=yData, validation_split=val_split, epochs=epoch_size, batch_size=batch_size,
-                       verbose=verbosity_mode, callbacks=callback_list, shuffle=True)
+                       verbose=verbosity_mode, callbacks=callback_list, shuffle=True, initial_epoch=initial_epoch)
         return self.history
 
+    def call_training_streaming(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1,
+                                callback_list=[], initial_epoch=0):
+        '''
+        Calls training on the tf.data pipeline over the data shards. The targets are given by trainingTargets.
+        '''
+        [trainDataset, valDataset] = self.createTrainingDatasets(val_split=val_split, batch_size=batch_size)
+        self.history = self.model.fit(trainDataset, validation_data=valDataset, epochs=epoch_size,
+                                      verbose=verbosity_mode, callbacks=callback_list,
+                                      initial_epoch=initial_epoch)
+        return self.history
+
+    def call_training_distributed(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1,
+                                  callback_list=[], initial_epoch=0):
+        '''
+        Calls multi worker training with the distribution strategy. Streams the data shards or uses the in-memory
+        data, each worker reads its part of the data. batch_size is the global batch size.
+        '''
+        if self.trainingDataShards is not None:
+            [trainDataset, valDataset] = self.createTrainingDatasets(val_split=val_split, batch_size=batch_size)
+        else:
+            [trainDataset, valDataset] = self.createInMemoryDatasets(val_split=val_split, batch_size=batch_size)
+        self.history = self.model.fit(trainDataset, validation_data=valDataset, epochs=epoch_size,
+                                      verbose=verbosity_mode, callbacks=callback_list,
+                                      initial_epoch=initial_epoch)
+        return self.history
+
+    def createInMemoryDatasets(self, val_split=0.1, batch_size=128):
+        '''
+        Creates tf.data datasets of the in-memory training data for multi worker training. As in keras
+        validation_split, the last val_split fraction of the samples is held out for validation. The datasets are
+        sharded over the workers by samples. If the data is shuffled (see setTrainingData), the samples are taken in
+        the order of trainingIndices and gathered batch wise from the (memory mapped) arrays.
+        returns: [trainDataset, valDataset]
+        '''
+        if self.trainingIndices is not None:
+            return self.createIndexedDatasets(val_split=val_split, batch_size=batch_size)
+        targets = self.getTrainingTargets()
+        if isinstance(targets, list):
+            targets = tuple(targets)
+        nTrain = int(self.trainingData[0].shape[0] * (1 - val_split))
+
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+
+        def createDataset(start, stop, shuffle):
+            xData = self.trainingData[0][start:stop]
+            yData = tf.nest.map_structure(lambda data: data[start:stop], targets)
+            dataset = tf.data.Dataset.from_tensor_slices((xData, yData))
+            if shuffle:
+                dataset = dataset.shuffle(stop - start, reshuffle_each_iteration=True)
+            return dataset.batch(batch_size).with_options(options).prefetch(tf.data.AUTOTUNE)
+
+        trainDataset = createDataset(0, nTrain, shuffle=True)
+        valDataset = None
+        if nTrain < self.trainingData[0].shape[0]:
+            valDataset = createDataset(nTrain, self.trainingData[0].shape[0], shuffle=False)
+        return [trainDataset, valDataset]
+
+    def createIndexedDatasets(self, val_split=0.1, batch_size=128):
+        '''
+        Creates tf.data datasets over the sample indices of the in-memory training data. Each batch of indices is
+        gathered from the arrays and mapped to (u, trainingTargets), so no shuffled copy of the data is
+        materialized. The last val_split fraction of trainingIndices is held out for validation.
+        returns: [trainDataset, valDataset]
+        '''
+        dtype = self.networkDtype.name
+        nSamples = self.trainingIndices.shape[0]
+        nTrain = int(nSamples * (1 - val_split))
+        selected = self.selectTrainingData()
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+
+        def readBatch(indices):
+            # ascending indices keep the reads of memory mapped data local, the batch order is irrelevant
+            indices = np.sort(indices)
+            return [np.asarray(data[indices], dtype=dtype) for data in self.trainingData]
+
+        def toSample(indices):
+            batch = tf.numpy_function(readBatch, [indices], [dtype] * len(self.trainingData))
+            for data, array in zip(batch, self.trainingData):
+                data.set_shape([None] + list(array.shape[1:]))
+            loadedData = iter(batch)
+            [u, alpha, h] = [next(loadedData) if isSelected else None for isSelected in selected]
+            targets = self.trainingTargets(u, alpha, h)
+            if isinstance(targets, list):
+                targets = tuple(targets)
+            return batch[0], targets
+
+        def createDataset(indices, shuffle):
+            dataset = tf.data.Dataset.from_tensor_slices(indices)
+            if shuffle:
+                dataset = dataset.shuffle(indices.shape[0], reshuffle_each_iteration=True)
+            dataset = dataset.batch(batch_size).map(toSample, num_parallel_calls=tf.data.AUTOTUNE)
+            return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+        trainDataset = createDataset(self.trainingIndices[:nTrain], shuffle=True)
+        valDataset = None
+        if nTrain < nSamples:
+            valDataset = createDataset(self.trainingIndices[nTrain:], shuffle=False)
+        return [trainDataset, valDataset]
+
+    def getTrainingTargets(self):
+        '''
+        returns: training targets (yData) of the in-memory training data. call_training, the in-memory datasets and
+                 the streaming pipeline all take their targets from trainingTargets, so they can not diverge
+        '''
+        # complete the selected columns to (u, alpha, h), the unselected ones are not used by trainingTargets
+        loadedData = iter(self.trainingData)
+        [u, alpha, h] = [next(loadedData) if selected else None for selected in self.selectTrainingData()]
+        return self.trainingTargets(u, alpha, h)
+
+    def trainingTargets(self, u, alpha, h):
+        '''
+        Training targets of the MK model for a batch of (u, alpha, h), same as yData in call_training.
+        Multi output models list the data of their outputs in trainingTargetLayout, e.g. ["h", "alpha", "u"].
+        Otherwise the target is the second selected column.
+        '''
+        if self.trainingTargetLayout is not None:
+            data = {"u": u, "alpha": alpha, "h": h}
+            return [data[name] for name in self.trainingTargetLayout]
+        selectedData = [data for data, selected in zip([u, alpha, h], self.selectTrainingData()) if selected]
+        return selectedData[1]
+
+    def createTrainingDatasets(self, val_split=0.1, batch_size=128):
+        '''
+        Creates the streaming input pipeline over the data shards: block wise (parallel) reading of the memory
+        mapped shards, shuffle buffer, batching, parallel mapping to (u, trainingTargets) and prefetching.
+        The last val_split fraction of rows of each shard is held out for validation. Only the row ranges are
+        split, so no copies of the data are materialized. In multi worker training, every worker reads only its
+        share of the blocks.
+        returns: [trainDataset, valDataset]
+        '''
+        dtype = self.networkDtype.name
+        blockSize = self.streamingBlockSize
+        trainBlocks = []
+        valBlocks = []
+        for shardIdx, shard in enumerate(self.trainingDataShards):
+            nRows = shard[0].shape[0]
+            nTrain = int(nRows * (1 - val_split))
+            trainBlocks += [[shardIdx, start, min(start + blockSize, nTrain)] for start in range(0, nTrain, blockSize)]
+            valBlocks += [[shardIdx, start, min(start + blockSize, nRows)] for start in range(nTrain, nRows, blockSize)]
+
+        # shard the blocks over the workers, so no worker reads the complete data set. All workers have to run the
+        # same number of steps, so every worker uses the row count of the smallest share
+        [numWorkers, workerIndex] = distributed.getWorkerInfo(self.strategy)
+        nTrainRows = min([sum([block[2] - block[1] for block in trainBlocks[idx::numWorkers]])
+                          for idx in range(numWorkers)])
+        nValRows = min([sum([block[2] - block[1] for block in valBlocks[idx::numWorkers]])
+                        for idx in range(numWorkers)])
+        trainBlocks = trainBlocks[workerIndex::numWorkers]
+        valBlocks = valBlocks[workerIndex::numWorkers]
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+
+        def readBlock(shardIdx, start, stop):
+            return [np.asarray(data[start:stop], dtype=dtype) for data in self.trainingDataShards[shardIdx]]
+
+        def loadBlock(block):
+            [u, alpha, h] = tf.numpy_function(readBlock, [block[0], block[1], block[2]], [dtype, dtype, dtype])
+            u.set_shape([None, self.csvInputDim])
+            alpha.set_shape([None, self.csvInputDim])
+            h.set_shape([None, 1])
+            return u, alpha, h
+
+        def toSample(u, alpha, h):
+            if self.streamingNormalized:
+                # ignore first col of u and alpha
+                u = u[:, 1:]
+                alpha = alpha[:, 1:]
+            targets = self.trainingTargets(u, alpha, h)
+            if isinstance(targets, list):
+                targets = tuple(targets)
+            return u, targets
+
+        def createDataset(blocks, nRows, shuffle):
+            dataset = tf.data.Dataset.from_tensor_slices(np.asarray(blocks, dtype=np.int64))
+            if shuffle:
+                dataset = dataset.shuffle(len(blocks), reshuffle_each_iteration=True)
+            dataset = dataset.map(loadBlock, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+            dataset = dataset.unbatch().take(nRows)
+            if shuffle:
+                dataset = dataset.shuffle(self.streamingShuffleBuffer, reshuffle_each_iteration=True)
+            dataset = dataset.batch(batch_size)
+            dataset = dataset.map(toSample, num_parallel_calls=tf.data.AUTOTUNE)
+            return dataset.with_options(options).prefetch(tf.data.AUTOTUNE)
+
+        trainDataset = createDataset(trainBlocks, nTrainRows, shuffle=True)
+        valDataset = None
+        if nValRows > 0:
+            valDataset = createDataset(valBlocks, nValRows, shuffle=False)
+        return [trainDataset, valDataset]
+
     def concatHistoryFiles(self):
         '''
         concatenates the historylogs (works only for up to 10 logs right now)
@@ -246,8 +561,17 @@ class neuralBase:
         """
         Saves best model to .pb file
         """
+        if not distributed.isChief(self.strategy):
+            # saving may contain collective ops, so all workers save. Non chief workers to a temporary folder
+            tmpFolder = tempfile.mkdtemp(prefix="worker_model_")
+            self.model.save(tmpFolder + '/best_model')
+            shutil.rmtree(tmpFolder, ignore_errors=True)
+            return 0
         # load best h5 file
         usedFileName = self.filename
+        if self.model.save_spec() is None and getattr(self, "trainingData", None):
+            # the model was never called, e.g. a resumed training that had already finished. Defines the input spec
+            self.model(self.trainingData[0][:1])
         self.model.load_weights(self.filename + '/best_model.h5')
         self.model.save(self.filename + '/best_model')
         print("Model successfully saved to file and .h5")
@@ -269,6 +593,23 @@ class neuralBase:
         print("Model loaded from file ")
         return 0
 
+    def useFusedCore(self):
+        """
+        Replaces the functional icnn core of a sobolev model (MK11, MK13, MK14) by the fused core, that computes
+        h and alpha in one pass instead of using a GradientTape. Layer configs and weights are copied, and the
+        weight order is kept, so .h5 files stay compatible.
+        """
+        if not hasattr(self.model, "coreModel"):
+            raise ValueError("Model has no icnn core model. Fused core is only available for MK11, MK13 and MK14.")
+        if self.strategy is not None:
+            with self.strategy.scope(), self.networkFloatx():
+                self.model.coreModel = fusedIcnn.fromCore(self.model.coreModel)
+        else:
+            with self.networkFloatx():
+                self.model.coreModel = fusedIcnn.fromCore(self.model.coreModel)
+        print("Fused icnn core enabled")
+        return 0
+
     def printWeights(self):
         for layer in self.model.layers:
             weights = layer.get_weights()  # list of numpy arrays
@@ -279,17 +620,10 @@ class neuralBase:
         self.model.summary()
         return 0
 
-    def loadTrainingData(self, shuffleMode=False, alphasampling=0, loadAll=False, normalizedData=False):
+    def getTrainingDataFilename(self, alphasampling=0, normalizedData=False):
         """
-        Loads the trianing data
-        params: normalizedMoments = load normalized data  (u_0=1)
-                shuffleMode = shuffle loaded Data  (yes,no)
-                alphasampling = use data uniformly sampled in the space of Lagrange multipliers.
-        return: True, if loading successful
+        returns: path of the training data csv file, i.e. data/<d>D/Monomial_M<N>_<d>D[_normal][_alpha].csv
         """
-        self.trainingData = []
-
-        ### Create trainingdata filename"
         filename = "data/" + str(self.spatialDim) + "D/Monomial_M" + str(self.polyDegree) + "_" + str(
             self.spatialDim) + "D"
         if normalizedData:
@@ -298,50 +632,83 @@ class neuralBase:
         if alphasampling == 1:
             filename = filename + "_alpha"
         filename = filename + ".csv"
+        return filename
+
+    def convertTrainingData(self, alphasampling=0, normalizedData=False):
+        """
+        One-time conversion of the training data csv file to the memory mappable binary format (.npy per column group)
+        """
+        filename = self.getTrainingDataFilename(alphasampling=alphasampling, normalizedData=normalizedData)
+        utils.convertCSVToBinary(filename, self.csvInputDim)
+        return True
 
-        print("Loading Data from location: " + filename)
-        # determine which cols correspond to u, alpha and h
-        uCols = list(range(1, self.csvInputDim + 1))
-        alphaCols = list(range(self.csvInputDim + 1, 2 * self.csvInputDim + 1))
-        hCol = [2 * self.csvInputDim + 1]
+    def loadTrainingData(self, shuffleMode=False, alphasampling=0, loadAll=False, normalizedData=False):
+        """
+        Loads the trianing data. If a binary copy (see convertTrainingData) exists, it is memory mapped instead of
+        parsing the csv file.
+        params: normalizedMoments = load normalized data  (u_0=1)
+                shuffleMode = shuffle loaded Data  (yes,no)
+                alphasampling = use data uniformly sampled in the space of Lagrange multipliers.
+        return: True, if loading successful
+        """
+        ### Create trainingdata filename"
+        filename = self.getTrainingDataFilename(alphasampling=alphasampling, normalizedData=normalizedData)
 
         selectedCols = self.selectTrainingData()  # outputs a boolean triple.
 
         # selectedCols = [True, False, True]
 
         start = time.perf_counter()
-        if selectedCols[0] == True:
-            df = pd.read_csv(filename, usecols=[i for i in uCols])
-            uNParray = df.to_numpy()
-            if normalizedData and not loadAll:
-                # ignore first col of u
-                uNParray = uNParray[:, 1:]
-
-            self.trainingData.append(uNParray)
-        if selectedCols[1] == True:
-            df = pd.read_csv(filename, usecols=[i for i in alphaCols])
-            alphaNParray = df.to_numpy()
-            if normalizedData and not loadAll:
-                # ignore first col of alpha
-                alphaNParray = alphaNParray[:, 1:]
-            self.trainingData.append(alphaNParray)
-        if selectedCols[2] == True:
-            df = pd.read_csv(filename, usecols=[i for i in hCol])
-            hNParray = df.to_numpy()
-            self.trainingData.append(hNParray)
-
-        # shuffle data
-        if (shuffleMode):
-            indices = np.arange(hNParray.shape[0])
-            np.random.shuffle(indices)
-            for idx in range(len(self.trainingData)):
-                self.trainingData[idx] = self.trainingData[idx][indices]
+        loadedData = iter(utils.loadData(filename, self.csvInputDim, selectedCols))
+        self.setTrainingData([next(loadedData) if selected else None for selected in selectedCols],
+                             shuffleMode=shuffleMode, loadAll=loadAll, normalizedData=normalizedData)
 
         end = time.perf_counter()
         print("Data loaded. Elapsed time: " + str(end - start))
 
         return True
 
+    def setTrainingData(self, data, shuffleMode=False, loadAll=False, normalizedData=False):
+        """
+        Sets the training data from already loaded arrays (e.g. shared by a sweep), selected as in loadTrainingData
+        params: data = [u, alpha, h], unselected entries may be None
+        """
+        self.trainingData = []
+        for idx, selected in enumerate(self.selectTrainingData()):  # u, alpha, h
+            if selected:
+                if normalizedData and not loadAll and idx < 2:
+                    # ignore first col of u and alpha
+                    self.trainingData.append(data[idx][:, 1:])
+                else:
+                    self.trainingData.append(data[idx])
+
+        # shuffle data by index, fancy indexing would copy memory mapped data into RAM
+        self.trainingIndices = None
+        if (shuffleMode):
+            self.trainingIndices = np.random.permutation(self.trainingData[0].shape[0])
+        return True
+
+    def loadTrainingDataStreaming(self, alphasampling=0, normalizedData=False, shuffleBufferSize=100000,
+                                  blockSize=8192):
+        """
+        Prepares out-of-core training: the binary data shards (see utils.getBinaryDataShards) are memory mapped and
+        streamed through a tf.data pipeline during training instead of being loaded into memory.
+        params: normalizedData = load normalized data  (u_0=1)
+                alphasampling = use data uniformly sampled in the space of Lagrange multipliers.
+                shuffleBufferSize = number of samples in the shuffle buffer
+                blockSize = number of rows read from a shard at once
+        return: True, if loading successful
+        """
+        filename = self.getTrainingDataFilename(alphasampling=alphasampling, normalizedData=normalizedData)
+        print("Streaming Data from location: " + filename)
+        self.trainingDataShards = utils.getBinaryDataShards(filename, self.csvInputDim)
+        self.streamingNormalized = normalizedData
+        self.streamingShuffleBuffer = shuffleBufferSize
+        self.streamingBlockSize = blockSize
+        print("Found " + str(len(self.trainingDataShards)) + " data shard(s) with " + str(
+            sum([shard[0].shape[0] for shard in self.trainingDataShards])) + " samples")
+        return True
+
     def getTrainingData(self):
         return self.trainingData
 
@@ -446,6 +813,111 @@ class LossAndErrorPrintingCallback(tf.keras.callbacks.Callback):
         )
 
 
+class ResumableCheckpointCallback(tf.keras.callbacks.Callback):
+    # attributes of the tracked callbacks that survive a restart, e.g. patience counter and best value of
+    # EarlyStopping and ModelCheckpoint
+    stateAttributes = ["wait", "best", "best_epoch"]
+
+    def __init__(self, checkpointFolder, trackedCallbacks=[], frequency=1, chief=True, maxToKeep=2):
+        """
+        Periodic checkpoints of weights, optimizer state (slots and iterations), epoch and callback states.
+        The epoch determines the position of the learning rate schedule after a restart.
+        input: checkpointFolder = folder of the checkpoints and of trainingState.json
+               trackedCallbacks = callbacks whose state is saved
+               frequency = epochs between two checkpoints
+               chief = only the chief writes to checkpointFolder, other workers to a temporary folder (saving contains
+                       collective ops, so all workers save)
+        """
+        super(ResumableCheckpointCallback, self).__init__()
+        self.checkpointFolder = checkpointFolder
+        self.stateFile = checkpointFolder + '/trainingState.json'
+        self.trackedCallbacks = list(trackedCallbacks)
+        self.frequency = max(int(frequency), 1)
+        self.chief = chief
+        self.maxToKeep = maxToKeep
+        self.checkpoint = None
+        self.manager = None
+        self.workerFolder = None
+        self.restoredStates = None
+        self.lastEpoch = None  # last finished epoch (1-based) that is not checkpointed yet
+
+    def createCheckpoint(self, model):
+        if self.checkpoint is None:
+            self.set_model(model)
+            # create the optimizer slots, so they are restored immediately
+            model.optimizer.build(model.trainable_variables)
+            self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer)
+            folder = self.checkpointFolder
+            if not self.chief:
+                self.workerFolder = tempfile.mkdtemp(prefix="worker_checkpoint_")
+                folder = self.workerFolder
+            self.manager = tf.train.CheckpointManager(self.checkpoint, folder, max_to_keep=self.maxToKeep)
+        return self.checkpoint
+
+    def restore(self, model):
+        """
+        Restores weights and optimizer state of the last checkpoint. The callback states are restored in
+        on_train_begin.
+        returns: initialEpoch, number of finished epochs of the checkpoint. 0 without checkpoint
+        """
+        if not path.exists(self.stateFile):
+            print("No checkpoint in " + self.checkpointFolder + ". Start training at epoch 0")
+            return 0
+        with open(self.stateFile, 'r') as file:
+            state = json.load(file)
+        self.createCheckpoint(model).restore(self.checkpointFolder + '/' + state["checkpoint"])
+        self.restoredStates = state["callbacks"]
+        print("Resume training at epoch " + str(state["epoch"]) + " from " + self.checkpointFolder + '/'
+              + state["checkpoint"])
+        return state["epoch"]
+
+    def getCallbackStates(self):
+        states = []
+        for callback in self.trackedCallbacks:
+            callbackState = {}
+            for attribute in self.stateAttributes:
+                value = getattr(callback, attribute, None)
+                if isinstance(value, np.number):
+                    value = value.item()
+                if isinstance(value, (int, float)):
+                    callbackState[attribute] = value
+            states.append(callbackState)
+        return states
+
+    def on_train_begin(self, logs=None):
+        self.createCheckpoint(self.model)
+        if self.restoredStates is not None:
+            for callback, callbackState in zip(self.trackedCallbacks, self.restoredStates):
+                for attribute, value in callbackState.items():
+                    setattr(callback, attribute, type(getattr(callback, attribute))(value))
+            self.restoredStates = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.lastEpoch = epoch + 1
+        if self.lastEpoch % self.frequency == 0:
+            self.save(self.lastEpoch)
+
+    def on_train_end(self, logs=None):
+        # early stopped or last epoch not on the checkpoint frequency
+        if self.lastEpoch is not None:
+            self.save(self.lastEpoch)
+        if self.workerFolder is not None:
+            shutil.rmtree(self.workerFolder, ignore_errors=True)
+            self.workerFolder = None
+
+    def save(self, epoch):
+        checkpointPath = self.manager.save(checkpoint_number=epoch)
+        self.lastEpoch = None
+        if not self.chief:
+            return 0
+        state = {"epoch": epoch, "checkpoint": path.basename(checkpointPath), "callbacks": self.getCallbackStates()}
+        # the state file points to a complete checkpoint, also if the job is killed while writing
+        with open(self.stateFile + '.tmp', 'w') as file:
+            json.dump(state, file, indent=2)
+        os.replace(self.stateFile + '.tmp', self.stateFile)
+        return 0
+
+
 class HaltWhenCallback(tf.keras.callbacks.Callback):
     def __init__(self, quantity, tol):
         """
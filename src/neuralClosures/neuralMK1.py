@@ -26,7 +26,8 @@ class neuralMK1(neuralBase):
         super(neuralMK1, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
                                         customFolderName)
 
-        self.model = self.createModel()
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
         # inputDim = self.getIdxSphericalHarmonics(self.polyDegree, self.polyDegree) + 1
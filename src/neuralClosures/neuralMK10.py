@@ -35,7 +35,9 @@ class neuralMK10(neuralBase):
         super(neuralMK10, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
                                          customFolderName)
 
-        self.model = self.createModel()
+        self.trainingTargetLayout = ["h", "alpha"]
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
 
@@ -83,16 +85,17 @@ class neuralMK10(neuralBase):
                                   show_layer_names=True, rankdir='TB', expand_nested=True)
         return model
 
-    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[]):
+    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[],
+                      initial_epoch=0):
         '''
         Calls training depending on the MK model
         '''
         xData = self.trainingData[0]
-        yData = [self.trainingData[2], self.trainingData[1]]
+        yData = self.getTrainingTargets()
         self.model.fit(x=xData, y=yData,
                        validation_split=val_split, epochs=epoch_size,
                        batch_size=batch_size, verbose=verbosity_mode,
-                       callbacks=callback_list, shuffle=True)
+                       callbacks=callback_list, shuffle=True, initial_epoch=initial_epoch)
         return self.history
 
     def selectTrainingData(self):
@@ -110,12 +113,10 @@ class customNet(tf.keras.Model):
 
         # Specify integration weights and basis
         ### Compare u and reconstructed u
-        [mu, quadWeights] = math.qGaussLegendre1D(100)  # Create quadrature
-        mBasis = math.computeMonomialBasis1D(mu, 1)  # Create basis
+        [_, quadWeights, self.mBasis] = math.getQuadratureBasisTF(1, 1, 100, dtype=tf.float32)  # shared constants
+        self.quadWeights = tf.reshape(quadWeights, shape=(-1,))  # dims = nq
 
         # Specify architecture and input shape
-        self.mBasis = tf.constant(mBasis, dtype=float)
-        self.quadWeights = tf.constant(quadWeights, dtype=float)
 
         self.inputDim = inputDim
         self.modelWidth = modelWidth
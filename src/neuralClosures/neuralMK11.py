@@ -16,6 +16,7 @@ from tensorflow.keras import layers
 from tensorflow.keras.constraints import NonNeg
 from tensorflow import Tensor
 from src import math
+from src import reductions
 
 
 class neuralMK11(neuralBase):
@@ -26,16 +27,18 @@ class neuralMK11(neuralBase):
     '''
 
     def __init__(self, polyDegree=0, spatialDim=1, folderName="testFolder", lossCombi=0, width=10, depth=5,
-                 normalized=False):
+                 normalized=False, precision=1):
         if (folderName == "testFolder"):
             customFolderName = "MK11_N" + str(polyDegree) + "_D" + str(spatialDim)
         else:
             customFolderName = folderName
 
         super(neuralMK11, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
-                                         customFolderName)
+                                         customFolderName, precision)
 
-        self.model = self.createModel()
+        self.trainingTargetLayout = ["h", "alpha", "u"]
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
 
@@ -133,7 +136,8 @@ class neuralMK11(neuralBase):
 
         # build model
         model = sobolevModel(coreModel, polyDegree=self.polyDegree, spatialDim=self.spatialDim,
-                             reconsU=bool(self.lossWeights[2]), name="sobolev_icnn_wrapper")
+                             reconsU=bool(self.lossWeights[2]), reconstructionDtype=self.reconstructionDtype,
+                             name="sobolev_icnn_wrapper")
 
         batchSize = 2  # dummy entry
         model.build(input_shape=(batchSize, self.inputDim))
@@ -230,17 +234,17 @@ class neuralMK11(neuralBase):
 
         return KL_divergence
 
-    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[]):
+    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[],
+                      initial_epoch=0):
         '''
         Calls training depending on the MK model
         '''
         xData = self.trainingData[0]
-        # yData = [h,alpha,u, alpha (for KLDivergence)]
-        yData = [self.trainingData[2], self.trainingData[1], self.trainingData[0]]  # , self.trainingData[1]]
+        yData = self.getTrainingTargets()
         self.history = self.model.fit(x=xData, y=yData,
                                       validation_split=val_split, epochs=epoch_size,
                                       batch_size=batch_size, verbose=verbosity_mode,
-                                      callbacks=callback_list, shuffle=True)
+                                      callbacks=callback_list, shuffle=True, initial_epoch=initial_epoch)
         return self.history
 
     def selectTrainingData(self):
@@ -262,7 +266,7 @@ class neuralMK11(neuralBase):
                  h_predicted, dim = (nS x 1)
         """
         u_reduced = u_complete[:, 1:]  # chop of u_0
-        [h_predicted, alpha_predicted, u_0_predicted, tmp] = self.model(u_reduced)
+        [h_predicted, alpha_predicted, u_0_predicted] = self.model(u_reduced)
         alpha_complete_predicted = self.model.reconstruct_alpha(alpha_predicted)
         u_complete_reconstructed = self.model.reconstruct_u(alpha_complete_predicted)
 
@@ -284,39 +288,16 @@ class neuralMK11(neuralBase):
                  u_complete_reconstructed_scaled, dim = (nS x N)
                  h_predicted_scaled, dim = (nS x 1)
         """
-        u_non_normal = tf.constant(u_non_normal, dtype=tf.float32)
+        u_non_normal = tf.cast(u_non_normal, dtype=self.networkDtype)
         u_downscaled = self.model.scale_u(u_non_normal, tf.math.reciprocal(u_non_normal[:, 0]))  # downscaling
         #
         #
         #
         u_reduced = u_downscaled[:, 1:]  # chop of u_0
         [h_predicted, alpha_predicted, u_0_predicted] = self.model(u_reduced)
-        ### cast to fp64 ###
-        alpha_predicted = tf.cast(alpha_predicted, dtype=tf.float64, name=None)
-        mBasis = tf.cast(self.model.momentBasis, dtype=tf.float64, name=None)
-        qWeights = tf.cast(self.model.quadWeights, dtype=tf.float64, name=None)
-        # reconstruct alpha (with fp64)
-        tmp = tf.math.exp(tf.tensordot(alpha_predicted, mBasis[1:, :], axes=([1], [0])))  # tmp = alpha * m
-        alpha_0 = -tf.math.log(tf.tensordot(tmp, qWeights, axes=([1], [1])))  # ln(<tmp>)
-        alpha_complete_predicted = tf.concat([alpha_0, alpha_predicted], axis=1)  # concat [alpha_0,alpha]
-        #
-        # reconstruct_u
-        f_quad = tf.math.exp(tf.tensordot(alpha_complete_predicted, mBasis, axes=([1], [0])))  # alpha*m
-        tmp = tf.math.multiply(f_quad, qWeights)  # f*w
-        u_complete_reconstructed = tf.tensordot(tmp, mBasis[:, :], axes=([1], [1]))
-        #
-        # upscale u
-        u0 = tf.cast(u_non_normal[:, 0], dtype=tf.float64, name=None)
-        u_rescaled = self.model.scale_u(u_complete_reconstructed, u0)  # upscaling
-        alpha_rescaled = self.model.scale_alpha(alpha_complete_predicted, u0)  # upscaling
-        #
-        # compute h
-        f_quad = tf.math.exp(tf.tensordot(alpha_rescaled, mBasis, axes=([1], [0])))  # alpha*m
-        tmp = tf.tensordot(f_quad, qWeights, axes=([1], [1]))  # f*w
-        tmp2 = tf.math.reduce_sum(tf.math.multiply(alpha_rescaled, u_rescaled), axis=1, keepdims=True)
-        h_rescaled = tmp2 - tmp
-
-        return [u_rescaled, alpha_rescaled, h_rescaled]
+        # fused post processing with fp64: alpha_0, u, upscaling and h from one evaluation of exp(alpha*m)
+        return math.reconstructScaledFused(u_non_normal, alpha_predicted, self.model.momentBasis64,
+                                           self.model.quadWeights64, dtype=tf.float64)
 
     def call_scaled(self, u_non_normal):
 
@@ -334,22 +315,20 @@ class neuralMK11(neuralBase):
                  u_complete_reconstructed_scaled, dim = (nS x N)
                  h_predicted_scaled, dim = (nS x 1)
         """
-        u_non_normal = tf.constant(u_non_normal, dtype=tf.float32)
+        u_non_normal = tf.cast(u_non_normal, dtype=self.networkDtype)
         u_downscaled = self.model.scale_u(u_non_normal, tf.math.reciprocal(u_non_normal[:, 0]))  # downscaling
-        [u_complete_reconstructed, alpha_complete_predicted, h_predicted] = self.callNetwork(u_downscaled)
-        u_rescaled = self.model.scale_u(u_complete_reconstructed, u_non_normal[:, 0])  # upscaling
-        alpha_rescaled = self.model.scale_alpha(alpha_complete_predicted, u_non_normal[:, 0])  # upscaling
-        h_rescaled = self.model.compute_h(u_rescaled, alpha_rescaled)
-
-        return [u_rescaled, alpha_rescaled, h_rescaled]
+        [h_predicted, alpha_predicted, u_0_predicted] = self.model(u_downscaled[:, 1:])
+        # fused post processing with fp32
+        return math.reconstructScaledFused(u_non_normal, alpha_predicted, self.model.momentBasis,
+                                           self.model.quadWeights, dtype=tf.float32)
 
     def normalizeData(self):
 
         # load data
         #
         [u_t, alpha_t, h_t] = self.trainingData
-        mBasis = tf.cast(self.model.momentBasis, dtype=tf.float64, name=None)
-        qWeights = tf.cast(self.model.quadWeights, dtype=tf.float64, name=None)
+        mBasis = self.model.momentBasis64
+        qWeights = self.model.quadWeights64
         #
         #
         u_non_normal = tf.constant(u_t, dtype=tf.float64)
@@ -372,34 +351,30 @@ class neuralMK11(neuralBase):
 
 class sobolevModel(tf.keras.Model):
     # Sobolev implies, that the model outputs also its derivative
-    def __init__(self, coreModel, polyDegree=1, spatialDim=1, reconsU=False, **opts):
+    def __init__(self, coreModel, polyDegree=1, spatialDim=1, reconsU=False, reconstructionDtype=tf.float64,
+                 **opts):
         super(sobolevModel, self).__init__()
         # Member is only the model we want to wrap with sobolev execution
         self.coreModel = coreModel  # must be a compiled tensorflow model
         self.reconsU_enabled = reconsU
 
-        # Create quadrature and momentBasis. Currently only for 1D problems
+        # Create quadrature and momentBasis
         self.polyDegree = polyDegree
 
-        if spatialDim == 1:
-            [quadPts, quadWeights] = math.qGaussLegendre1D(10 * polyDegree)  # dims = nq
-            mBasis = math.computeMonomialBasis1D(quadPts, self.polyDegree)  # dims = (N x nq)
-            self.nq = quadWeights.size  # = 10 * polyDegree
-        elif spatialDim == 2:
-            [quadPts, quadWeights] = math.qGaussLegendre2D(10 * polyDegree)  # dims = nq
-            self.nq = quadWeights.size  # is not 10 * polyDegree
-            mBasis = math.computeMonomialBasis2D(quadPts, self.polyDegree)  # dims = (N x nq)
-        else:
+        if spatialDim not in [1, 2, 3]:
             print("spatial dimension not yet supported for sobolev wrapper")
             exit()
-
-        self.quadPts = tf.constant(quadPts, shape=(self.nq, spatialDim),
-                                   dtype=tf.float64)  # dims = (ds x nq)
-        self.quadWeights = tf.constant(quadWeights, shape=(1, self.nq),
-                                       dtype=tf.float64)  # dims = (batchSIze x N x nq)
-        self.inputDim = mBasis.shape[0]
-        self.momentBasis = tf.constant(mBasis, shape=(self.inputDim, self.nq),
-                                       dtype=tf.float64)  # dims = (batchSIze x N x nq)
+        # shared constants of the process wide quadrature registry, dims = (nq x ds), (1 x nq), (N x nq).
+        # Stored in the dtype of the quadrature reconstruction, so they are never cast inside the training step
+        self.reconstructionDtype = reconstructionDtype
+        [self.quadPts, self.quadWeights, self.momentBasis] = math.getQuadratureBasisTF(spatialDim, self.polyDegree,
+                                                                                      10 * polyDegree,
+                                                                                      dtype=reconstructionDtype)
+        # full precision copies for the fp64 post processing
+        [_, self.quadWeights64, self.momentBasis64] = math.getQuadratureBasisTF(spatialDim, self.polyDegree,
+                                                                               10 * polyDegree, dtype=tf.float64)
+        self.nq = self.quadWeights.shape[1]  # = 10 * polyDegree in 1D
+        self.inputDim = self.momentBasis.shape[0]
 
     def call(self, x, training=False):
         """
@@ -410,17 +385,23 @@ class sobolevModel(tf.keras.Model):
                 u = [u_1,u_2,...,u_N]
         """
 
-        with tf.GradientTape() as grad_tape:
-            grad_tape.watch(x)
-            h = self.coreModel(x)
-        alpha = grad_tape.gradient(h, x)
+        if hasattr(self.coreModel, "call_with_derivative"):
+            # fused core: h and alpha in one pass
+            [h, alpha] = self.coreModel.call_with_derivative(x)
+        else:
+            with tf.GradientTape() as grad_tape:
+                grad_tape.watch(x)
+                h = self.coreModel(x)
+            alpha = grad_tape.gradient(h, x)
 
         if self.reconsU_enabled:
             print("Reconstruction of U enabled")
-            alpha64 = tf.cast(alpha, dtype=tf.float64, name=None)
-            alpha_complete = self.reconstruct_alpha(alpha64)
+            # one cast per batch into the reconstruction precision and one back into the network precision
+            alpha_reconstruction = tf.cast(alpha, dtype=self.reconstructionDtype)
+            alpha_complete = self.reconstruct_alpha(alpha_reconstruction)
             u_complete = self.reconstruct_u(alpha_complete)
-            res = u_complete[:, 1:]  # cutoff the 0th order moment, since it is 1 by construction
+            # cutoff the 0th order moment, since it is 1 by construction
+            res = tf.cast(u_complete[:, 1:], dtype=alpha.dtype)
         else:
             print("Reconstruction of U disabled. Output 3 is meaningless")
             res = alpha
@@ -448,14 +429,9 @@ class sobolevModel(tf.keras.Model):
         returns alpha_complete = [alpha_0,alpha], dim = (nS x N), where alpha_0 = - ln(<exp(alpha*m)>)
         """
         # Check the predicted alphas for +/- infinity or nan - raise error if found
-        checked_alpha = tf.debugging.check_numerics(alpha,
-                                                    message='input tensor checking error at alpha = ' + str(alpha),
-                                                    name='checked')
-        # Clip the predicted alphas below the tf.exp overflow threshold
-        clipped_alpha = tf.clip_by_value(checked_alpha, clip_value_min=-50, clip_value_max=50, name='checkedandclipped')
-
-        tmp = tf.math.exp(tf.tensordot(clipped_alpha, self.momentBasis[1:, :], axes=([1], [0])))  # tmp = alpha * m
-        alpha_0 = -tf.math.log(tf.tensordot(tmp, self.quadWeights, axes=([1], [1])))  # ln(<tmp>)
+        checked_alpha = tf.debugging.check_numerics(alpha, message='input tensor checking error', name='checked')
+        # log-sum-exp, stable without clipping alpha
+        alpha_0 = reductions.reconstructAlpha0(checked_alpha, self.momentBasis, self.quadWeights)
         return tf.concat([alpha_0, alpha], axis=1)  # concat [alpha_0,alpha]
 
     def reconstruct_u(self, alpha):
@@ -472,13 +448,8 @@ class sobolevModel(tf.keras.Model):
         """
         # Check the predicted alphas for +/- infinity or nan - raise error if found
         checked_alpha = tf.debugging.check_numerics(alpha, message='input tensor checking error', name='checked')
-        # Clip the predicted alphas below the tf.exp overflow threshold
-        clipped_alpha = tf.clip_by_value(checked_alpha, clip_value_min=-50, clip_value_max=50, name='checkedandclipped')
-
-        # Currently only for maxwell Boltzmann entropy
-        f_quad = tf.math.exp(tf.tensordot(clipped_alpha, self.momentBasis, axes=([1], [0])))  # alpha*m
-        tmp = tf.math.multiply(f_quad, self.quadWeights)  # f*w
-        return tf.tensordot(tmp, self.momentBasis[:, :], axes=([1], [1]))  # f * w * momentBasis
+        # Currently only for maxwell Boltzmann entropy. Max shifted exponentials, stable without clipping alpha
+        return reductions.reconstructU(checked_alpha, self.momentBasis, self.quadWeights)
 
     def scale_alpha(self, alpha, u_0):
         """
@@ -515,7 +486,4 @@ class sobolevModel(tf.keras.Model):
         returns h = alpha*u - <eta_*(alpha*m)>
         """
         # Currently only for maxwell Boltzmann entropy
-        f_quad = tf.math.exp(tf.tensordot(alpha, self.momentBasis, axes=([1], [0])))  # alpha*m
-        tmp = tf.tensordot(f_quad, self.quadWeights, axes=([1], [1]))  # f*w
-        tmp2 = tf.math.reduce_sum(tf.math.multiply(alpha, u), axis=1, keepdims=True)
-        return tmp2 - tmp
+        return reductions.computeH(u, alpha, self.momentBasis, self.quadWeights)  # log-sum-exp
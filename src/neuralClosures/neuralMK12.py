@@ -29,7 +29,9 @@ class neuralMK12(neuralBase):
         super(neuralMK12, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
                                          customFolderName)
 
-        self.model = self.createModel()
+        self.trainingTargetLayout = ["h", "alpha"]
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
 
@@ -92,16 +94,17 @@ class neuralMK12(neuralBase):
 
         return model
 
-    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[]):
+    def call_training(self, val_split=0.1, epoch_size=2, batch_size=128, verbosity_mode=1, callback_list=[],
+                      initial_epoch=0):
         '''
         Calls training depending on the MK model
         '''
         xData = self.trainingData[0]
-        yData = [self.trainingData[2], self.trainingData[1]]
+        yData = self.getTrainingTargets()
         self.model.fit(x=xData, y=yData,
                        validation_split=val_split, epochs=epoch_size,
                        batch_size=batch_size, verbose=verbosity_mode,
-                       callbacks=callback_list, shuffle=True)
+                       callbacks=callback_list, shuffle=True, initial_epoch=initial_epoch)
         return self.history
 
     def selectTrainingData(self):
@@ -140,14 +143,10 @@ class sobolevModel(tf.keras.Model):
         # Create quadrature and momentBasis. Currently only for 1D problems
         self.polyDegree = polyDegree
         self.nq = 100
-        [quadPts, quadWeights] = math.qGaussLegendre1D(self.nq)  # dims = nq
-        self.quadPts = tf.constant(quadPts, shape=(1, self.nq), dtype=tf.float32)  # dims = (batchSIze x N x nq)
-        self.quadWeights = tf.constant(quadWeights, shape=(1, self.nq),
-                                       dtype=tf.float32)  # dims = (batchSIze x N x nq)
-        mBasis = math.computeMonomialBasis1D(quadPts, self.polyDegree)  # dims = (N x nq)
-        self.inputDim = mBasis.shape[0]
-        self.momentBasis = tf.constant(mBasis, shape=(self.inputDim, self.nq),
-                                       dtype=tf.float32)  # dims = (batchSIze x N x nq)
+        [quadPts, self.quadWeights, self.momentBasis] = math.getQuadratureBasisTF(1, self.polyDegree, self.nq,
+                                                                                 dtype=tf.float32)  # shared
+        self.quadPts = tf.reshape(quadPts, shape=(1, self.nq))  # dims = (1 x nq)
+        self.inputDim = self.momentBasis.shape[0]
 
     def call(self, x, training=False):
         """
@@ -28,7 +28,8 @@ class neuralMK2(neuralBase):
         super(neuralMK2, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
                                         customFolderName)
 
-        self.model = self.createModel()
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
         # Define the input
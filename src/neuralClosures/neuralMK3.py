@@ -36,7 +36,8 @@ class neuralMK3(neuralBase):
         super(neuralMK3, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
                                         customFolderName)
 
-        self.model = self.createModel()
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
         inputDim = self.getIdxSphericalHarmonics(self.polyDegree, self.polyDegree) + 1
@@ -30,7 +30,8 @@ class neuralMK4(neuralBase):
         super(neuralMK4, self).__init__(normalized, polyDegree, spatialDim, width, depth, lossCombi,
                                         customFolderName)
 
-        self.model = self.createModel()
+        with self.networkFloatx():
+            self.model = self.createModel()
 
     def createModel(self):
 
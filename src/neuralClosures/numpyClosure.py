@@ -0,0 +1,165 @@
+'''
+Pure numpy inference backend for the ICNN closures (MK11, MK13, MK14).
+The weights of the "Icnn_closure" core model are exported into a flat parameter pack (.npz). The numpy closure
+evaluates the entropy h and its input gradient alpha = dh/du with a hand written backward pass, so it needs
+neither tensorflow nor a GPU at inference time.
+'''
+
+### imports ###
+# python modules
+import hashlib
+
+import numpy as np
+
+
+### global functions ###
+def exportNumpyClosure(neuralClosure, filename=None):
+    '''
+    Exports the core model weights of an ICNN closure into a numpy parameter pack.
+    input: neuralClosure = initialized (and loaded) neuralMK11, neuralMK13 or neuralMK14
+           filename = path of the .npz file. Default: <model folder>/numpy_closure.npz
+    returns: params = dict of numpy arrays
+    '''
+    coreModel = neuralClosure.model.coreModel
+    depth = neuralClosure.modelDepth
+    layerIdxs = list(range(0, depth)) + [depth + 1]  # index of the last convex layer is skipped in createModel
+
+    params = {"nLayers": np.array(len(layerIdxs)),
+              "polyDegree": np.array(neuralClosure.polyDegree),
+              "spatialDim": np.array(neuralClosure.spatialDim)}
+    [params["W_first"], params["b_first"]] = coreModel.get_layer("first_dense").get_weights()
+    for count, idx in enumerate(layerIdxs):
+        [params["Wz_" + str(count)], params["bz_" + str(count)]] = coreModel.get_layer(
+            "non_neg_component_" + str(idx)).get_weights()
+        [params["Wx_" + str(count)]] = coreModel.get_layer("dense_component_" + str(idx)).get_weights()
+
+    # the output layer is unnamed: two dense layers with one unit, the z component has a bias, the x component not
+    for layer in coreModel.layers:
+        if getattr(layer, "units", None) == 1:
+            if layer.use_bias:
+                [params["Wz_out"], params["bz_out"]] = layer.get_weights()
+            else:
+                [params["Wx_out"]] = layer.get_weights()
+
+    # quadrature of the sobolev wrapper for the reconstruction of alpha_0 and u
+    params["momentBasis"] = np.asarray(neuralClosure.model.momentBasis64, dtype=np.float64)
+    params["quadWeights"] = np.reshape(np.asarray(neuralClosure.model.quadWeights64, dtype=np.float64), (-1,))
+
+    if filename is None:
+        filename = neuralClosure.filename + "/numpy_closure.npz"
+    np.savez(filename, **params)
+    print("Numpy closure exported to " + filename)
+    return params
+
+
+def paramsHash(params):
+    '''
+    returns: sha256 hex digest of a parameter pack, changes with any weight of the network
+    '''
+    digest = hashlib.sha256()
+    for key in sorted(params.keys()):
+        digest.update(key.encode())
+        digest.update(np.ascontiguousarray(params[key]).tobytes())
+    return digest.hexdigest()
+
+
+def softplus(x):
+    return np.logaddexp(0.0, x)
+
+
+def sigmoid(x):
+    # derivative of the softplus
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def reconstructScaled(u_non_normal, alpha_reduced, mBasis, quadWeights):
+    '''
+    brief: numpy post processing of a normalized closure. Reconstructs alpha_0 and u from the predicted
+           alpha_1..alpha_N of the normalized moments, scales both back to u_0 and computes the entropy h.
+           Only for maxwell Boltzmann entropy.
+    input: u_non_normal, dims = (nS x N)
+           alpha_reduced = [alpha_1,...,alpha_N] of the normalized moments, dims = (nS x N-1)
+           mBasis, dims = (N x nq)
+           quadWeights, dims = nq
+    returns: [u, alpha, h], dims = (nS x N), (nS x N), (nS x 1)
+    '''
+    f_w = np.exp(np.matmul(alpha_reduced, mBasis[1:, :])) * quadWeights  # exp(alpha*m)*w, alpha_0 = 0
+    moments = np.matmul(f_w, mBasis.T)  # <m exp(alpha*m)>, dims = (nS x N)
+    alpha_0 = -np.log(moments[:, 0:1])  # alpha_0 = -ln(<exp(alpha*m)>)
+    u_0 = u_non_normal[:, 0:1]
+
+    u_normal = moments / moments[:, 0:1]  # = <m exp(alpha_complete*m)>
+    u = u_normal * u_0  # upscaling
+    alpha = np.concatenate([alpha_0 + np.log(u_0), alpha_reduced], axis=1)  # upscaling
+    h = np.sum(alpha * u, axis=1, keepdims=True) - u_0  # alpha*u - <exp(alpha*m)>, <exp(alpha*m)> = u_0
+    return [u, alpha, h]
+
+
+### class definitions ###
+class numpyClosure:
+
+    def __init__(self, params, dtype=np.float64):
+        '''
+        input: params = parameter pack of exportNumpyClosure, or the path to its .npz file
+               dtype = dtype of the network evaluation
+        '''
+        if isinstance(params, str):
+            params = dict(np.load(params))
+        self.dtype = dtype
+        self.nLayers = int(params["nLayers"])
+        self.polyDegree = int(params["polyDegree"])
+        self.spatialDim = int(params["spatialDim"])
+
+        self.W_first = params["W_first"].astype(dtype)
+        self.b_first = params["b_first"].astype(dtype)
+        self.Wz = [params["Wz_" + str(i)].astype(dtype) for i in range(self.nLayers)]
+        self.bz = [params["bz_" + str(i)].astype(dtype) for i in range(self.nLayers)]
+        self.Wx = [params["Wx_" + str(i)].astype(dtype) for i in range(self.nLayers)]
+        self.Wz_out = params["Wz_out"].astype(dtype)
+        self.bz_out = params["bz_out"].astype(dtype)
+        self.Wx_out = params["Wx_out"].astype(dtype)
+
+        self.momentBasis = params["momentBasis"]
+        self.quadWeights = params["quadWeights"]
+        self.inputDim = self.W_first.shape[0]
+
+    def __call__(self, u_non_normal):
+        return self.call_scaled(u_non_normal)
+
+    def call(self, u_reduced):
+        '''
+        brief: evaluates the ICNN and its analytic input gradient
+        input: u_reduced = [u_1,...,u_N] of normalized moments, dims = (nS x N-1)
+        returns: [h, alpha], dims = (nS x 1), (nS x N-1)
+        '''
+        x = np.asarray(u_reduced, dtype=self.dtype)
+
+        # forward pass, keep the pre-activations for the backward pass
+        preActivations = [np.matmul(x, self.W_first) + self.b_first]
+        z = softplus(preActivations[0])
+        for i in range(self.nLayers):
+            preActivations.append(np.matmul(z, self.Wz[i]) + self.bz[i] + np.matmul(x, self.Wx[i]))
+            z = softplus(preActivations[-1])
+        h = np.matmul(z, self.Wz_out) + self.bz_out + np.matmul(x, self.Wx_out)
+
+        # backward pass: dh/dx
+        alpha = np.broadcast_to(self.Wx_out[:, 0], x.shape).copy()
+        grad_z = np.broadcast_to(self.Wz_out[:, 0], z.shape)
+        for i in reversed(range(self.nLayers)):
+            grad_pre = grad_z * sigmoid(preActivations[i + 1])
+            alpha += np.matmul(grad_pre, self.Wx[i].T)
+            grad_z = np.matmul(grad_pre, self.Wz[i].T)
+        alpha += np.matmul(grad_z * sigmoid(preActivations[0]), self.W_first.T)
+        return [h, alpha]
+
+    def call_scaled(self, u_non_normal):
+        '''
+        brief: numpy counterpart of call_scaled_64 of the normalized closures.
+        input: u_non_normal, dims = (nS x N)
+        returns: [u, alpha, h], dims = (nS x N), (nS x N), (nS x 1)
+        '''
+        u_non_normal = np.asarray(u_non_normal, dtype=np.float64)
+        u_normal = u_non_normal / u_non_normal[:, 0:1]  # downscaling
+        [h_normal, alpha_reduced] = self.call(u_normal[:, 1:])
+        return reconstructScaled(u_non_normal, alpha_reduced.astype(np.float64), self.momentBasis,
+                                 self.quadWeights)
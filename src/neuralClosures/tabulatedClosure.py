@@ -0,0 +1,365 @@
+'''
+Tabulated entropy closure for M1 in 1D (input u_1) and 2D (inputs u_1, u_2).
+A source closure (a trained network via its numpy export, or the Newton reference) is evaluated once on an adaptive
+grid over the normalized realizable set. The table stores the entropy h and its derivatives, and h is interpolated
+with cubic (1D) or bicubic (2D) Hermite polynomials. alpha is the exact gradient of the interpolant, so h and
+alpha stay consistent. 1D uses an interval grid in u_1, 2D a polar grid (r, theta) over the disc, with adaptive
+radial nodes and uniform angular nodes. Lookups are vectorized in numpy and need no tensorflow. Only moments outside
+of the table, i.e. close to the realizable boundary, are solved with Newton.
+'''
+
+### imports ###
+# python modules
+import numpy as np
+
+# inpackage imports
+from src import math
+from src import realizability
+from src.neuralClosures.numpyClosure import reconstructScaled
+
+
+### global functions ###
+def newtonSource(mBasis, quadWeights, tol=1e-10, polishSteps=3):
+    '''
+    Reference source of the table: solves the dual entropy problem of the normalized moments with Newton. The line
+    search of the Newton solver stalls at the rounding level of the dual objective, so the solution is polished with
+    a few undamped Newton steps, until |<m f> - u| < tol.
+    returns: source(u_reduced) -> [h, alpha_reduced, hessian], dims = nS, (nS x d), (nS x d x d), where
+             d = N - 1 and hessian = d alpha_reduced / d u_reduced is the inverse moment hessian
+    '''
+    mBasis = np.asarray(mBasis, dtype=np.float64)
+    quadWeights = np.asarray(quadWeights, dtype=np.float64)
+
+    def source(u_reduced):
+        u = np.concatenate([np.ones((u_reduced.shape[0], 1)), u_reduced], axis=1)
+        alphaStart = np.zeros(u.shape)
+        alphaStart[:, 0] = -np.log(np.sum(quadWeights))  # isotropic density with u_0 = 1
+        [alpha, _, _] = math.minimizeEntropyNewtonBatch(u, alphaStart, mBasis, quadWeights, tol=tol)
+        for i in range(polishSteps + 1):
+            f_w = np.exp(np.matmul(alpha, mBasis)) * quadWeights
+            hessian = np.einsum('sq,nq,kq->snk', f_w, mBasis, mBasis)  # <m m^T f>
+            residual = np.matmul(f_w, mBasis.T) - u
+            if i < polishSteps:
+                alpha -= np.linalg.solve(hessian, residual[:, :, np.newaxis])[:, :, 0]
+        unconverged = np.count_nonzero(np.logical_not(np.linalg.norm(residual, axis=1) < tol))
+        if unconverged > 0:
+            raise ValueError("Newton source did not converge for " + str(unconverged) + " points. Reduce rMax.")
+        h = np.sum(alpha * u, axis=1) - np.sum(f_w, axis=1)  # alpha*u - <exp(alpha*m)>
+        return [h, alpha[:, 1:], np.linalg.inv(hessian)[:, 1:, 1:]]  # d alpha / d u = <m m^T f>^-1
+
+    return source
+
+
+def closureSource(closure, eps=1e-5):
+    '''
+    Network source of the table.
+    input: closure = normalized closure with call(u_reduced) -> [h, alpha_reduced] in float64, e.g.
+                     numpyClosure(exportNumpyClosure(neuralClosure))
+           eps = step of the central differences of alpha for the hessian
+    returns: source(u_reduced) -> [h, alpha_reduced, hessian], dims = nS, (nS x d), (nS x d x d)
+    '''
+
+    def source(u_reduced):
+        [h, alpha] = closure.call(u_reduced)
+        dim = u_reduced.shape[1]
+        hessian = np.zeros((u_reduced.shape[0], dim, dim))
+        for k in range(dim):
+            shift = np.zeros(dim)
+            shift[k] = eps
+            hessian[:, :, k] = (closure.call(u_reduced + shift)[1] - closure.call(u_reduced - shift)[1]) / (2 * eps)
+        hessian = 0.5 * (hessian + np.transpose(hessian, (0, 2, 1)))
+        return [np.reshape(h, (-1,)).astype(np.float64), np.asarray(alpha, dtype=np.float64), hessian]
+
+    return source
+
+
+def inscribedRadius(mBasis, nDirections=360):
+    '''
+    returns: radius of the largest ball around 0 inside the realizable set of the quadrature, i.e. the minimal
+             support function of the projected quadrature points over all directions
+    '''
+    return realizability.supportRadius(mBasis, mBasis.shape[0] - 1, nDirections=nDirections)
+
+
+# positions of the refinement tests in an interval. The value error of the cubic Hermite interpolant is maximal at
+# the midpoint, where the error of its derivative (alpha) vanishes. The derivative error is maximal at (1 +- 1/sqrt(3))/2
+testPositions = np.array([0.5, 0.5 * (1.0 - 1.0 / np.sqrt(3.0)), 0.5 * (1.0 + 1.0 / np.sqrt(3.0))])
+
+
+def hermiteBasis(s):
+    '''
+    returns: [values, derivatives] of the cubic Hermite basis H0, H1, H2, H3 on [0, 1] at s, dims = (nS x 4).
+             p(s) = H0 p(0) + H1 p'(0) + H2 p(1) + H3 p'(1)
+    '''
+    s2 = s * s
+    s3 = s2 * s
+    values = np.stack([2 * s3 - 3 * s2 + 1, s3 - 2 * s2 + s, -2 * s3 + 3 * s2, s3 - s2], axis=1)
+    derivatives = np.stack([6 * s2 - 6 * s, 3 * s2 - 4 * s + 1, -6 * s2 + 6 * s, 3 * s2 - 2 * s], axis=1)
+    return [values, derivatives]
+
+
+def nodeData1D(source, nodes):
+    '''
+    returns: table data [h, dh/du_1] at the nodes, dims = (n x 2)
+    '''
+    [h, alpha, _] = source(nodes[:, np.newaxis])
+    return np.stack([h, alpha[:, 0]], axis=1)
+
+
+def nodeData2D(source, rNodes, nTheta):
+    '''
+    returns: table data [h, dh/dr, dh/dtheta, d^2h/drdtheta] at the polar nodes, dims = (nr x nTheta x 4)
+    '''
+    theta = 2.0 * np.pi * np.arange(nTheta) / nTheta
+    [r, theta] = [np.repeat(rNodes, nTheta), np.tile(theta, rNodes.size)]
+    eR = np.stack([np.cos(theta), np.sin(theta)], axis=1)
+    eTheta = np.stack([-np.sin(theta), np.cos(theta)], axis=1)
+    [h, alpha, hessian] = source(r[:, np.newaxis] * eR)
+    alphaR = np.sum(alpha * eR, axis=1)
+    alphaTheta = np.sum(alpha * eTheta, axis=1)
+    hRTheta = r * np.einsum('si,sij,sj->s', eR, hessian, eTheta) + alphaTheta  # d/dtheta (alpha * e_r)
+    return np.reshape(np.stack([h, alphaR, r * alphaTheta, hRTheta], axis=1), (rNodes.size, nTheta, 4))
+
+
+def tableError(hTable, alphaTable, h, alpha):
+    '''
+    returns: interpolation error per sample, max(|dh|, ||dalpha|| / max(1, ||alpha||)), dims = nS
+    '''
+    alphaNorm = np.maximum(np.linalg.norm(alpha, axis=1), 1.0)
+    return np.maximum(np.abs(hTable - h), np.linalg.norm(alphaTable - alpha, axis=1) / alphaNorm)
+
+
+def tabulateClosure(source, mBasis, quadWeights, spatialDim, tol=1e-6, rMax=None, nInitial=17, nThetaInitial=16,
+                    maxNodes=200000, nValidation=100000, seed=0, filename=None, sourceHash=None):
+    '''
+    Builds the table of a M1 closure on an adaptive grid. Intervals (1D) and radial intervals (2D) are bisected
+    where the interpolation error at their testPositions exceeds tol, the angular resolution (2D) is doubled, if the
+    error at the angular testPositions exceeds tol.
+    input: source = newtonSource or closureSource
+           mBasis = moment basis at the quadrature points of the closure, dims = (N x nq)
+           quadWeights = quadrature weights, dims = nq
+           rMax = radius of the tabulated part of the normalized realizable set. Default: 0.98 * inscribedRadius
+           maxNodes = maximal number of nodes, the refinement stops before exceeding it
+           nValidation = random samples for the maximal interpolation error against the source
+           filename = path of the .npz file of the table. Not saved, if None
+           sourceHash = identifier of the source, e.g. numpyClosure.paramsHash of the network weights. Stored with
+                        the table to detect outdated tables
+    returns: params = dict of numpy arrays, see tabulatedClosure
+    '''
+    if spatialDim not in [1, 2] or mBasis.shape[0] != spatialDim + 1:
+        raise ValueError("Tabulated closure only for M1 in 1D and 2D")
+    if rMax is None:
+        rMax = 0.98 * inscribedRadius(mBasis)
+    params = {"spatialDim": np.array(spatialDim), "rMax": np.array(rMax),
+              "momentBasis": np.asarray(mBasis, dtype=np.float64),
+              "quadWeights": np.reshape(np.asarray(quadWeights, dtype=np.float64), (-1,))}
+    if sourceHash is not None:
+        params["sourceHash"] = np.array(sourceHash)
+
+    if spatialDim == 1:
+        params["nodes"] = np.linspace(-rMax, rMax, nInitial)
+        params["table"] = nodeData1D(source, params["nodes"])
+        while True:
+            nodes = params["nodes"]
+            # test points of all intervals, dims = (nTest x nIntervals). Row 0 are the midpoints
+            points = nodes[:-1] + np.outer(testPositions, nodes[1:] - nodes[:-1])
+            [hTest, alphaTest, _] = source(np.reshape(points, (-1, 1)))
+            [hTable, alphaTable] = tabulatedClosure(params).call(np.reshape(points, (-1, 1)))
+            split = np.reshape(tableError(hTable[:, 0], alphaTable, hTest, alphaTest), points.shape).max(axis=0) > tol
+            if not split.any() or nodes.size + np.count_nonzero(split) > maxNodes:
+                break
+            # the midpoints become nodes, their data is already known
+            mids = points[0]
+            midData = np.stack([hTest, alphaTest[:, 0]], axis=1)[:mids.size]
+            order = np.argsort(np.concatenate([nodes, mids[split]]))
+            params["nodes"] = np.concatenate([nodes, mids[split]])[order]
+            params["table"] = np.concatenate([params["table"], midData[split]])[order]
+    else:
+        params["rNodes"] = np.linspace(0.0, rMax, nInitial)
+        nTheta = nThetaInitial
+        params["table"] = nodeData2D(source, params["rNodes"], nTheta)
+        while True:
+            rNodes = params["rNodes"]
+            closure = tabulatedClosure(params)
+            theta = 2.0 * np.pi * np.arange(nTheta) / nTheta
+            # radial test points at the angular nodes and angular test points at the radial nodes
+            rMids = 0.5 * (rNodes[:-1] + rNodes[1:])
+            rTest = rNodes[:-1] + np.outer(testPositions, rNodes[1:] - rNodes[:-1])  # dims = (nTest x nr-1)
+            [r, t] = [np.repeat(rTest, nTheta), np.tile(theta, rTest.size)]
+            radialError = np.reshape(closure.errorAt(source, r, t), (testPositions.size, rMids.size, nTheta)).max(
+                axis=(0, 2))
+            thetaTest = np.ravel(theta[np.newaxis, :] + 2.0 * np.pi / nTheta * testPositions[:, np.newaxis])
+            [r, t] = [np.repeat(rNodes, thetaTest.size), np.tile(thetaTest, rNodes.size)]
+            angularError = closure.errorAt(source, r, t).max()
+
+            split = radialError > tol
+            nThetaNew = 2 * nTheta if angularError > tol else nTheta
+            if (not split.any() and angularError <= tol) or (
+                    rNodes.size + np.count_nonzero(split)) * nThetaNew > maxNodes:
+                break
+            params["rNodes"] = np.sort(np.concatenate([rNodes, rMids[split]]))
+            nTheta = nThetaNew
+            params["table"] = nodeData2D(source, params["rNodes"], nTheta)
+
+    # maximal interpolation error against the source on uniform samples of the tabulated set
+    closure = tabulatedClosure(params)
+    rng = np.random.default_rng(seed)
+    if spatialDim == 1:
+        samples = rng.uniform(-rMax, rMax, size=(nValidation, 1))
+    else:
+        samples = tabulatedClosure.toCartesian(rMax * np.sqrt(rng.random(nValidation)),
+                                               2.0 * np.pi * rng.random(nValidation))
+    [h, alpha, _] = source(samples)
+    [hTable, alphaTable] = closure.call(samples)
+    params["maxErrorH"] = np.array(np.max(np.abs(hTable[:, 0] - h)))
+    params["maxErrorAlpha"] = np.array(np.max(np.abs(alphaTable - alpha)))
+    print("Tabulated closure: " + str(closure.nNodes()) + " nodes, max interpolation error against the source: h "
+          + str(params["maxErrorH"]) + ", alpha " + str(params["maxErrorAlpha"]))
+
+    if filename is not None:
+        np.savez(filename, **params)
+        print("Tabulated closure saved to " + filename)
+    return params
+
+
+### class definitions ###
+class tabulatedClosure:
+
+    def __init__(self, params, tol=1e-7, maxIter=100):
+        '''
+        input: params = table of tabulateClosure, or the path to its .npz file
+               tol, maxIter = Newton solver of the moments outside of the table
+        '''
+        if isinstance(params, str):
+            params = dict(np.load(params))
+        self.tol = tol
+        self.maxIter = maxIter
+        self.spatialDim = int(params["spatialDim"])
+        self.rMax = float(params["rMax"])
+        self.table = params["table"]
+        self.momentBasis = params["momentBasis"]
+        self.quadWeights = params["quadWeights"]
+        if self.spatialDim == 1:
+            self.nodes = params["nodes"]
+        else:
+            self.rNodes = params["rNodes"]
+            self.nTheta = self.table.shape[1]
+            self.dTheta = 2.0 * np.pi / self.nTheta
+        self.sourceHash = str(params.get("sourceHash", ""))
+        self.maxErrorH = float(params.get("maxErrorH", np.nan))
+        self.maxErrorAlpha = float(params.get("maxErrorAlpha", np.nan))
+        self.outsideRates = []  # fraction of the moments outside of the table per call_scaled, solved with Newton
+
+    def __call__(self, u_non_normal):
+        return self.call_scaled(u_non_normal)
+
+    @staticmethod
+    def toCartesian(r, theta):
+        return np.stack([r * np.cos(theta), r * np.sin(theta)], axis=1)
+
+    def nNodes(self):
+        return self.table.shape[0] if self.spatialDim == 1 else self.table.shape[0] * self.table.shape[1]
+
+    def outsideMask(self, u_reduced):
+        '''
+        returns: mask of the samples outside of the tabulated set |u_reduced| <= rMax, dims = nS
+        '''
+        return np.linalg.norm(u_reduced, axis=1) > self.rMax
+
+    def call(self, u_reduced):
+        '''
+        brief: interpolates h and its gradient alpha
+        input: u_reduced = [u_1,...,u_N] of normalized moments inside the table, dims = (nS x N-1)
+        returns: [h, alpha], dims = (nS x 1), (nS x N-1)
+        '''
+        if self.spatialDim == 1:
+            return self.call1D(np.asarray(u_reduced, dtype=np.float64)[:, 0])
+        u_reduced = np.asarray(u_reduced, dtype=np.float64)
+        r = np.linalg.norm(u_reduced, axis=1)
+        theta = np.mod(np.arctan2(u_reduced[:, 1], u_reduced[:, 0]), 2.0 * np.pi)
+        return self.call2D(r, theta)
+
+    def call1D(self, x):
+        idx = np.clip(np.searchsorted(self.nodes, x, side='right') - 1, 0, self.nodes.size - 2)
+        delta = self.nodes[idx + 1] - self.nodes[idx]
+        [values, derivatives] = hermiteBasis((x - self.nodes[idx]) / delta)
+        # coefficients of the Hermite basis: h_i, h'_i * delta, h_i+1, h'_i+1 * delta
+        coefficients = np.stack([self.table[idx, 0], self.table[idx, 1] * delta, self.table[idx + 1, 0],
+                                 self.table[idx + 1, 1] * delta], axis=1)
+        h = np.sum(values * coefficients, axis=1)
+        alpha = np.sum(derivatives * coefficients, axis=1) / delta
+        return [h[:, np.newaxis], alpha[:, np.newaxis]]
+
+    def call2D(self, r, theta):
+        i = np.clip(np.searchsorted(self.rNodes, r, side='right') - 1, 0, self.rNodes.size - 2)
+        deltaR = self.rNodes[i + 1] - self.rNodes[i]
+        position = theta / self.dTheta
+        j = np.mod(np.floor(position).astype(int), self.nTheta)
+        t = position - np.floor(position)
+        [valuesR, derivativesR] = hermiteBasis((r - self.rNodes[i]) / deltaR)
+        [valuesT, derivativesT] = hermiteBasis(t)
+
+        # corner data, dims = (nS x 2 x 2 x 4), the angular nodes are periodic
+        corners = np.stack([np.stack([self.table[i, j], self.table[i, (j + 1) % self.nTheta]], axis=1),
+                            np.stack([self.table[i + 1, j], self.table[i + 1, (j + 1) % self.nTheta]], axis=1)],
+                           axis=1)
+        # weights of the values (a, b) and of the derivatives in r and theta at the corners, dims = (nS x 2)
+        [wR, wRd, dwR, dwRd] = [valuesR[:, [0, 2]], valuesR[:, [1, 3]] * deltaR[:, np.newaxis],
+                                derivativesR[:, [0, 2]] / deltaR[:, np.newaxis], derivativesR[:, [1, 3]]]
+        [wT, wTd, dwT, dwTd] = [valuesT[:, [0, 2]], valuesT[:, [1, 3]] * self.dTheta,
+                                derivativesT[:, [0, 2]] / self.dTheta, derivativesT[:, [1, 3]]]
+
+        def interpolate(weightR, weightRd, weightT, weightTd):
+            return (np.einsum('sa,sab,sb->s', weightR, corners[..., 0], weightT)
+                    + np.einsum('sa,sab,sb->s', weightRd, corners[..., 1], weightT)
+                    + np.einsum('sa,sab,sb->s', weightR, corners[..., 2], weightTd)
+                    + np.einsum('sa,sab,sb->s', weightRd, corners[..., 3], weightTd))
+
+        h = interpolate(wR, wRd, wT, wTd)
+        hR = interpolate(dwR, dwRd, wT, wTd)
+        hTheta = interpolate(wR, wRd, dwT, dwTd)
+        # gradient in cartesian coordinates. h_theta / r stays finite for r -> 0
+        eR = self.toCartesian(np.ones(r.size), theta)
+        eTheta = np.stack([-eR[:, 1], eR[:, 0]], axis=1)
+        alpha = hR[:, np.newaxis] * eR + (hTheta / np.maximum(r, 1e-12))[:, np.newaxis] * eTheta
+        return [h[:, np.newaxis], alpha]
+
+    def errorAt(self, source, r, theta):
+        '''
+        returns: interpolation error (see tableError) against the source at the polar points, dims = nS
+        '''
+        [h, alpha, _] = source(self.toCartesian(r, theta))
+        [hTable, alphaTable] = self.call2D(r, theta)
+        return tableError(hTable[:, 0], alphaTable, h, alpha)
+
+    def call_scaled(self, u_non_normal):
+        '''
+        brief: counterpart of call_scaled_64 of the normalized closures. Moments outside of the table, i.e. close
+               to the realizable boundary, are solved with Newton. Raises, if Newton does not converge for them
+        input: u_non_normal, dims = (nS x N)
+        returns: [u, alpha, h], dims = (nS x N), (nS x N), (nS x 1). Newton cells return their moments u
+        '''
+        u_non_normal = np.asarray(u_non_normal, dtype=np.float64)
+        u_reduced = u_non_normal[:, 1:] / u_non_normal[:, 0:1]
+        outside = self.outsideMask(u_reduced)
+        self.outsideRates.append(np.count_nonzero(outside) / max(u_non_normal.shape[0], 1))
+        # the outside cells are evaluated at the origin of the table and replaced by Newton below
+        [_, alpha_reduced] = self.call(np.where(outside[:, np.newaxis], 0.0, u_reduced))
+        [u, alpha, h] = reconstructScaled(u_non_normal, alpha_reduced, self.momentBasis, self.quadWeights)
+        if not outside.any():
+            return [u, alpha, h]
+
+        alphaStart = np.zeros((np.count_nonzero(outside), u.shape[1]))
+        alphaStart[:, 0] = np.log(u_non_normal[outside, 0] / np.sum(self.quadWeights))  # isotropic density
+        [alphaNewton, hNewton, converged] = math.minimizeEntropyNewtonBatch(u=u_non_normal[outside],
+                                                                            alphaStart=alphaStart, m=self.momentBasis,
+                                                                            w=self.quadWeights, tol=self.tol,
+                                                                            maxIter=self.maxIter)
+        if not converged.all():
+            raise ValueError("Newton did not converge for " + str(np.count_nonzero(np.logical_not(converged)))
+                             + " moments outside of the tabulated closure")
+        # the dual objective of Newton is the negative entropy
+        u[outside] = u_non_normal[outside]
+        alpha[outside] = alphaNewton
+        h[outside, 0] = -hNewton
+        return [u, alpha, h]
@@ -0,0 +1,230 @@
+'''
+Realizable set of the normalized monomial moments (u_0 = 1) and rejection free samplers on it.
+1D (velocity interval [-1, 1]): the bounds of the next moment given the lower ones are roots of the Hankel
+determinants of the measures f, (1 + v) f and (1 - v) f. A moment vector is parametrized by its canonical moments
+p_k = (N_k - N_k^-) / (N_k^+ - N_k^-) in (0, 1). Independent p_k ~ Beta(N - k + 1, N - k + 1) are uniformly
+distributed on the moment space (Chang, Kemperman, Studden 1993).
+2D M1 (sphere projected to the x-y plane): the realizable set is the open unit disc.
+The boundary distance of u is the relative distance 1 - t on the ray from the center of the realizable set c through
+u, where u = c + t (b - c) and b is the boundary point of the ray.
+A quadrature only realizes moments of velocities inside the convex hull of its nodes. The samplers can be restricted
+to the velocity ball of radius a inside this hull, whose moments are the ones of [-1, 1] (or the unit disc) scaled by
+a^k in degree k.
+'''
+
+### imports ###
+import numpy as np
+
+
+defaultStrata = (1e-3, 1e-2, 1e-1, 1.0)  # edges of the boundary distance strata of sampleStratified
+
+
+### function definitions ###
+def checkSupport(polyDegree, spatialDim):
+    '''
+    Raises a ValueError, if the realizable set of the basis is not implemented (1D any degree, 2D degree 1)
+    '''
+    if not ((spatialDim == 1 and polyDegree >= 1) or (spatialDim == 2 and polyDegree == 1)):
+        raise ValueError("Realizable set sampler only for 1D moments and 2D M1, not for degree " + str(polyDegree)
+                         + " in " + str(spatialDim) + "D")
+
+
+def hankelMatrices(moments, k):
+    '''
+    brief: Hankel matrices of the moments N_0..N_k whose determinants bound N_k on [-1, 1]
+    input: moments = normalized moments N_0..N_k, dims = (nS x k+1)
+           k = index of the bounded moment, k >= 1
+    returns: [lowerMatrix, upperMatrix], dims = (nS x m x m).
+             det(lowerMatrix) = 0 at N_k = N_k^-, det(upperMatrix) = 0 at N_k = N_k^+
+    '''
+    if k % 2 == 0:  # k = 2m: [N_{i+j}]_{i,j=0..m} and [N_{i+j} - N_{i+j+2}]_{i,j=0..m-1}
+        m = k // 2
+        idxLower = np.add.outer(np.arange(m + 1), np.arange(m + 1))
+        idxUpper = np.add.outer(np.arange(m), np.arange(m))
+        return [moments[:, idxLower], moments[:, idxUpper] - moments[:, idxUpper + 2]]
+    # k = 2m + 1: [N_{i+j} + N_{i+j+1}]_{i,j=0..m} and [N_{i+j} - N_{i+j+1}]_{i,j=0..m}
+    m = (k - 1) // 2
+    idx = np.add.outer(np.arange(m + 1), np.arange(m + 1))
+    return [moments[:, idx] + moments[:, idx + 1], moments[:, idx] - moments[:, idx + 1]]
+
+
+def momentBounds1D(moments):
+    '''
+    brief: bounds of the next normalized moment N_k on [-1, 1], given N_0..N_{k-1}. The Hankel determinants are
+           linear in N_k, their roots are found from two evaluations.
+    input: moments = normalized moments N_0..N_{k-1} (N_0 = 1), dims = (nS x k)
+    returns: [lower, upper], dims = nS
+    '''
+    k = moments.shape[1]
+    extended = np.concatenate([moments, np.zeros((moments.shape[0], 1))], axis=1)
+    determinants0 = [np.linalg.det(matrix) for matrix in hankelMatrices(extended, k)]
+    extended[:, k] = 1.0
+    determinants1 = [np.linalg.det(matrix) for matrix in hankelMatrices(extended, k)]
+    return [-d0 / (d1 - d0) for d0, d1 in zip(determinants0, determinants1)]
+
+
+def momentsFromCanonical1D(canonical):
+    '''
+    input: canonical = canonical moments p_1..p_N in (0, 1), dims = (nS x N)
+    returns: normalized moments N_0..N_N, dims = (nS x N+1)
+    '''
+    moments = np.ones((canonical.shape[0], 1))
+    for k in range(canonical.shape[1]):
+        [lower, upper] = momentBounds1D(moments)
+        moments = np.concatenate([moments, (lower + canonical[:, k] * (upper - lower))[:, np.newaxis]], axis=1)
+    return moments
+
+
+def canonicalFromMoments1D(moments):
+    '''
+    input: moments = normalized moments N_0..N_N, dims = (nS x N+1)
+    returns: canonical moments p_1..p_N, dims = (nS x N). All in (0, 1) for interior moments. After the first p_k
+             outside of (0, 1), the remaining entries are nan.
+    '''
+    canonical = np.full((moments.shape[0], moments.shape[1] - 1), np.nan)
+    valid = np.ones(moments.shape[0], dtype=bool)
+    for k in range(1, moments.shape[1]):
+        [lower, upper] = momentBounds1D(moments[valid, :k])
+        canonical[valid, k - 1] = (moments[valid, k] - lower) / (upper - lower)
+        valid[valid] = (canonical[valid, k - 1] > 0.0) & (canonical[valid, k - 1] < 1.0)
+    return canonical
+
+
+def isRealizable(u, polyDegree, spatialDim):
+    '''
+    returns: mask of the interior points of the realizable set, dims = nS
+    input: u = normalized moments incl. u_0 = 1, dims = (nS x N)
+    '''
+    checkSupport(polyDegree, spatialDim)
+    if spatialDim == 2:
+        return np.linalg.norm(u[:, 1:], axis=1) < 1.0
+    canonical = canonicalFromMoments1D(u)
+    return np.all((canonical > 0.0) & (canonical < 1.0), axis=1)
+
+
+def getCenterMoments(polyDegree, spatialDim):
+    '''
+    returns: moments of the isotropic (uniform) density, i.e. the center of the boundary distance, dims = N
+    '''
+    checkSupport(polyDegree, spatialDim)
+    if spatialDim == 2:
+        return np.array([1.0, 0.0, 0.0])
+    return np.array([1.0 / (k + 1) if k % 2 == 0 else 0.0 for k in range(polyDegree + 1)])
+
+
+def sampleUniform(nS, polyDegree, spatialDim, rng):
+    '''
+    Samples normalized moments uniformly on the realizable set, without rejection
+    returns: u, dims = (nS x N), u_0 = 1
+    '''
+    checkSupport(polyDegree, spatialDim)
+    if spatialDim == 2:
+        radius = np.sqrt(rng.random(nS))
+        angle = 2.0 * np.pi * rng.random(nS)
+        return np.stack([np.ones(nS), radius * np.cos(angle), radius * np.sin(angle)], axis=1)
+    shapes = polyDegree - np.arange(polyDegree)  # N - k + 1 for k = 1..N
+    return momentsFromCanonical1D(rng.beta(shapes, shapes, size=(nS, polyDegree)))
+
+
+def boundaryPoints(u, polyDegree, spatialDim, iterations=60):
+    '''
+    brief: intersection of the rays from the center through u with the boundary of the realizable set
+           (bisection in 1D, exact in 2D)
+    input: u = interior normalized moments, dims = (nS x N)
+    returns: [b, t], boundary points, dims = (nS x N), and relative position t of u on the ray, u = c + t (b - c)
+    '''
+    center = getCenterMoments(polyDegree, spatialDim)
+    direction = u - center
+    if spatialDim == 2:
+        t = np.linalg.norm(u[:, 1:], axis=1)
+        return [center + direction / t[:, np.newaxis], t]
+    # bisection on the scaling s of the direction, c + s (u - c) is realizable for s = 1
+    sInner = np.ones(u.shape[0])
+    sOuter = 2.0 * np.ones(u.shape[0])
+    inside = isRealizable(center + sOuter[:, np.newaxis] * direction, polyDegree, spatialDim)
+    while inside.any():  # the realizable set is bounded, so doubling terminates
+        sInner[inside] = sOuter[inside]
+        sOuter[inside] *= 2.0
+        inside = isRealizable(center + sOuter[:, np.newaxis] * direction, polyDegree, spatialDim)
+    for i in range(iterations):
+        sMid = 0.5 * (sInner + sOuter)
+        inside = isRealizable(center + sMid[:, np.newaxis] * direction, polyDegree, spatialDim)
+        sInner = np.where(inside, sMid, sInner)
+        sOuter = np.where(inside, sOuter, sMid)
+    return [center + sInner[:, np.newaxis] * direction, 1.0 / sInner]
+
+
+def boundaryDistance(u, polyDegree, spatialDim):
+    '''
+    returns: relative distance 1 - t of u to the boundary of the realizable set, in (0, 1], dims = nS
+    '''
+    return 1.0 - boundaryPoints(u, polyDegree, spatialDim)[1]
+
+
+def sampleStratified(nS, polyDegree, spatialDim, rng, strata=defaultStrata, fractions=None, returnStrata=False):
+    '''
+    Samples normalized moments stratified by the relative boundary distance, without rejection. The directions are
+    taken from uniform samples, the distance 1 - t is uniform within each stratum.
+    input: strata = edges of the distance strata, ascending in (0, 1]
+           fractions = fraction of the samples per stratum. Default: equal fractions
+           returnStrata = additionally return the stratum index of each sample
+    returns: u, dims = (nS x N), u_0 = 1. [u, strataIdx], if returnStrata
+    '''
+    strata = np.asarray(strata, dtype=float)
+    nStrata = strata.size - 1
+    if fractions is None:
+        fractions = np.ones(nStrata) / nStrata
+    counts = np.floor(np.asarray(fractions, dtype=float) / np.sum(fractions) * nS).astype(int)
+    counts[:nS - counts.sum()] += 1  # distribute the rounding remainder
+    distance = np.concatenate([rng.uniform(strata[i], strata[i + 1], size=counts[i]) for i in range(nStrata)])
+    strataIdx = np.repeat(np.arange(nStrata), counts)
+    permutation = rng.permutation(nS)
+    [distance, strataIdx] = [distance[permutation], strataIdx[permutation]]
+
+    center = getCenterMoments(polyDegree, spatialDim)
+    [boundary, _] = boundaryPoints(sampleUniform(nS, polyDegree, spatialDim, rng), polyDegree, spatialDim)
+    u = center + (1.0 - distance)[:, np.newaxis] * (boundary - center)
+    if returnStrata:
+        return [u, strataIdx]
+    return u
+
+
+def supportRadius(mBasis, spatialDim, nDirections=360):
+    '''
+    returns: radius a of the largest velocity ball around 0 inside the convex hull of the quadrature nodes, i.e. the
+             minimal support function of the nodes over all directions
+    input: mBasis = monomial basis at the quadrature points, rows 1..spatialDim are the velocity components
+    '''
+    velocities = np.asarray(mBasis[1:spatialDim + 1, :], dtype=np.float64)  # dims = (spatialDim x nq)
+    if spatialDim == 1:
+        return min(velocities.max(), -velocities.min())
+    angles = np.linspace(0.0, 2.0 * np.pi, nDirections, endpoint=False)
+    directions = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+    return np.min(np.max(np.matmul(directions, velocities), axis=1))
+
+
+def scaleToSupport(u, radius, polyDegree, spatialDim):
+    '''
+    Maps normalized moments of velocities in [-1, 1] (unit disc) to the ones of velocities in [-a, a] (disc of radius
+    a). The map is linear, so the relative boundary distance is kept.
+    returns: u with the moments of degree k scaled by radius^k, dims = (nS x N)
+    '''
+    checkSupport(polyDegree, spatialDim)
+    degrees = np.arange(polyDegree + 1) if spatialDim == 1 else np.array([0, 1, 1])
+    return u * np.power(radius, degrees)
+
+
+def sampleRealizable(nS, polyDegree, spatialDim, rng, mode="uniform", radius=1.0, **opts):
+    '''
+    Dispatches to sampleUniform (mode = "uniform") or sampleStratified (mode = "boundary")
+    input: radius = velocity support of the realizable set, e.g. supportRadius of a quadrature
+    returns: u, dims = (nS x N), u_0 = 1. [u, strataIdx] for mode = "boundary" with returnStrata
+    '''
+    if mode == "uniform":
+        return scaleToSupport(sampleUniform(nS, polyDegree, spatialDim, rng), radius, polyDegree, spatialDim)
+    if mode == "boundary":
+        samples = sampleStratified(nS, polyDegree, spatialDim, rng, **opts)
+        if opts.get("returnStrata", False):
+            return [scaleToSupport(samples[0], radius, polyDegree, spatialDim), samples[1]]
+        return scaleToSupport(samples, radius, polyDegree, spatialDim)
+    raise ValueError("Unknown realizable sampling mode " + str(mode))
@@ -0,0 +1,113 @@
+'''
+Numerically stabilized quadrature reductions for the Maxwell-Boltzmann moment maps (tensorflow).
+All reductions of the form <b exp(alpha*m)> are evaluated with the exponent shifted by its maximum over the
+quadrature points (log-sum-exp), so they neither overflow nor underflow in float32. The quadrature axis can be
+processed in chunks with a running maximum, so no (nS x nq) tensor of the full quadrature is materialized.
+'''
+
+### imports ###
+import tensorflow as tf
+
+
+### function definitions ###
+def shiftedReduction(alpha, mBasis, quadWeights, reductionBasis, chunkSize=None, accumulationDtype=None):
+    '''
+    brief: computes <b exp(alpha*m - s)> and the shift s = max_q(alpha*m), chunked over the quadrature axis.
+           Chunks with a bigger maximum rescale the accumulated sum by exp(s_old - s_new).
+    nS = batchSize
+    N = basisSize
+    nq = number of quadPts
+    input: alpha, dims = (nS x N)
+           mBasis, dims = (N x nq)
+           quadWeights, dims = (1 x nq) or nq
+           reductionBasis = b, dims = (K x nq)
+           chunkSize = number of quadrature points per chunk. None uses a single chunk
+           accumulationDtype = dtype of the quadrature sums (e.g. tf.float64). Default: dtype of alpha
+    returns: [reduction, shift], dims = (nS x K), (nS x 1), in accumulationDtype
+    '''
+    dtype = alpha.dtype
+    if accumulationDtype is None:
+        accumulationDtype = dtype
+    mBasis = tf.cast(mBasis, dtype=dtype)
+    quadWeights = tf.reshape(tf.cast(quadWeights, dtype=accumulationDtype), shape=(1, -1))
+    reductionBasis = tf.cast(reductionBasis, dtype=accumulationDtype)
+    nq = mBasis.shape[1]
+    if chunkSize is None or chunkSize >= nq:
+        chunkSize = nq
+
+    reduction = None
+    shift = None
+    for start in range(0, nq, chunkSize):
+        end = min(start + chunkSize, nq)
+        exponent = tf.matmul(alpha, mBasis[:, start:end])  # alpha*m, dims = (nS x chunkSize)
+        chunkShift = tf.math.reduce_max(exponent, axis=1, keepdims=True)
+        exponent = tf.cast(exponent, dtype=accumulationDtype)
+        chunkShift = tf.cast(chunkShift, dtype=accumulationDtype)
+        if shift is None:
+            newShift = chunkShift
+        else:
+            newShift = tf.math.maximum(shift, chunkShift)
+        f_w = tf.math.exp(exponent - newShift) * quadWeights[:, start:end]  # exp(alpha*m - s)*w <= w
+        chunkReduction = tf.matmul(f_w, reductionBasis[:, start:end], transpose_b=True)
+        if reduction is None:
+            reduction = chunkReduction
+        else:
+            reduction = reduction * tf.math.exp(shift - newShift) + chunkReduction
+        shift = newShift
+    return [reduction, shift]
+
+
+def logQuadratureExp(alpha, mBasis, quadWeights, chunkSize=None):
+    '''
+    brief: log-sum-exp evaluation of ln(<exp(alpha*m)>)
+    input: alpha, dims = (nS x N)
+           mBasis, dims = (N x nq)
+           quadWeights, dims = (1 x nq) or nq
+    returns: ln(<exp(alpha*m)>), dims = (nS x 1)
+    '''
+    ones = tf.ones(shape=(1, mBasis.shape[1]), dtype=alpha.dtype)
+    [reduction, shift] = shiftedReduction(alpha, mBasis, quadWeights, ones, chunkSize)
+    return tf.math.log(reduction) + shift
+
+
+def shiftedMoments(alpha, mBasis, quadWeights, chunkSize=None):
+    '''
+    brief: moments of the Maxwell-Boltzmann ansatz up to the factor exp(s), i.e. u = exp(s) * <m exp(alpha*m - s)>
+    input: alpha, dims = (nS x N)
+           mBasis, dims = (N x nq)
+           quadWeights, dims = (1 x nq) or nq
+    returns: [<m exp(alpha*m - s)>, s], dims = (nS x N), (nS x 1)
+    '''
+    return shiftedReduction(alpha, mBasis, quadWeights, mBasis, chunkSize)
+
+
+def reconstructAlpha0(alpha_reduced, mBasis, quadWeights, chunkSize=None):
+    '''
+    brief: alpha_0 = -ln(<exp(alpha_r*m_r)>) of normalized moments (u_0 = 1)
+    input: alpha_reduced = [alpha_1,...,alpha_N], dims = (nS x N-1)
+           mBasis = complete basis [m_0,...,m_N], dims = (N x nq)
+    returns: alpha_0, dims = (nS x 1)
+    '''
+    return -logQuadratureExp(alpha_reduced, tf.cast(mBasis, dtype=alpha_reduced.dtype)[1:, :], quadWeights,
+                             chunkSize)
+
+
+def reconstructU(alpha, mBasis, quadWeights, chunkSize=None):
+    '''
+    brief: u = <m exp(alpha*m)>
+    input: alpha, dims = (nS x N)
+    returns: u, dims = (nS x N)
+    '''
+    [moments, shift] = shiftedMoments(alpha, mBasis, quadWeights, chunkSize)
+    return moments * tf.math.exp(shift)
+
+
+def computeH(u, alpha, mBasis, quadWeights, chunkSize=None):
+    '''
+    brief: entropy h = alpha*u - <exp(alpha*m)>
+    input: u, dims = (nS x N)
+           alpha, dims = (nS x N)
+    returns: h, dims = (nS x 1)
+    '''
+    eta = tf.math.exp(logQuadratureExp(alpha, mBasis, quadWeights, chunkSize))
+    return tf.math.reduce_sum(alpha * u, axis=1, keepdims=True) - eta
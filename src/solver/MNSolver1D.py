@@ -14,12 +14,16 @@ from matplotlib import animation
 from matplotlib.colors import LogNorm
 import multiprocessing
 import pandas as pd
-from joblib import Parallel, delayed
 
 # inpackage imports
 # from neuralClosures.configModel import initNeuralClosure
 from src import math
+from src import realizability
+from src.activeLearning import activeLearningBuffer
 from src.neuralClosures.configModel import initNeuralClosure
+from src.neuralClosures.inferenceEngine import inferenceEngine
+from src.neuralClosures.numpyClosure import numpyClosure, exportNumpyClosure
+from src.solver.referenceClosure import referenceClosure
 
 num_cores = multiprocessing.cpu_count()
 
@@ -35,17 +39,28 @@ def main():
 
 class MNSolver1D:
 
-    def __init__(self, traditional=False, polyDegree=3):
+    def __init__(self, traditional=False, polyDegree=3, parallel=False, incrementalTol=0.0, numpyBackend=False,
+                 activeLearning=False, retrainInterval=100, fusedCore=False, rootFolder="../../"):
 
         # Prototype for  spatialDim=1, polyDegree=2
         self.nSystem = polyDegree + 1
         self.polyDegree = polyDegree
         self.quadOrder = 10
         self.traditional = traditional
-        [self.quadPts, self.quadWeights] = math.qGaussLegendre1D(self.quadOrder)  # dims = nq
+        self.parallel = parallel  # solve the reference closure on all cores
+        self.incrementalTol = incrementalTol  # skip the reference closure in cells that changed less than this
+        self.rootFolder = rootFolder  # repository root relative to the working directory, holds models/ and data/
+        # read only arrays of the process wide quadrature registry
+        [self.quadPts, self.quadWeights, self.mBasis] = math.getQuadratureBasis(1, self.polyDegree,
+                                                                             self.quadOrder)  # dims = (N x nq)
         self.nq = self.quadWeights.size
-        self.mBasis = math.computeMonomialBasis1D(self.quadPts, self.polyDegree)  # dims = (N x nq)
         self.inputDim = self.mBasis.shape[0]  # = self.nSystem
+        # split quadrature in positive and negative directions once for vectorized upwinding
+        self.quadIdxPos = self.quadPts > 0
+        self.quadIdxNeg = np.logical_not(self.quadIdxPos)
+        upwindBasis = self.mBasis * (self.quadWeights * self.quadPts)  # m * w * mu, dims = (N x nq)
+        self.upwindBasisPos = upwindBasis[:, self.quadIdxPos]
+        self.upwindBasisNeg = upwindBasis[:, self.quadIdxNeg]
 
         # generate geometry
         self.x0 = -1.5
@@ -73,19 +88,42 @@ class MNSolver1D:
         self.u2 = self.ICperiodic()  # self.ICLinesource()  # self.ICperiodic()
         self.alpha2 = np.zeros((self.nSystem, self.nx))
         self.xFlux2 = np.zeros((self.nSystem, self.nx), dtype=float)
+        # Reference closure
+        self.referenceClosure = referenceClosure(self.mBasis, self.quadWeights, nCells=self.nx,
+                                                 nWorkers=num_cores if self.parallel else 1, tol=1e-7,
+                                                 incrementalTol=self.incrementalTol)
         # Neural closure
         self.neuralClosure = None
+        self.modelFolder = None
+        self.numpyBackend = numpyBackend
+        self.activeLearning = None
         if not self.traditional:
             if self.polyDegree == 2:
                 self.neuralClosure = initNeuralClosure(modelNumber=11, polyDegree=2, spatialDim=1,
                                                        folderName="002_sim_M2_1D", lossCombi=2,
                                                        width=15, depth=7, normalized=True)
-                self.neuralClosure.loadModel("../../models/002_sim_M2_1D")
             elif self.polyDegree == 3:
                 self.neuralClosure = initNeuralClosure(modelNumber=13, polyDegree=3, spatialDim=1,
                                                        folderName="002_sim_M3_1D", lossCombi=2,
                                                        width=20, depth=7, normalized=True)
-                self.neuralClosure.loadModel("../../models/002_sim_M3_1D")
+            # all model artifacts (weights, exported closures) live in the folder of the loaded model
+            self.modelFolder = self.rootFolder + self.neuralClosure.filename
+            self.neuralClosure.loadModel(self.modelFolder)
+            if fusedCore:
+                # single pass h and alpha instead of the GradientTape, needs tf_keras (see callNeuralClosure)
+                self.neuralClosure.useFusedCore()
+            # compiled closure, traced once per batch bucket. The stabilized fp32 post processing is accurate enough
+            self.closureEngine = inferenceEngine(self.neuralClosure, closureName="call_scaled")
+            if numpyBackend:
+                # tensorflow free evaluation of the exported weights
+                self.closureEngine = numpyClosure(
+                    exportNumpyClosure(self.neuralClosure, filename=self.modelFolder + "/numpy_closure.npz"))
+            if activeLearning:
+                # error hotspots of the neural solver, periodically used to fine tune the closure
+                # the original training data is replayed in each fine tuning
+                replayFile = self.rootFolder + self.neuralClosure.getTrainingDataFilename(normalizedData=True)
+                self.activeLearning = activeLearningBuffer(self.neuralClosure, retrainInterval=retrainInterval,
+                                                           replayFile=replayFile)
 
         # Analysis variables
         self.errorMap = np.zeros((self.nSystem, self.nx))
@@ -130,22 +168,15 @@ class MNSolver1D:
                 uIc[0, i] = 1.0
                 uIc[1, i] = 0.0
                 uIc[2, i] = 0.5
-                if self.polyDegree == 3:
-                    N1 = uIc[1, i] / uIc[0, i]
-                    N2 = uIc[2, i] / uIc[0, i]
-                    upper = N2 - (N1 - N2) ** 2 / (1 - N1)
-                    lower = - N2 + (N1 + N2) ** 2 / (1 + N1)
-                    uIc[3, i] = (upper + lower / 2) * uIc[0, i]
             else:
                 uIc[0, i] = 0.5
                 uIc[1, i] = 0.0
                 uIc[2, i] = 0.25
-                if self.polyDegree == 3:
-                    N1 = uIc[1, i] / uIc[0, i]
-                    N2 = uIc[2, i] / uIc[0, i]
-                    upper = N2 - (N1 - N2) ** 2 / (1 - N1)
-                    lower = - N2 + (N1 + N2) ** 2 / (1 + N1)
-                    uIc[3, i] = (upper + lower / 2) * uIc[0, i]
+
+            if self.polyDegree == 3:
+                # realizability bounds of N3 given N1, N2
+                [lower, upper] = realizability.momentBounds1D(uIc[np.newaxis, 0:3, i] / uIc[0, i])
+                uIc[3, i] = (upper[0] + lower[0] / 2) * uIc[0, i]
 
             # uIc[0, i] = sincos(x=xKoor)
             # uIc[1, i] = 0.0  # 0.8 * uIc[0, i]  # 0.5 * uIc[0, i]  # realizable
@@ -269,8 +300,15 @@ class MNSolver1D:
     def entropyClosureNewton(self):
 
         # if (self.traditional): # NEWTON
-        for i in range(self.nx):
-            self.entropyClosureSingleRow(i)
+        # all cells at once with the batched newton solver (parallel if enabled), warm started from the last alpha
+        [alpha, h, converged] = self.referenceClosure(np.transpose(self.u), np.transpose(self.alpha))
+        self.referenceClosure.reportTimings()
+        self.referenceClosure.reportSkipRate()
+        if not converged.all():
+            print("Optimization unsuccessfull! u=" + str(self.u[:, np.logical_not(converged)]))
+            exit(ValueError)
+        self.alpha = np.transpose(alpha)
+        self.h = h
         return 0
 
     def entropyClosureSingleRow(self, i):
@@ -379,58 +417,54 @@ class MNSolver1D:
         return opti_entropy_prime2nd
 
     def realizabilityReconstruction(self):
-
-        for i in range(self.nx):
-            # self.u2[:, i] = np.copy(self.u[:, i])
-            a = np.reshape(self.alpha[:, i], (1, self.nSystem))
-            self.u[:, i] = math.reconstructU(alpha=a, m=self.mBasis, w=self.quadWeights)
-            # print("(" + str(self.u2[:, i]) + " | " + str(self.u[:, i]))
-            # h = self.create_opti_entropy(self.u[:, i])(self.alpha[:, i])
-            # row = [0, self.u[0, i], self.u[1, i], self.u[2, i], self.alpha[0, i], self.alpha[1, i],
-            #       self.alpha[2, i], h]
-
+        # all cells at once, reconstructU works on batches of alpha.
+        # cells skipped by the incremental reference closure keep their moments, since the cached alpha belongs to
+        # an older u
+        solved = self.referenceClosure.solvedMask
+        self.u[:, solved] = np.transpose(
+            math.reconstructU(alpha=np.transpose(self.alpha[:, solved]), m=self.mBasis, w=self.quadWeights))
         return 0
 
     def compareAndRetrain(self):
-        # open the file in the write mode
-        with open('csv_writeout/Monomial_M2_1D.csv', 'a+', newline='') as f:
-            # create the csv writer
-            writer = csv.writer(f)
-            for i in range(self.nx):
-                h = self.create_opti_entropy(self.u[:, i])(self.alpha[:, i])
-                row = [0, self.u[0, i], self.u[1, i], self.u[2, i], self.alpha[0, i], self.alpha[1, i],
-                       self.alpha[2, i], h]
-                writer.writerow(row)
-
-                h = self.create_opti_entropy(self.u2[:, i])(self.alpha2[:, i])
-                row = [1, self.u2[0, i], self.u2[1, i], self.u2[2, i], self.alpha2[0, i], self.alpha2[1, i],
-                       self.alpha2[2, i], h]
-                # write a row to the csv file
-                writer.writerow(row)
+        """
+        brief: active learning step. Labels the cells of the neural solver with the reference closure, warm started
+               from the network alpha, and passes them to the active learning buffer. The buffer keeps the error
+               hotspots and periodically fine tunes the neural closure.
+        """
+        if self.activeLearning is None:
+            return 0
+        u = np.transpose(self.u2)
+        alphaTheta = np.transpose(self.alpha2)
+        [alpha, h, converged] = math.minimizeEntropyNewtonBatch(u=u, alphaStart=alphaTheta, m=self.mBasis,
+                                                                w=self.quadWeights, tol=1e-7)
+        uTheta = math.reconstructU(alpha=alphaTheta, m=self.mBasis, w=self.quadWeights)
+        if self.activeLearning.addCells(u[converged], alpha[converged], uTheta[converged], alphaTheta[converged]):
+            if self.numpyBackend:
+                # the numpy closure holds a copy of the weights
+                self.closureEngine = numpyClosure(
+                    exportNumpyClosure(self.neuralClosure, filename=self.modelFolder + "/numpy_closure.npz"))
         return 0
 
     def computeFluxNewton(self):
         """
         for periodic boundaries, upwinding.
-        writes to xFlux and yFlux, uses alpha
+        writes to xFlux, uses alpha
         """
-        for i in range(self.nx):
-
-            # Computation in x direction
-            im1 = i - 1
-            if i == 0:  # periodic boundaries
-                im1 = self.nx - 1
-            left = np.tensordot(self.alpha[:, im1], self.mBasis, axes=([0], [0]))
-            right = np.tensordot(self.alpha[:, i], self.mBasis, axes=([0], [0]))
-            fluxL = math.entropyDualPrime(left)
-            fluxR = math.entropyDualPrime(right)
-            flux = 0
-            for q in range(self.nq):  # integrate upwinding result
-                upwind = self.upwinding(fluxL[q], fluxR[q], self.quadPts[q])
-                flux = flux + upwind * self.quadWeights[q] * self.mBasis[:, q]
-            self.xFlux[:, i] = flux
+        self.xFlux = self.computeFluxVectorized(self.alpha)
         return 0
 
+    def computeFluxVectorized(self, alpha):
+        """
+        brief: kinetic upwind flux at all cell interfaces (i-1/2) of the periodic grid at once
+        input: alpha, dims = (N x nx)
+        returns: flux, dims = (N x nx), flux[:, i] = <mu * m * f_upwind> at the left interface of cell i
+        """
+        alphaLeft = np.roll(alpha, 1, axis=1)  # periodic left neighbour
+        # positive directions take the left state, negative directions the right state
+        fluxL = math.entropyDualPrime(np.matmul(alphaLeft.T, self.mBasis[:, self.quadIdxPos]))  # dims = (nx x nqPos)
+        fluxR = math.entropyDualPrime(np.matmul(alpha.T, self.mBasis[:, self.quadIdxNeg]))  # dims = (nx x nqNeg)
+        return np.matmul(self.upwindBasisPos, fluxL.T) + np.matmul(self.upwindBasisNeg, fluxR.T)
+
     def upwinding(self, fluxL, fluxR, quadpt):
         # t = np.inner(quadpt, normal)
         if quadpt > 0:
@@ -439,71 +473,39 @@ class MNSolver1D:
             return quadpt * fluxR
 
     def FVMUpdateNewton(self):
-        for i in range(self.nx):
-            ip1 = i + 1
-            # periodic boundaries
-            if i == self.nx - 1:
-                ip1 = 0
-
-            # Advection
-            self.u[:, i] = self.u[:, i] + ((self.xFlux[:, i] - self.xFlux[:, ip1]) / self.dx) * self.dt
-            # Scattering
-            # self.u[0, i, j] = self.u[0, i, j] + (
-            #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
-            # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
+        # Advection, periodic boundaries
+        self.u = self.u + ((self.xFlux - np.roll(self.xFlux, -1, axis=1)) / self.dx) * self.dt
+        # Scattering
+        # self.u[0, i, j] = self.u[0, i, j] + (
+        #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
+        # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
 
         return 0
 
     def entropyClosureML(self):
         tmp = np.copy(np.transpose(self.u2))
-        [u_pred, alpha_pred, h] = self.neuralClosure.call_scaled_64(np.asarray(tmp))
+        [u_pred, alpha_pred, h] = self.closureEngine(np.asarray(tmp))
 
-        for i in range(self.nx):
-            # self.u2[:, i] = u_pred[i, :]
-            t = alpha_pred[i, :].numpy()
-            a = t.reshape((1, self.nSystem))
-            # self.u2[:, i] = math.reconstructU(alpha=a, m=self.mBasis, w=self.quadWeights)
-            self.alpha2[:, i] = alpha_pred[i, :]
-            self.h2[i] = h[i]
-            # print("(" + str(self.u2[:, i]) + " | " + str(tmp[i, :]) + " | " + str(
-            #    np.linalg.norm(self.u2[:, i] - tmp[i, :], 2)))
+        # self.u2 = np.transpose(np.asarray(u_pred))
+        self.alpha2 = np.transpose(np.asarray(alpha_pred))
+        self.h2 = np.reshape(np.asarray(h), (self.nx,))
         return 0
 
     def computeFluxML(self):
         """
         for periodic boundaries, upwinding.
-        writes to xFlux and yFlux, uses alpha
+        writes to xFlux2, uses alpha2
         """
-        for i in range(self.nx):
-
-            # Computation in x direction
-            im1 = i - 1
-            if i == 0:  # periodic boundaries
-                im1 = self.nx - 1
-            left = np.tensordot(self.alpha2[:, im1], self.mBasis, axes=([0], [0]))
-            right = np.tensordot(self.alpha2[:, i], self.mBasis, axes=([0], [0]))
-            fluxL = math.entropyDualPrime(left)
-            fluxR = math.entropyDualPrime(right)
-            flux = 0
-            for q in range(self.nq):  # integrate upwinding result
-                upwind = self.upwinding(fluxL[q], fluxR[q], self.quadPts[q])
-                flux = flux + upwind * self.quadWeights[q] * self.mBasis[:, q]
-            self.xFlux2[:, i] = flux
+        self.xFlux2 = self.computeFluxVectorized(self.alpha2)
         return 0
 
     def FVMUpdateML(self):
-        for i in range(self.nx):
-            ip1 = i + 1
-            # periodic boundaries
-            if i == self.nx - 1:
-                ip1 = 0
-
-            # Advection
-            self.u2[:, i] = self.u2[:, i] + ((self.xFlux2[:, i] - self.xFlux2[:, ip1]) / self.dx) * self.dt
-            # Scattering
-            # self.u[0, i, j] = self.u[0, i, j] + (
-            #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
-            # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
+        # Advection, periodic boundaries
+        self.u2 = self.u2 + ((self.xFlux2 - np.roll(self.xFlux2, -1, axis=1)) / self.dx) * self.dt
+        # Scattering
+        # self.u[0, i, j] = self.u[0, i, j] + (
+        #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
+        # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
 
         return 0
 
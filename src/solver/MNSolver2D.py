@@ -4,6 +4,7 @@ Author: Steffen Schotthöfer
 Date: 17.05.2021
 """
 
+import os
 import sys
 
 sys.path.append('../..')
@@ -17,10 +18,13 @@ from matplotlib.colors import LogNorm
 import multiprocessing
 import csv
 
-from joblib import Parallel, delayed
-
 # inpackage imports
 from src.neuralClosures.configModel import initNeuralClosure
+from src.neuralClosures.inferenceEngine import inferenceEngine
+from src.neuralClosures.numpyClosure import numpyClosure, exportNumpyClosure, paramsHash
+from src.neuralClosures.tabulatedClosure import tabulatedClosure, tabulateClosure, closureSource
+from src.solver.referenceClosure import referenceClosure
+from src.solver.hybridClosure import hybridClosure
 from src import utils
 
 num_cores = multiprocessing.cpu_count()
@@ -37,17 +41,27 @@ def main():
 
 
 class MNSolver2D:
-    def __init__(self, traditional=True):
+    def __init__(self, traditional=True, parallel=False, incrementalTol=0.0, numpyBackend=False, hybrid=False,
+                 tabulatedBackend=False, fusedCore=False, rootFolder="../../"):
 
         # Prototype for  spatialDim=2, polyDegree=1
         self.nSystem = 3
         self.polyDegree = 1
         self.quadOrder = 10
         self.traditional = traditional
-        [self.quadPts, self.quadWeights] = math.qGaussLegendre2D(self.quadOrder)  # dims = nq
+        self.parallel = parallel  # solve the reference closure on all cores
+        self.incrementalTol = incrementalTol  # skip the reference closure in cells that changed less than this
+        self.rootFolder = rootFolder  # repository root relative to the working directory, holds models/
+        # read only arrays of the process wide quadrature registry
+        [self.quadPts, self.quadWeights, self.mBasis] = math.getQuadratureBasis(2, self.polyDegree,
+                                                                             self.quadOrder)  # dims = (N x nq)
         self.nq = self.quadWeights.size
-        self.mBasis = math.computeMonomialBasis2D(self.quadPts, self.polyDegree)  # dims = (N x nq)
         self.inputDim = self.mBasis.shape[0]  # = self.nSystem
+        # split quadrature in positive and negative directions (for x and y) once for vectorized upwinding
+        self.quadIdxPos = [self.quadPts[:, 0] > 0, self.quadPts[:, 1] > 0]
+        self.quadIdxNeg = [np.logical_not(self.quadIdxPos[0]), np.logical_not(self.quadIdxPos[1])]
+        self.upwindBasis = [self.mBasis * (self.quadWeights * self.quadPts[:, 0]),
+                            self.mBasis * (self.quadWeights * self.quadPts[:, 1])]  # m * w * <v,n>, dims = (N x nq)
 
         # generate geometry
         self.x0 = -1.5
@@ -88,13 +102,47 @@ class MNSolver2D:
         self.alpha2 = np.zeros((self.nSystem, self.nx, self.ny))
         self.xFlux2 = np.zeros((self.nSystem, self.nx, self.ny), dtype=float)
         self.yFlux2 = np.zeros((self.nSystem, self.nx, self.ny), dtype=float)
+        # Reference closure
+        self.referenceClosure = referenceClosure(self.mBasis, self.quadWeights, nCells=self.nx * self.ny,
+                                                 nWorkers=num_cores if self.parallel else 1, tol=1e-7,
+                                                 incrementalTol=self.incrementalTol)
         # Neural closure
         self.neuralClosure = None
+        self.modelFolder = None
+        self.hybridClosure = None
         if not self.traditional:
             self.neuralClosure = initNeuralClosure(modelNumber=11, polyDegree=1, spatialDim=2,
                                                    folderName="002_sim_M1_2D", lossCombi=2,
                                                    width=18, depth=8, normalized=True)
-            self.neuralClosure.loadModel("../../models/002_sim_M1_2D")
+            # all model artifacts (weights, exported closures, table) live in the folder of the loaded model
+            self.modelFolder = self.rootFolder + self.neuralClosure.filename
+            self.neuralClosure.loadModel(self.modelFolder)
+            if fusedCore:
+                # single pass h and alpha instead of the GradientTape, needs tf_keras (see callNeuralClosure)
+                self.neuralClosure.useFusedCore()
+            # compiled closure, traced once per batch bucket. The stabilized fp32 post processing is accurate enough
+            self.closureEngine = inferenceEngine(self.neuralClosure, closureName="call_scaled")
+            if numpyBackend:
+                # tensorflow free evaluation of the exported weights
+                self.closureEngine = numpyClosure(
+                    exportNumpyClosure(self.neuralClosure, filename=self.modelFolder + "/numpy_closure.npz"))
+            if tabulatedBackend:
+                # interpolation of the network tabulated on the realizable set. The table is rebuilt, if it was
+                # built from other weights
+                tableFile = self.modelFolder + "/tabulated_closure.npz"
+                networkParams = exportNumpyClosure(self.neuralClosure, filename=self.modelFolder + "/numpy_closure.npz")
+                weightsHash = paramsHash(networkParams)
+                if not os.path.exists(tableFile) or tabulatedClosure(tableFile).sourceHash != weightsHash:
+                    network = numpyClosure(networkParams)
+                    tabulateClosure(closureSource(network), network.momentBasis, network.quadWeights, spatialDim=2,
+                                    filename=tableFile, sourceHash=weightsHash)
+                self.closureEngine = tabulatedClosure(tableFile)
+            if hybrid:
+                # cells with a large reconstruction residual or close to the realizable boundary are solved with
+                # Newton, warm started from the network alpha
+                self.hybridClosure = hybridClosure(self.closureEngine, self.mBasis, self.quadWeights,
+                                                   polyDegree=self.polyDegree, spatialDim=2)
+                self.closureEngine = self.hybridClosure
 
         # Analysis variables
         self.errorMap = np.zeros((self.nSystem, self.nx, self.ny))
@@ -102,6 +150,7 @@ class MNSolver2D:
         self.normErrorMapAbsolute = np.zeros((self.nx, self.ny))
         self.mass = []
         self.realizabilityMap = np.zeros((self.nx, self.ny))
+        self.fallbackMap = np.zeros((self.nx, self.ny))  # hybrid closure: number of Newton corrections per cell
         columns = ['u0', 'u1', 'u2', 'alpha0', 'alpha1', 'alpha2', 'h']  # , 'realizable']
         # self.dfErrPoints = pd.DataFrame(columns=columns)
 
@@ -272,35 +321,34 @@ class MNSolver2D:
         return 0
 
     def entropyClosureML(self):
-        count = 0
-        tmp = np.zeros((self.nx * self.ny, self.nSystem))
-        for i in range(self.nx):
-            for j in range(self.ny):
-                tmp[count, :] = self.u2[:, i, j]
-                count = count + 1
+        # cells in row major order, i.e. cell (i,j) is row i * ny + j
+        tmp = np.reshape(self.u2, (self.nSystem, self.nx * self.ny)).T
         # call neuralEntropy
-        [u_pred, alpha, h] = self.neuralClosure.call_scaled_64(np.asarray(tmp))
-        count = 0
-        for i in range(self.nx):
-            for j in range(self.ny):
-                # print(str(self.u[:, i, j]) + " | " + str(u_pred[count, :]))
-                # self.u2[:, i, j] = u_pred[count, :]  # reconstruction
-                self.alpha2[:, i, j] = alpha[count, :]
-                self.h2[i, j] = h[count]
-                count = count + 1
+        [u_pred, alpha, h] = self.closureEngine(np.asarray(tmp))
+        # self.u2 = np.reshape(np.asarray(u_pred).T, (self.nSystem, self.nx, self.ny))  # reconstruction
+        self.alpha2 = np.reshape(np.asarray(alpha).T, (self.nSystem, self.nx, self.ny))
+        self.h2 = np.reshape(np.asarray(h), (self.nx, self.ny))
+        if self.hybridClosure is not None:
+            self.fallbackMap += np.reshape(self.hybridClosure.fallbackMask, (self.nx, self.ny))
+            self.hybridClosure.reportFallback()
 
         return 0
 
     def entropyClosureNewton(self):
 
         # if (self.traditional): # NEWTON
-        for i in range(self.nx):
-            self.entropyClosureSingleRow(i)
-
-        # resList = Parallel(n_jobs=num_cores)(delayed(self.entropyClosureSingleRow)(i) for i in range(self.nx))
-        # for i in range(self.nx):
-        #    for j in range(self.ny):
-        #        self.alpha[:, i, j] = resList[i][j]
+        # all cells at once with the batched newton solver (parallel if enabled), warm started from the last alpha
+        u = np.reshape(self.u, (self.nSystem, self.nx * self.ny)).T
+        alphaStart = np.reshape(self.alpha, (self.nSystem, self.nx * self.ny)).T
+        [alpha, h, converged] = self.referenceClosure(u, alphaStart)
+        self.referenceClosure.reportTimings()
+        self.referenceClosure.reportSkipRate()
+        if not converged.all():
+            print("Optimization unsuccessfull!")
+        # unconverged cells keep their old alpha
+        alpha[np.logical_not(converged)] = alphaStart[np.logical_not(converged)]
+        self.alpha = np.reshape(alpha.T, (self.nSystem, self.nx, self.ny))
+        self.h = np.where(converged, h, self.h.reshape(-1)).reshape((self.nx, self.ny))
 
         # else: #TENSORFLOW
 
@@ -386,12 +434,15 @@ class MNSolver2D:
         return opti_entropy_prime
 
     def realizabilityReconstruction(self):
-        for i in range(self.nx):
-            for j in range(self.ny):
-                # self.u2[:, i, j] = self.u[:, i, j]
-                a = np.reshape(self.alpha[:, i, j], (1, self.nSystem))
-                self.u[:, i, j] = math.reconstructU(alpha=a, m=self.mBasis, w=self.quadWeights)
-                # print("(" + str(self.u2[:, i, j]) + " | " + str(self.u[:, i, j]))
+        # all cells at once, reconstructU works on batches of alpha. Cells in row major order, see entropyClosureML.
+        # cells skipped by the incremental reference closure keep their moments, since the cached alpha belongs to
+        # an older u
+        solved = self.referenceClosure.solvedMask
+        u = np.reshape(self.u, (self.nSystem, self.nx * self.ny))
+        alpha = np.reshape(self.alpha, (self.nSystem, self.nx * self.ny))
+        u[:, solved] = np.transpose(
+            math.reconstructU(alpha=np.transpose(alpha[:, solved]), m=self.mBasis, w=self.quadWeights))
+        self.u = np.reshape(u, (self.nSystem, self.nx, self.ny))
         return 0
 
     def computeFluxNewton(self):
@@ -399,76 +450,37 @@ class MNSolver2D:
         for periodic boundaries, upwinding.
         writes to xFlux and yFlux, uses alpha
         """
-        for j in range(self.ny):
-            for i in range(self.nx):
-
-                # Computation in x direction
-                im1 = i - 1
-                if i == 0:  # periodic boundaries
-                    im1 = self.nx - 1
-                left = np.tensordot(self.alpha[:, im1, j], self.mBasis, axes=([0], [0]))
-                right = np.tensordot(self.alpha[:, i, j], self.mBasis, axes=([0], [0]))
-                fluxL = math.entropyDualPrime(left)
-                fluxR = math.entropyDualPrime(right)
-                flux = 0
-                for q in range(self.nq):  # integrate upwinding result
-                    upwind = self.upwinding(fluxL[q], fluxR[q], self.quadPts[q], [1, 0])
-                    flux = flux + upwind * self.quadWeights[q] * self.mBasis[:, q]
-                self.xFlux[:, i, j] = flux
-
-                # Computation in y direction
-                jm1 = j - 1
-                if j == 0:  # periodic boundaries
-                    jm1 = self.ny - 1
-                lower = np.tensordot(self.alpha[:, i, jm1], self.mBasis, axes=([0], [0]))
-                upper = np.tensordot(self.alpha[:, i, j], self.mBasis, axes=([0], [0]))
-                fluxLow = math.entropyDualPrime(lower)
-                fluxUp = math.entropyDualPrime(upper)
-                flux = 0
-                for q in range(self.nq):  # integrate upwinding result
-                    upwind = self.upwinding(fluxLow[q], fluxUp[q], self.quadPts[q], [0, 1])
-                    flux = flux + upwind * self.quadWeights[q] * self.mBasis[:, q]
-                self.yFlux[:, i, j] = flux
+        [self.xFlux, self.yFlux] = self.computeFluxVectorized(self.alpha)
         return 0
 
     def computeFluxML(self):
         """
         for periodic boundaries, upwinding.
-        writes to xFlux and yFlux, uses alpha
+        writes to xFlux2 and yFlux2, uses alpha2
         """
-
-        for j in range(self.ny):
-            for i in range(self.nx):
-
-                # Computation in x direction
-                im1 = i - 1
-                if i == 0:  # periodic boundaries
-                    im1 = self.nx - 1
-                left = np.tensordot(self.alpha2[:, im1, j], self.mBasis, axes=([0], [0]))
-                right = np.tensordot(self.alpha2[:, i, j], self.mBasis, axes=([0], [0]))
-                fluxL = math.entropyDualPrime(left)
-                fluxR = math.entropyDualPrime(right)
-                flux = 0
-                for q in range(self.nq):  # integrate upwinding result
-                    upwind = self.upwinding(fluxL[q], fluxR[q], self.quadPts[q], [1, 0])
-                    flux = flux + upwind * self.quadWeights[q] * self.mBasis[:, q]
-                self.xFlux2[:, i, j] = flux
-
-                # Computation in y direction
-                jm1 = j - 1
-                if j == 0:  # periodic boundaries
-                    jm1 = self.ny - 1
-                lower = np.tensordot(self.alpha2[:, i, jm1], self.mBasis, axes=([0], [0]))
-                upper = np.tensordot(self.alpha2[:, i, j], self.mBasis, axes=([0], [0]))
-                fluxLow = math.entropyDualPrime(lower)
-                fluxUp = math.entropyDualPrime(upper)
-                flux = 0
-                for q in range(self.nq):  # integrate upwinding result
-                    upwind = self.upwinding(fluxLow[q], fluxUp[q], self.quadPts[q], [0, 1])
-                    flux = flux + upwind * self.quadWeights[q] * self.mBasis[:, q]
-                self.yFlux2[:, i, j] = flux
+        [self.xFlux2, self.yFlux2] = self.computeFluxVectorized(self.alpha2)
         return 0
 
+    def computeFluxVectorized(self, alpha):
+        """
+        brief: kinetic upwind fluxes at all cell interfaces of the periodic grid at once
+        input: alpha, dims = (N x nx x ny)
+        returns: [xFlux, yFlux], dims = (N x nx x ny), where
+                 xFlux[:, i, j] = flux over the interface between cell (i-1, j) and (i, j)
+                 yFlux[:, i, j] = flux over the interface between cell (i, j-1) and (i, j)
+        """
+        fluxes = []
+        for direction in range(2):
+            alphaUpwind = np.roll(alpha, 1, axis=direction + 1)  # periodic left/lower neighbour
+            idxPos = self.quadIdxPos[direction]
+            idxNeg = self.quadIdxNeg[direction]
+            # positive directions take the left/lower state, negative directions the right/upper state
+            fluxL = math.entropyDualPrime(np.tensordot(alphaUpwind, self.mBasis[:, idxPos], axes=([0], [0])))
+            fluxR = math.entropyDualPrime(np.tensordot(alpha, self.mBasis[:, idxNeg], axes=([0], [0])))
+            fluxes.append(np.tensordot(self.upwindBasis[direction][:, idxPos], fluxL, axes=([1], [2])) +
+                          np.tensordot(self.upwindBasis[direction][:, idxNeg], fluxR, axes=([1], [2])))
+        return fluxes
+
     def upwinding(self, fluxL, fluxR, quadpt, normal):
         t = np.inner(quadpt, normal)
         if t > 0:
@@ -484,45 +496,28 @@ class MNSolver2D:
         return 0
 
     def FVMUpdateNewton(self):
-        for j in range(self.ny):
-            for i in range(self.nx):
-                ip1 = i + 1
-                jp1 = j + 1
-                # periodic boundaries
-                if i == self.nx - 1:
-                    ip1 = 0
-                if j == self.ny - 1:
-                    jp1 = 0
-
-                # Advection
-                self.u[:, i, j] = self.u[:, i, j] + ((self.xFlux[:, i, j] - self.xFlux[:, ip1, j]) / self.dx + (
-                        self.yFlux[:, i, j] - self.yFlux[:, i, jp1]) / self.dy) * self.dt
-                # Scattering
-                # self.u[0, i, j] = self.u[0, i, j] + (
-                #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
-                # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
+        self.u = self.FVMUpdateVectorized(self.u, self.xFlux, self.yFlux)
         return 0
 
     def FVMUpdateML(self):
-        for j in range(self.ny):
-            for i in range(self.nx):
-                ip1 = i + 1
-                jp1 = j + 1
-                # periodic boundaries
-                if i == self.nx - 1:
-                    ip1 = 0
-                if j == self.ny - 1:
-                    jp1 = 0
-
-                # Advection
-                self.u2[:, i, j] = self.u2[:, i, j] + ((self.xFlux2[:, i, j] - self.xFlux2[:, ip1, j]) / self.dx + (
-                        self.yFlux2[:, i, j] - self.yFlux2[:, i, jp1]) / self.dy) * self.dt
-                # Scattering
-                # self.u[0, i, j] = self.u[0, i, j] + (
-                #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
-                # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
+        self.u2 = self.FVMUpdateVectorized(self.u2, self.xFlux2, self.yFlux2)
         return 0
 
+    def FVMUpdateVectorized(self, u, xFlux, yFlux):
+        """
+        brief: explicit euler step of the advection for all cells, periodic boundaries
+        input: u, xFlux, yFlux, dims = (N x nx x ny)
+        returns: updated u, dims = (N x nx x ny)
+        """
+        # Advection
+        u = u + ((xFlux - np.roll(xFlux, -1, axis=1)) / self.dx + (
+                yFlux - np.roll(yFlux, -1, axis=2)) / self.dy) * self.dt
+        # Scattering
+        # self.u[0, i, j] = self.u[0, i, j] + (
+        #        self.sigmaS * self.u[0, i, j] - self.sigmaT * self.u[0, i, j]) * self.dt
+        # self.u[1:, i, j] = self.u[0, i, j] + (self.sigmaT * self.u[1:, i, j]) * self.dt
+        return u
+
     def showSolution(self, idx):
         plt.clf()
         fig = plt.figure(figsize=(10, 10))
@@ -0,0 +1,113 @@
+'''
+Hybrid neural/Newton entropy closure for the moment solvers.
+The network closes all cells of a batch at once. A vectorized validity test flags the cells whose prediction can
+not be trusted, i.e. a large reconstruction residual ||u - u_theta|| / u_0, a non finite prediction, or moments
+close to the boundary of the realizable set. Only the flagged cells are solved again with the batched Newton solver,
+warm started from the network alpha.
+'''
+
+### imports ###
+# python modules
+import numpy as np
+
+# inpackage imports
+from src import math
+from src import realizability
+
+
+### class definitions ###
+class hybridClosure:
+
+    def __init__(self, closureEngine, mBasis, quadWeights, polyDegree, spatialDim, residualTol=1e-3,
+                 realizabilityMargin=0.05, tol=1e-7, maxIter=100):
+        """
+        input: closureEngine = network closure with the call_scaled interface, u -> [u_theta, alpha, h]
+                               (e.g. inferenceEngine or numpyClosure)
+               mBasis = moment basis at the quadrature points, dims = (N x nq)
+               quadWeights = quadrature weights, dims = nq
+               residualTol = cells with ||u - u_theta|| / u_0 > residualTol fall back to Newton
+               realizabilityMargin = cells with a relative distance to the realizable boundary below the margin fall
+                                     back to Newton (see realizability.boundaryDistance). 0.05 corresponds to
+                                     |u_1| / u_0 > 0.95 for M1
+               tol = tolerance of the Newton solver
+        """
+        realizability.checkSupport(polyDegree, spatialDim)
+        self.closureEngine = closureEngine
+        self.mBasis = np.asarray(mBasis, dtype=np.float64)
+        self.quadWeights = np.asarray(quadWeights, dtype=np.float64)
+        self.polyDegree = polyDegree
+        self.spatialDim = spatialDim
+        self.residualTol = residualTol
+        self.realizabilityMargin = realizabilityMargin
+        self.tol = tol
+        self.maxIter = maxIter
+
+        self.fallbackMask = None  # cells solved with Newton in the last call
+        self.fallbackRates = []  # fraction of Newton cells per call
+        self.unconvergedCounts = []  # Newton cells per call that did not converge and keep the network prediction
+
+    def __call__(self, u):
+        return self.call_scaled(u)
+
+    def validate(self, u, uTheta, alpha):
+        """
+        brief: vectorized validity test of the network closure
+        input: u = moments, dims = (nS x N)
+               uTheta, alpha = reconstructed moments and multipliers of the network, dims = (nS x N)
+        returns: mask of the valid cells, dims = nS
+        """
+        residual = np.linalg.norm(u - uTheta, axis=1) / u[:, 0]
+        valid = np.isfinite(alpha).all(axis=1) & (residual <= self.residualTol)
+
+        uNormal = u / u[:, 0:1]
+        # the boundary distance is only defined inside the realizable set
+        interior = realizability.isRealizable(uNormal, self.polyDegree, self.spatialDim)
+        distance = np.zeros(u.shape[0])
+        if interior.any():
+            distance[interior] = realizability.boundaryDistance(uNormal[interior], self.polyDegree, self.spatialDim)
+        return valid & (distance >= self.realizabilityMargin)
+
+    def call_scaled(self, u):
+        """
+        brief: closes all cells with the network and the invalid cells with Newton
+        input: u, dims = (nS x N)
+        returns: [u, alpha, h], dims = (nS x N), (nS x N), (nS x 1). Valid cells keep the network reconstruction,
+                 Newton cells return their moments u
+        """
+        u = np.asarray(u, dtype=np.float64)
+        [uTheta, alpha, h] = [np.array(output, dtype=np.float64) for output in self.closureEngine(u)]
+
+        self.fallbackMask = np.logical_not(self.validate(u, uTheta, alpha))
+        self.fallbackRates.append(np.count_nonzero(self.fallbackMask) / max(u.shape[0], 1))
+        if not self.fallbackMask.any():
+            self.unconvergedCounts.append(0)
+            return [uTheta, alpha, h]
+
+        # non finite predictions start from the isotropic density
+        alphaStart = alpha[self.fallbackMask]
+        broken = np.logical_not(np.isfinite(alphaStart).all(axis=1))
+        alphaStart[broken] = 0.0
+        alphaStart[broken, 0] = np.log(u[self.fallbackMask][broken, 0] / np.sum(self.quadWeights))
+        [alphaNewton, hNewton, converged] = math.minimizeEntropyNewtonBatch(u=u[self.fallbackMask],
+                                                                            alphaStart=alphaStart, m=self.mBasis,
+                                                                            w=self.quadWeights, tol=self.tol,
+                                                                            maxIter=self.maxIter)
+        self.unconvergedCounts.append(np.count_nonzero(np.logical_not(converged)))
+
+        # only converged cells replace the network prediction. The dual objective is the negative entropy
+        newtonIdx = np.flatnonzero(self.fallbackMask)[converged]
+        uTheta[newtonIdx] = u[newtonIdx]
+        alpha[newtonIdx] = alphaNewton[converged]
+        h[newtonIdx, 0] = -hNewton[converged]
+        return [uTheta, alpha, h]
+
+    def reportFallback(self):
+        """
+        brief: prints the fraction of cells solved with Newton in the last call and over all calls
+        """
+        if len(self.fallbackRates) == 0:
+            return 0
+        print("Hybrid closure: Newton fallback in " + str(self.fallbackRates[-1]) + " of the cells ("
+              + str(self.unconvergedCounts[-1]) + " unconverged) in the last call, " + str(np.mean(self.fallbackRates))
+              + " on average over " + str(len(self.fallbackRates)) + " calls")
+        return 0
@@ -0,0 +1,219 @@
+'''
+Parallel reference (Newton) entropy closure for the moment solvers.
+The grid cells are split in chunks that are solved by a pool of worker processes. Moments, Lagrange multipliers
+and entropies live in shared memory, so only chunk bounds are sent to the workers and no solver object is pickled.
+Small grids are solved serially.
+In incremental mode, cells whose moments changed less than a tolerance since their last solve are skipped and
+reuse the cached Lagrange multiplier and entropy.
+'''
+
+### imports ###
+# python modules
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+import numpy as np
+
+# inpackage imports
+from src import math
+
+num_cores = multiprocessing.cpu_count()
+
+# shared arrays of a worker process, set by _initWorker
+_workerArrays = {}
+
+
+### worker functions ###
+def _initWorker(sharedNames, nCells, inputDim, mBasis, quadWeights, tol):
+    """
+    brief: attaches a worker process to the shared memory blocks of its referenceClosure
+    """
+    _workerArrays["sharedMemory"] = [shared_memory.SharedMemory(name=name) for name in sharedNames]
+    [shmU, shmAlpha, shmH, shmConverged] = _workerArrays["sharedMemory"]
+    _workerArrays["u"] = np.ndarray((nCells, inputDim), dtype=np.float64, buffer=shmU.buf)
+    _workerArrays["alpha"] = np.ndarray((nCells, inputDim), dtype=np.float64, buffer=shmAlpha.buf)
+    _workerArrays["h"] = np.ndarray((nCells,), dtype=np.float64, buffer=shmH.buf)
+    _workerArrays["converged"] = np.ndarray((nCells,), dtype=bool, buffer=shmConverged.buf)
+    _workerArrays["mBasis"] = mBasis
+    _workerArrays["quadWeights"] = quadWeights
+    _workerArrays["tol"] = tol
+
+
+def _solveChunk(bounds):
+    """
+    brief: solves the closure for the cells [start, end) in place in shared memory
+    input: bounds = (start, end)
+    returns: (start, end, wall time of the chunk in seconds)
+    """
+    [start, end] = bounds
+    timeStart = time.perf_counter()
+    [alpha, h, converged] = math.minimizeEntropyNewtonBatch(u=_workerArrays["u"][start:end],
+                                                            alphaStart=_workerArrays["alpha"][start:end],
+                                                            m=_workerArrays["mBasis"],
+                                                            w=_workerArrays["quadWeights"], tol=_workerArrays["tol"])
+    _workerArrays["alpha"][start:end] = alpha
+    _workerArrays["h"][start:end] = h
+    _workerArrays["converged"][start:end] = converged
+    return start, end, time.perf_counter() - timeStart
+
+
+### class definitions ###
+class referenceClosure:
+
+    def __init__(self, mBasis, quadWeights, nCells, nWorkers=num_cores, chunkSize=None, minParallelCells=2048,
+                 tol=1e-7, incrementalTol=0.0):
+        """
+        input: mBasis = moment basis at the quadrature points, dims = (N x nq)
+               quadWeights = quadrature weights, dims = nq
+               nCells = number of grid cells
+               nWorkers = number of worker processes. 1 means serial execution
+               chunkSize = cells per chunk. Default splits the grid in 4 chunks per worker
+               minParallelCells = grids with less cells are solved serially
+               tol = tolerance of the Newton solver
+               incrementalTol = cells with max|u - u_cached| / max|u_cached| <= incrementalTol are not solved again.
+                                0 disables the incremental mode
+        """
+        self.mBasis = np.asarray(mBasis, dtype=np.float64)
+        self.quadWeights = np.asarray(quadWeights, dtype=np.float64)
+        self.nCells = nCells
+        self.inputDim = self.mBasis.shape[0]
+        self.nWorkers = max(1, min(nWorkers, nCells))
+        if chunkSize is None:
+            chunkSize = int(np.ceil(nCells / (4 * self.nWorkers)))
+        self.chunkSize = max(1, chunkSize)
+        self.tol = tol
+        self.parallel = self.nWorkers > 1 and nCells >= minParallelCells
+
+        # per chunk timings of the last solve, list of (start, end, seconds)
+        self.chunkTimings = []
+
+        # incremental mode: cache of the last solved state per cell
+        self.incrementalTol = incrementalTol
+        self.uCache = None
+        self.alphaCache = None
+        self.hCache = None
+        self.solvedMask = np.ones(nCells, dtype=bool)  # cells solved in the last call
+        self.skipRates = []  # fraction of skipped cells per call
+
+        self.sharedMemory = []
+        self.pool = None
+        if self.parallel:
+            self.createSharedArrays()
+            # spawn, since forking a process with an initialized tensorflow runtime is unsafe
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                processes=self.nWorkers, initializer=_initWorker,
+                initargs=([shm.name for shm in self.sharedMemory], self.nCells, self.inputDim, self.mBasis,
+                          self.quadWeights, self.tol))
+
+    def createSharedArrays(self):
+        sizes = [self.nCells * self.inputDim * 8, self.nCells * self.inputDim * 8, self.nCells * 8, self.nCells]
+        self.sharedMemory = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+        [shmU, shmAlpha, shmH, shmConverged] = self.sharedMemory
+        self.u = np.ndarray((self.nCells, self.inputDim), dtype=np.float64, buffer=shmU.buf)
+        self.alpha = np.ndarray((self.nCells, self.inputDim), dtype=np.float64, buffer=shmAlpha.buf)
+        self.h = np.ndarray((self.nCells,), dtype=np.float64, buffer=shmH.buf)
+        self.converged = np.ndarray((self.nCells,), dtype=bool, buffer=shmConverged.buf)
+        return 0
+
+    def __call__(self, u, alphaStart):
+        return self.solve(u, alphaStart)
+
+    def solve(self, u, alphaStart):
+        """
+        brief: solves the dual entropy problem for all cells. In incremental mode only for the cells that changed
+        input: u, dims = (nCells x N)
+               alphaStart = start value of alpha (e.g. alpha of the last time step), dims = (nCells x N)
+        returns: [alpha, h, converged], dims = (nCells x N), nCells, nCells
+        """
+        if self.incrementalTol <= 0.0:
+            return self.solveCells(u, alphaStart)
+
+        if self.uCache is None:
+            self.uCache = np.full((self.nCells, self.inputDim), np.nan)
+            self.alphaCache = np.zeros((self.nCells, self.inputDim))
+            self.hCache = np.zeros(self.nCells)
+
+        # relative change of each cell since its last solve. Unsolved cells are nan and thus always solved.
+        # The denominator is bounded away from zero for cached vacuum cells (u = 0)
+        change = np.max(np.abs(u - self.uCache), axis=1) / np.maximum(np.max(np.abs(self.uCache), axis=1),
+                                                                      np.finfo(np.float64).tiny)
+        self.solvedMask = np.logical_not(change <= self.incrementalTol)
+        self.skipRates.append(1.0 - np.count_nonzero(self.solvedMask) / self.nCells)
+
+        converged = np.ones(self.nCells, dtype=bool)
+        self.chunkTimings = []  # no chunks, if all cells are skipped
+        if self.solvedMask.any():
+            [alphaSolved, hSolved, convergedSolved] = self.solveCells(u[self.solvedMask],
+                                                                      alphaStart[self.solvedMask])
+            converged[self.solvedMask] = convergedSolved
+            # only converged cells enter the cache, the others are solved again in the next call
+            self.uCache[self.solvedMask] = np.where(convergedSolved[:, np.newaxis], u[self.solvedMask], np.nan)
+            self.alphaCache[self.solvedMask] = alphaSolved
+            self.hCache[self.solvedMask] = hSolved
+
+        return [self.alphaCache.copy(), self.hCache.copy(), converged]
+
+    def solveCells(self, u, alphaStart):
+        """
+        brief: solves the dual entropy problem for a batch of nS <= nCells cells, serial or on the worker pool
+        input: u, dims = (nS x N)
+               alphaStart, dims = (nS x N)
+        returns: [alpha, h, converged], dims = (nS x N), nS, nS
+        """
+        nS = u.shape[0]
+        if not self.parallel:
+            timeStart = time.perf_counter()
+            res = math.minimizeEntropyNewtonBatch(u=u, alphaStart=alphaStart, m=self.mBasis, w=self.quadWeights,
+                                                  tol=self.tol)
+            self.chunkTimings = [(0, nS, time.perf_counter() - timeStart)]
+            return res
+
+        # the cells to solve are packed at the front of the shared arrays
+        np.copyto(self.u[:nS], u)
+        np.copyto(self.alpha[:nS], alphaStart)
+        chunks = [(start, min(start + self.chunkSize, nS)) for start in range(0, nS, self.chunkSize)]
+        self.chunkTimings = sorted(self.pool.map(_solveChunk, chunks))
+        return [self.alpha[:nS].copy(), self.h[:nS].copy(), self.converged[:nS].copy()]
+
+    def reportTimings(self):
+        """
+        brief: prints the per chunk timings of the last solve
+        """
+        times = np.array([timing[2] for timing in self.chunkTimings])
+        if times.size == 0:
+            return 0
+        print("Reference closure: " + str(times.size) + " chunks on " + str(self.nWorkers if self.parallel else 1)
+              + " processes. Chunk time [s]: min " + str(times.min()) + ", mean " + str(times.mean()) + ", max "
+              + str(times.max()))
+        return 0
+
+    def reportSkipRate(self):
+        """
+        brief: prints the fraction of cells skipped by the incremental mode in the last call and over all calls
+        """
+        if len(self.skipRates) == 0:
+            return 0
+        print("Reference closure: skipped " + str(self.skipRates[-1]) + " of the cells in the last solve, "
+              + str(np.mean(self.skipRates)) + " on average over " + str(len(self.skipRates)) + " solves")
+        return 0
+
+    def close(self):
+        """
+        brief: shuts down the worker pool and releases the shared memory
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        # views into the shared buffers have to be released before closing them
+        self.u = self.alpha = self.h = self.converged = None
+        for shm in self.sharedMemory:
+            shm.close()
+            shm.unlink()
+        self.sharedMemory = []
+        return 0
+
+    def __del__(self):
+        if hasattr(self, "sharedMemory"):
+            self.close()
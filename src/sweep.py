@@ -0,0 +1,217 @@
+'''
+Parallel hyperparameter sweep for width/depth/model studies of the neural entropy closures.
+The configurations (model, width, depth, objective, degree) are trained concurrently in a local process pool.
+The training data of each degree is loaded and shuffled once and shared with all jobs via shared memory.
+Each job runs in a fresh process with a limited number of threads. The results are collected in one summary table.
+'''
+
+### imports ###
+# python modules
+import contextlib
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+# inpackage imports
+from src import utils
+
+sweepKeys = ["model", "width", "depth", "objective", "degree"]
+
+
+### function definitions ###
+def expandGrid(models=[11], widths=[10], depths=[5], objectives=[0], degrees=[1]):
+    '''
+    returns: list of configs (dicts with the sweepKeys), the cartesian product of the given lists
+    '''
+    return [dict(zip(sweepKeys, values)) for values in itertools.product(models, widths, depths, objectives, degrees)]
+
+
+def loadSweepConfigs(filename):
+    '''
+    Reads a list of configs from a csv file with the columns model, width, depth, objective, degree
+    returns: list of configs (dicts)
+    '''
+    df = pd.read_csv(filename)
+    missing = [key for key in sweepKeys if key not in df.columns]
+    if missing:
+        raise ValueError("Sweep config file " + filename + " misses the columns " + str(missing))
+    return [{key: int(row[key]) for key in sweepKeys} for _, row in df.iterrows()]
+
+
+def getJobFolder(sweepFolder, jobIdx, config):
+    '''
+    returns: model folder of a job (relative to models/), i.e. <sweepFolder>/<idx>_MK<m>_M<N>_W<w>_D<d>_O<o>
+    '''
+    return sweepFolder + "/" + str(jobIdx).zfill(3) + "_MK" + str(config["model"]) + "_M" + str(
+        config["degree"]) + "_W" + str(config["width"]) + "_D" + str(config["depth"]) + "_O" + str(
+        config["objective"])
+
+
+def shareArray(array):
+    '''
+    Copies a numpy array into a new shared memory block
+    returns: [sharedMemory, descriptor], descriptor = (name, shape, dtype) to attach the array in another process
+    '''
+    array = np.ascontiguousarray(array)
+    sharedMemory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    sharedArray = np.ndarray(array.shape, dtype=array.dtype, buffer=sharedMemory.buf)
+    sharedArray[...] = array
+    return [sharedMemory, (sharedMemory.name, array.shape, array.dtype.str)]
+
+
+def attachArray(descriptor):
+    '''
+    Attaches a shared array created by shareArray. The shared memory must stay referenced while the array is used.
+    returns: [sharedMemory, array]
+    '''
+    (name, shape, dtype) = descriptor
+    # the spawned jobs share the resource tracker of the sweep process, which owns and unlinks the blocks
+    sharedMemory = shared_memory.SharedMemory(name=name)
+    return [sharedMemory, np.ndarray(shape, dtype=np.dtype(dtype), buffer=sharedMemory.buf)]
+
+
+def loadSharedTrainingData(degrees, spatialDim, normalized, alphasampling, seed=0):
+    '''
+    Loads [u, alpha, h] of each degree once, shuffles it once and copies it into shared memory
+    returns: [sharedMemories, descriptors], descriptors = dict degree -> [u, alpha, h] descriptors
+    '''
+    # imported here, so the module can be imported without initializing tensorflow
+    from src.neuralClosures.neuralBase import neuralBase
+
+    rng = np.random.default_rng(seed)
+    sharedMemories = []
+    descriptors = {}
+    for degree in sorted(set(degrees)):
+        dataModel = neuralBase(normalized=normalized, polyDegree=degree, spatialDim=spatialDim, width=1, depth=1,
+                               lossCombi=0, customFolderName="")
+        filename = dataModel.getTrainingDataFilename(alphasampling=alphasampling, normalizedData=normalized)
+        trainingData = utils.loadData(filename, dataModel.csvInputDim, [True, True, True])
+        indices = rng.permutation(trainingData[0].shape[0])
+        descriptors[degree] = []
+        for data in trainingData:
+            [sharedMemory, descriptor] = shareArray(data[indices])
+            sharedMemories.append(sharedMemory)
+            descriptors[degree].append(descriptor)
+        print("Shared training data of degree " + str(degree) + ": " + str(len(indices)) + " samples")
+    return [sharedMemories, descriptors]
+
+
+def initWorker(threadsPerJob):
+    '''
+    Pool initializer, limits the threads of the job before tensorflow creates its thread pools
+    '''
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"]:
+        os.environ[variable] = str(threadsPerJob)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ["CUDA_VISIBLE_DEVICES"] = "-1"  # concurrent jobs share the cpu
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threadsPerJob)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def runJob(job):
+    '''
+    Trains one configuration of the sweep on the shared training data. The output of the job is written to
+    models/<job folder>/sweep_job.log
+    input: job = (jobIdx, config, descriptors, settings)
+    returns: result record (dict)
+    '''
+    (jobIdx, config, descriptors, settings) = job
+    folderName = getJobFolder(settings["sweepFolder"], jobIdx, config)
+    record = dict(config)
+    record.update({"job": jobIdx, "folder": folderName, "status": "failed", "epochs": 0, "finalLoss": np.nan,
+                   "finalValLoss": np.nan, "bestLoss": np.nan, "bestValLoss": np.nan, "trainingTime": np.nan,
+                   "error": ""})
+    utils.make_directory("models/" + folderName)
+
+    sharedMemories = []
+    data = []
+    with open("models/" + folderName + "/sweep_job.log", "w") as logFile, contextlib.redirect_stdout(logFile):
+        try:
+            from src.neuralClosures.configModel import initNeuralClosure
+
+            neuralClosure = initNeuralClosure(modelNumber=config["model"], polyDegree=config["degree"],
+                                              spatialDim=settings["spatialDim"], folderName=folderName,
+                                              lossCombi=config["objective"], width=config["width"],
+                                              depth=config["depth"], normalized=settings["normalized"],
+                                              precision=settings["precision"])
+            for descriptor in descriptors[config["degree"]]:
+                [sharedMemory, array] = attachArray(descriptor)
+                sharedMemories.append(sharedMemory)
+                data.append(array)
+            # the data is shuffled once by the sweep
+            neuralClosure.setTrainingData(data, shuffleMode=False, normalizedData=settings["normalized"])
+
+            start = time.perf_counter()
+            neuralClosure.config_start_training(valSplit=settings["valSplit"], epochCount=settings["epochs"],
+                                                curriculum=settings["curriculum"], batchSize=settings["batchSize"],
+                                                verbosity=settings["verbosity"], processingMode=0)
+            record["trainingTime"] = time.perf_counter() - start
+            neuralClosure.saveModel()
+
+            history = neuralClosure.model.history.history
+            record["epochs"] = len(history.get("loss", []))
+            for key, name in [("loss", "Loss"), ("val_loss", "ValLoss")]:
+                if history.get(key):
+                    record["final" + name] = float(history[key][-1])
+                    record["best" + name] = float(np.min(history[key]))
+            record["status"] = "finished"
+        except Exception as error:
+            traceback.print_exc(file=logFile)
+            record["error"] = type(error).__name__ + ": " + str(error)
+        finally:
+            neuralClosure = None
+            data.clear()
+            for sharedMemory in sharedMemories:
+                try:
+                    sharedMemory.close()
+                except BufferError:  # views still referenced by keras, released when the job process ends
+                    pass
+    return record
+
+
+def runSweep(configs, nWorkers=2, threadsPerJob=1, sweepFolder="sweep", spatialDim=1, normalized=True,
+             alphasampling=0, epochs=1000, batchSize=128, curriculum=1, valSplit=0.1, precision=1, verbosity=1,
+             seed=0):
+    '''
+    Trains all configs concurrently in a pool of nWorkers processes with threadsPerJob threads each.
+    The models are saved to models/<sweepFolder>/<job folder>, the summary to models/<sweepFolder>/sweep_summary.csv
+    input: configs = list of dicts with the sweepKeys, see expandGrid and loadSweepConfigs
+    returns: summary, pandas dataframe with one row per config
+    '''
+    if not configs:
+        raise ValueError("The sweep has no configurations")
+    utils.make_directory("models/" + sweepFolder)
+    settings = {"sweepFolder": sweepFolder, "spatialDim": spatialDim, "normalized": normalized, "epochs": epochs,
+                "batchSize": batchSize, "curriculum": curriculum, "valSplit": valSplit, "precision": precision,
+                "verbosity": verbosity}
+
+    [sharedMemories, descriptors] = loadSharedTrainingData([config["degree"] for config in configs], spatialDim,
+                                                           normalized, alphasampling, seed)
+    jobs = [(jobIdx, config, descriptors, settings) for jobIdx, config in enumerate(configs)]
+    results = []
+    try:
+        # spawn: jobs start without the tensorflow state of this process. One job per process frees its memory
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=min(nWorkers, len(jobs)), initializer=initWorker, initargs=(threadsPerJob,),
+                          maxtasksperchild=1) as pool:
+            for record in pool.imap_unordered(runJob, jobs):
+                results.append(record)
+                print("Sweep job " + str(len(results)) + "/" + str(len(jobs)) + " " + record["folder"] + ": "
+                      + record["status"] + ", best val_loss " + str(record["bestValLoss"]))
+    finally:
+        for sharedMemory in sharedMemories:
+            sharedMemory.close()
+            sharedMemory.unlink()
+
+    summary = pd.DataFrame(sorted(results, key=lambda record: record["job"]))
+    summary = summary[["job"] + sweepKeys + [key for key in summary.columns if key not in sweepKeys + ["job"]]]
+    summary.to_csv("models/" + sweepFolder + "/sweep_summary.csv", index=False)
+    print("Sweep summary written to models/" + sweepFolder + "/sweep_summary.csv")
+    return summary
@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 from matplotlib import cm
 import random
 import os
+import glob
 from pathlib import Path
 
 
@@ -49,11 +50,19 @@ def integrate(x, y):
 
 def loadData(filename, inputDim, selectedCols=[True, True, True]):
     '''
-    Load training Data from csv file <filename>
+    Load training Data from csv file <filename>. Uses the memory mapped binary copy, if it exists.
     u, alpha have length <inputDim>
     returns: trainingData = [u,alpha,h]
     '''
 
+    if binaryDataExists(filename):
+        return loadBinaryData(filename, selectedCols)
+    shardStems = getBinaryShardStems(filename)
+    if shardStems:
+        # generated shards, see dataGenerator.generateTrainingData
+        shards = [loadBinaryData(shardStem, selectedCols) for shardStem in shardStems]
+        return [np.concatenate(columns, axis=0) for columns in zip(*shards)]
+
     trainingData = []
 
     print("Loading Data from location: " + filename)
@@ -64,18 +73,15 @@ def loadData(filename, inputDim, selectedCols=[True, True, True]):
 
     # selectedCols = self.selectTrainingData() #outputs a boolean triple.
     start = time.time()
-    if selectedCols[0] == True:
-        df = pd.read_csv(filename, usecols=[i for i in uCols])
-        uNParray = df.to_numpy()
-        trainingData.append(uNParray)
-    if selectedCols[1] == True:
-        df = pd.read_csv(filename, usecols=[i for i in alphaCols])
-        alphaNParray = df.to_numpy()
-        trainingData.append(alphaNParray)
-    if selectedCols[2] == True:
-        df = pd.read_csv(filename, usecols=[i for i in hCol])
-        hNParray = df.to_numpy()
-        trainingData.append(hNParray)
+    usedCols = []
+    for cols, selected in zip([uCols, alphaCols, hCol], selectedCols):
+        if selected:
+            usedCols = usedCols + cols
+    # parse the csv only once and split the column groups afterwards
+    df = pd.read_csv(filename, usecols=usedCols)
+    for cols, selected in zip([uCols, alphaCols, hCol], selectedCols):
+        if selected:
+            trainingData.append(df.iloc[:, [usedCols.index(c) for c in cols]].to_numpy())
 
     end = time.time()
     print("Data loaded. Elapsed time: " + str(end - start))
@@ -83,6 +89,97 @@ def loadData(filename, inputDim, selectedCols=[True, True, True]):
     return trainingData
 
 
+def getBinaryDataFilenames(filename):
+    '''
+    Binary columnar copy of the training data file <filename> (.csv).
+    returns: [u_file, alpha_file, h_file], one .npy file per column group
+    '''
+    if filename.endswith(".csv"):
+        filename = filename[:-4]
+    return [filename + "_u.npy", filename + "_alpha.npy", filename + "_h.npy"]
+
+
+def binaryDataExists(filename):
+    return all([os.path.isfile(binFile) for binFile in getBinaryDataFilenames(filename)])
+
+
+def convertCSVToBinary(filename, inputDim, chunkSize=1000000):
+    '''
+    One-time conversion of training Data from csv file <filename> to one .npy file per column group (u, alpha, h).
+    The csv is parsed once in chunks of <chunkSize> rows, so the conversion does not need the whole table in RAM.
+    u, alpha have length <inputDim>
+    returns: list of the written filenames
+    '''
+    print("Converting Data from location: " + filename)
+    start = time.time()
+
+    # count rows (without header) with the same parser as the conversion, which skips blank lines
+    nRows = 0
+    for chunk in pd.read_csv(filename, usecols=[0], chunksize=chunkSize):
+        nRows += chunk.shape[0]
+
+    binFiles = getBinaryDataFilenames(filename)
+    colSlices = [slice(0, inputDim), slice(inputDim, 2 * inputDim), slice(2 * inputDim, 2 * inputDim + 1)]
+    binArrays = [np.lib.format.open_memmap(binFile, mode="w+", dtype=np.float64, shape=(nRows, cols.stop - cols.start))
+                 for binFile, cols in zip(binFiles, colSlices)]
+
+    rowIdx = 0
+    for chunk in pd.read_csv(filename, usecols=list(range(1, 2 * inputDim + 2)), chunksize=chunkSize):
+        chunkNP = chunk.to_numpy(dtype=np.float64)
+        for binArray, cols in zip(binArrays, colSlices):
+            binArray[rowIdx:rowIdx + chunkNP.shape[0]] = chunkNP[:, cols]
+        rowIdx += chunkNP.shape[0]
+    if rowIdx != nRows:
+        raise ValueError("Converted " + str(rowIdx) + " rows of " + filename + ", but counted " + str(nRows))
+
+    for binArray in binArrays:
+        binArray.flush()
+    del binArrays
+
+    end = time.time()
+    print("Data converted to " + str(binFiles) + ". Elapsed time: " + str(end - start))
+    return binFiles
+
+
+def getBinaryShardStems(filename):
+    '''
+    returns: sorted stems <stem>_shard<idx> of the binary shards of training data file <filename>
+    '''
+    stem = filename[:-4] if filename.endswith(".csv") else filename
+    return sorted([shardFile[:-len("_u.npy")] for shardFile in glob.glob(stem + "_shard*_u.npy")])
+
+
+def getBinaryDataShards(filename, inputDim):
+    '''
+    Collects the binary shards of training data file <filename>. A shard is a triple of .npy files
+    <stem>[_shard<idx>]_u.npy, _alpha.npy, _h.npy. If no binary copy exists yet, the csv file is converted first.
+    returns: list of shards [u,alpha,h] (read only np.memmap arrays)
+    '''
+    shardStems = getBinaryShardStems(filename)
+
+    if not shardStems:
+        stem = filename[:-4] if filename.endswith(".csv") else filename
+        if not binaryDataExists(filename):
+            convertCSVToBinary(filename, inputDim)
+        shardStems = [stem]
+
+    return [loadBinaryData(shardStem) for shardStem in shardStems]
+
+
+def loadBinaryData(filename, selectedCols=[True, True, True]):
+    '''
+    Memory maps the binary copy of training data file <filename>. Rows are only read from disk when accessed.
+    returns: trainingData = [u,alpha,h] (read only np.memmap arrays)
+    '''
+    binFiles = getBinaryDataFilenames(filename)
+    print("Memory mapping Data from location: " + str(binFiles))
+    trainingData = []
+    for binFile, selected in zip(binFiles, selectedCols):
+        if selected:
+            trainingData.append(np.load(binFile, mmap_mode="r"))
+    return trainingData
+
+
 def evaluateModel(model, input):
     '''Evaluates the model at input'''
     # x = input
@@ -200,16 +297,22 @@ def writeConfigFile(options, neuralClosureModel):
     runScript = "python callNeuralClosure.py \\\n"
     runScript = runScript + "--alphasampling=" + str(int(options.alphasampling)) + " \\\n"
     runScript = runScript + "--batch=" + str(options.batch) + " \\\n"
+    runScript = runScript + "--checkpointFrequency=" + str(options.checkpointFrequency) + " \\\n"
     runScript = runScript + "--curriculum=" + str(options.curriculum) + " \\\n"
     runScript = runScript + "--degree=" + str(options.degree) + " \\\n"
+    runScript = runScript + "--distributed=" + str(options.distributed) + " \\\n"
     runScript = runScript + "--epoch=" + str(options.epoch) + " \\\n"
     runScript = runScript + "--folder=" + str(options.folder) + " \\\n"
+    runScript = runScript + "--fusedCore=" + str(options.fusedCore) + " \\\n"
     runScript = runScript + "--loadModel=" + str(1) + " \\\n"  # force to load
     runScript = runScript + "--model=" + str(options.model) + " \\\n"
     runScript = runScript + "--normalized=" + str(int(options.normalized)) + " \\\n"
     runScript = runScript + "--objective=" + str(options.objective) + " \\\n"
+    runScript = runScript + "--precision=" + str(options.precision) + " \\\n"
     runScript = runScript + "--processingmode=" + str(options.processingmode) + " \\\n"
+    runScript = runScript + "--resume=" + str(1) + " \\\n"  # continue from the last checkpoint
     runScript = runScript + "--spatialDimension=" + str(options.spatialDimension) + " \\\n"
+    runScript = runScript + "--streaming=" + str(options.streaming) + " \\\n"
     runScript = runScript + "--training=" + str(options.training) + " \\\n"
     runScript = runScript + "--verbosity=" + str(options.verbosity) + " \\\n"
     runScript = runScript + "--networkwidth=" + str(options.networkwidth) + " \\\n"
@@ -236,16 +339,22 @@ def writeConfigFile(options, neuralClosureModel):
     # Print chosen options to csv
     d = {'alphasampling': [options.alphasampling],
          'batch': [options.batch],
+         'checkpoint frequency': [options.checkpointFrequency],
          'curriculum': [options.curriculum],
          'degree': [options.degree],
+         'distributed': [options.distributed],
          'epoch': [options.epoch],
          'folder': [options.folder],
+         'fused core': [options.fusedCore],
          'loadmodel': [options.loadmodel],
          'model': [options.model],
          'normalized moments': [options.normalized],
          'objective': [options.objective],
+         'precision': [options.precision],
          'processingmode': [options.processingmode],
+         'resume': [options.resume],
          'spatial Dimension': [options.spatialDimension],
+         'streaming': [options.streaming],
          'verbosity': [options.verbosity],
          'training': [options.training],
          'network width': [options.networkwidth],
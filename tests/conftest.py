@@ -0,0 +1,10 @@
+'''
+Test session setup. The sobolev models are tf_keras models, so legacy keras has to be selected before any test
+module imports tensorflow (e.g. through the solvers).
+'''
+
+### imports ###
+# python modules
+import os
+
+os.environ.setdefault("TF_USE_LEGACY_KERAS", "1")
@@ -0,0 +1,99 @@
+'''
+Checks the vectorized upwind flux and FVM update of MNSolver1D against the per cell loops they replace.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src import math
+from src.neuralClosures.configModel import initNeuralClosure
+from src.solver.MNSolver1D import MNSolver1D
+
+
+### reference implementations ###
+def loopFlux(solver, alpha):
+    # per cell kinetic upwind flux with periodic boundaries
+    nx = alpha.shape[1]
+    xFlux = np.zeros(alpha.shape)
+    for i in range(nx):
+        im1 = i - 1
+        if i == 0:  # periodic boundaries
+            im1 = nx - 1
+        left = np.tensordot(alpha[:, im1], solver.mBasis, axes=([0], [0]))
+        right = np.tensordot(alpha[:, i], solver.mBasis, axes=([0], [0]))
+        fluxL = math.entropyDualPrime(left)
+        fluxR = math.entropyDualPrime(right)
+        flux = 0
+        for q in range(solver.nq):  # integrate upwinding result
+            upwind = solver.upwinding(fluxL[q], fluxR[q], solver.quadPts[q])
+            flux = flux + upwind * solver.quadWeights[q] * solver.mBasis[:, q]
+        xFlux[:, i] = flux
+    return xFlux
+
+
+def loopUpdate(solver, u, xFlux):
+    u = np.copy(u)
+    nx = u.shape[1]
+    for i in range(nx):
+        ip1 = i + 1
+        if i == nx - 1:  # periodic boundaries
+            ip1 = 0
+        u[:, i] = u[:, i] + ((xFlux[:, i] - xFlux[:, ip1]) / solver.dx) * solver.dt
+    return u
+
+
+### test definitions ###
+@pytest.fixture(scope="module")
+def solver(tmp_path_factory):
+    # the solver writes its error analysis to the working directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("solver1D"))
+        yield MNSolver1D(traditional=True, polyDegree=2)
+
+
+def randomAlpha(solver, nx, seed):
+    # every alpha defines a realizable moment u = <m exp(alpha * m)>
+    rng = np.random.default_rng(seed)
+    alpha = rng.uniform(-2.0, 2.0, size=(solver.nSystem, nx))
+    alpha[0] = rng.uniform(-1.0, 1.0, size=nx)
+    return alpha
+
+
+@pytest.mark.parametrize("nx", [1, 2, 7])
+def test_fluxMatchesLoop(solver, nx):
+    alpha = randomAlpha(solver, nx, seed=nx)
+    flux = solver.computeFluxVectorized(alpha)
+    reference = loopFlux(solver, alpha)
+    np.testing.assert_allclose(flux, reference, rtol=1e-12, atol=1e-14)
+    # the first cell takes its left state from the last cell
+    np.testing.assert_allclose(flux[:, 0], loopFlux(solver, alpha[:, [-1, 0]])[:, 1], rtol=1e-12, atol=1e-14)
+
+
+def test_fvmUpdateMatchesLoop(solver):
+    alpha = randomAlpha(solver, 7, seed=0)
+    solver.u = math.reconstructU(alpha=alpha.T, m=solver.mBasis, w=solver.quadWeights).T
+    solver.alpha = alpha
+    reference = loopUpdate(solver, solver.u, loopFlux(solver, alpha))
+    solver.computeFluxNewton()
+    solver.FVMUpdateNewton()
+    np.testing.assert_allclose(solver.u, reference, rtol=1e-12, atol=1e-14)
+
+
+def test_modelArtifactsInRootFolder(tmp_path, monkeypatch):
+    # the solver loads the weights and writes the exported closure to <rootFolder>/models/<model folder>
+    monkeypatch.chdir(tmp_path)
+    closure = initNeuralClosure(modelNumber=11, polyDegree=2, spatialDim=1, folderName="002_sim_M2_1D", lossCombi=2,
+                                width=15, depth=7, normalized=True)
+    modelFolder = tmp_path / "root" / "models" / "002_sim_M2_1D"
+    modelFolder.mkdir(parents=True)
+    closure.model.save_weights(str(modelFolder / "best_model.h5"))
+
+    solver = MNSolver1D(traditional=False, polyDegree=2, numpyBackend=True, rootFolder=str(tmp_path / "root") + "/")
+    assert solver.modelFolder == str(modelFolder)
+    assert (modelFolder / "numpy_closure.npz").exists()
+    for [weight, loaded] in zip(closure.model.get_weights(), solver.neuralClosure.model.get_weights()):
+        np.testing.assert_array_equal(weight, loaded)
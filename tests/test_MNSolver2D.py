@@ -0,0 +1,103 @@
+'''
+Checks the vectorized x/y upwind fluxes and FVM update of MNSolver2D against the per cell loops they replace.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src import math
+
+try:
+    from src.solver.MNSolver2D import MNSolver2D
+except OSError:  # the solver module sets the custom matplotlib style "kitish"
+    pytest.skip("matplotlib style kitish is not installed", allow_module_level=True)
+
+
+### reference implementations ###
+def loopFlux(solver, alpha):
+    # per cell kinetic upwind fluxes with periodic boundaries
+    [_, nx, ny] = alpha.shape
+    xFlux = np.zeros(alpha.shape)
+    yFlux = np.zeros(alpha.shape)
+    for j in range(ny):
+        for i in range(nx):
+            # Computation in x direction
+            im1 = i - 1
+            if i == 0:  # periodic boundaries
+                im1 = nx - 1
+            fluxL = math.entropyDualPrime(np.tensordot(alpha[:, im1, j], solver.mBasis, axes=([0], [0])))
+            fluxR = math.entropyDualPrime(np.tensordot(alpha[:, i, j], solver.mBasis, axes=([0], [0])))
+            flux = 0
+            for q in range(solver.nq):  # integrate upwinding result
+                upwind = solver.upwinding(fluxL[q], fluxR[q], solver.quadPts[q], [1, 0])
+                flux = flux + upwind * solver.quadWeights[q] * solver.mBasis[:, q]
+            xFlux[:, i, j] = flux
+
+            # Computation in y direction
+            jm1 = j - 1
+            if j == 0:  # periodic boundaries
+                jm1 = ny - 1
+            fluxLow = math.entropyDualPrime(np.tensordot(alpha[:, i, jm1], solver.mBasis, axes=([0], [0])))
+            fluxUp = math.entropyDualPrime(np.tensordot(alpha[:, i, j], solver.mBasis, axes=([0], [0])))
+            flux = 0
+            for q in range(solver.nq):  # integrate upwinding result
+                upwind = solver.upwinding(fluxLow[q], fluxUp[q], solver.quadPts[q], [0, 1])
+                flux = flux + upwind * solver.quadWeights[q] * solver.mBasis[:, q]
+            yFlux[:, i, j] = flux
+    return [xFlux, yFlux]
+
+
+def loopUpdate(solver, u, xFlux, yFlux):
+    u = np.copy(u)
+    [_, nx, ny] = u.shape
+    for j in range(ny):
+        for i in range(nx):
+            ip1 = i + 1
+            jp1 = j + 1
+            # periodic boundaries
+            if i == nx - 1:
+                ip1 = 0
+            if j == ny - 1:
+                jp1 = 0
+            u[:, i, j] = u[:, i, j] + ((xFlux[:, i, j] - xFlux[:, ip1, j]) / solver.dx + (
+                    yFlux[:, i, j] - yFlux[:, i, jp1]) / solver.dy) * solver.dt
+    return u
+
+
+### test definitions ###
+@pytest.fixture(scope="module")
+def solver(tmp_path_factory):
+    # the solver writes its error analysis to the working directory
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("solver2D"))
+        yield MNSolver2D(traditional=True)
+
+
+def randomAlpha(solver, nx, ny, seed):
+    # every alpha defines a realizable moment u = <m exp(alpha * m)>
+    rng = np.random.default_rng(seed)
+    alpha = rng.uniform(-2.0, 2.0, size=(solver.nSystem, nx, ny))
+    alpha[0] = rng.uniform(-1.0, 1.0, size=(nx, ny))
+    return alpha
+
+
+@pytest.mark.parametrize("nx, ny", [(1, 1), (2, 3), (5, 4)])
+def test_fluxMatchesLoop(solver, nx, ny):
+    alpha = randomAlpha(solver, nx, ny, seed=nx * ny)
+    [xFlux, yFlux] = solver.computeFluxVectorized(alpha)
+    [xReference, yReference] = loopFlux(solver, alpha)
+    np.testing.assert_allclose(xFlux, xReference, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(yFlux, yReference, rtol=1e-12, atol=1e-14)
+
+
+def test_fvmUpdateMatchesLoop(solver):
+    alpha = randomAlpha(solver, 5, 4, seed=0)
+    u = np.reshape(math.reconstructU(alpha=np.reshape(alpha, (solver.nSystem, -1)).T, m=solver.mBasis,
+                                     w=solver.quadWeights).T, alpha.shape)
+    [xFlux, yFlux] = loopFlux(solver, alpha)
+    np.testing.assert_allclose(solver.FVMUpdateVectorized(u, xFlux, yFlux), loopUpdate(solver, u, xFlux, yFlux),
+                               rtol=1e-12, atol=1e-14)
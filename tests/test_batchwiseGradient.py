@@ -0,0 +1,47 @@
+'''
+Checks the traced batchwise closure of the KiT-RT bridge against the model outputs.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import os
+
+os.environ.setdefault("TF_USE_LEGACY_KERAS", "1")  # the sobolev models are tf_keras models
+
+import numpy as np
+import pytest
+
+# inpackage imports
+from src.neuralClosures.configModel import initNeuralClosure
+
+
+### test definitions ###
+@pytest.mark.parametrize("precision", [0, 2])
+@pytest.mark.parametrize("modelNumber", [11, 13, 14])
+def test_batchwiseGradientMatchesModelAlpha(modelNumber, precision, tmp_path):
+    neuralClosure = initNeuralClosure(modelNumber=modelNumber, polyDegree=2, spatialDim=1,
+                                      folderName=str(tmp_path), width=8, depth=2, normalized=True, lossCombi=2,
+                                      precision=precision)
+    u = np.random.default_rng(0).uniform(-0.5, 0.5, size=(16, neuralClosure.inputDim))
+    u = u.astype(neuralClosure.networkDtype.as_numpy_dtype)
+
+    [h, alpha] = neuralClosure.createBatchwiseGradientFunction()(u)
+    assert alpha.dtype == neuralClosure.networkDtype
+    outputs = neuralClosure.model(u)
+    np.testing.assert_allclose(h.numpy(), outputs[0].numpy(), rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(alpha.numpy(), outputs[1].numpy(), rtol=1e-5, atol=1e-6)
+
+
+def test_bridgeKeepsFloat64Precision(tmp_path):
+    import callNeuralClosure
+    callNeuralClosure.initModel(modelNumber=11, polyDegree=2, spatialDim=1, folderName=str(tmp_path), lossCombi=2,
+                                width=8, depth=2, normalized=True, precision=2)
+    u = np.random.default_rng(0).uniform(-0.5, 0.5, size=(16, callNeuralClosure.neuralClosureModel.inputDim))
+    alpha = np.copy(u)
+    h = np.zeros((16, 1))
+    callNeuralClosure.callNetworkBatchwiseInplace(alpha, h)
+
+    outputs = callNeuralClosure.neuralClosureModel.model(u)
+    np.testing.assert_allclose(h, outputs[0].numpy(), rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(alpha, outputs[1].numpy(), rtol=1e-12, atol=1e-14)
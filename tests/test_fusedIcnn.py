@@ -0,0 +1,44 @@
+'''
+Checks the fused icnn core against the functional core it replaces: h against the core model, alpha against the
+GradientTape, and the outputs of the sobolev model before and after useFusedCore.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+import tensorflow as tf
+
+# inpackage imports
+from src.neuralClosures.configModel import initNeuralClosure
+from src.neuralClosures.fusedIcnn import fusedIcnn
+
+
+### test definitions ###
+@pytest.mark.parametrize("modelNumber", [11, 13, 14])
+def test_fusedCoreMatchesTape(modelNumber, tmp_path):
+    neuralClosure = initNeuralClosure(modelNumber=modelNumber, polyDegree=2, spatialDim=1,
+                                      folderName=str(tmp_path), width=8, depth=3, normalized=True, lossCombi=2,
+                                      precision=2)
+    u = tf.constant(np.random.default_rng(modelNumber).uniform(-0.5, 0.5, size=(16, neuralClosure.inputDim)))
+    coreModel = neuralClosure.model.coreModel
+    with tf.GradientTape() as tape:
+        tape.watch(u)
+        hCore = coreModel(u)
+    alphaCore = tape.gradient(hCore, u)
+    outputs = neuralClosure.model(u)
+
+    # the output layers are found in the graph, not by their shape
+    outputLayerNames = fusedIcnn.getOutputLayerNames(coreModel)
+    assert all([isinstance(coreModel.get_layer(name), tf.keras.layers.Dense) for name in outputLayerNames])
+    assert coreModel.get_layer(outputLayerNames[0]).use_bias
+    assert not coreModel.get_layer(outputLayerNames[1]).use_bias
+
+    neuralClosure.useFusedCore()
+    [h, alpha] = neuralClosure.model.coreModel.call_with_derivative(u)
+    np.testing.assert_allclose(h.numpy(), hCore.numpy(), rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(alpha.numpy(), alphaCore.numpy(), rtol=1e-12, atol=1e-14)
+    fusedOutputs = neuralClosure.model(u)
+    for [output, fusedOutput] in zip(outputs, fusedOutputs):
+        np.testing.assert_allclose(fusedOutput.numpy(), output.numpy(), rtol=1e-12, atol=1e-14)
@@ -0,0 +1,93 @@
+'''
+Checks that the vectorized monomial basis keeps the row order of the hand-written bases it replaces.
+The reference implementations of computeMonomialBasis1D and computeMonomialBasis2D are copied from src/math.py
+before commit 582264e ("Vectorize monomial basis..."). The old 2D basis was hard-coded to degree 1 and there was no
+3D basis, so higher degrees are checked against explicit nested loops over the exponents in the documented order.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src import math
+
+
+### reference implementations ###
+def oldMonomialBasis1D(quadPts, polyDegree):
+    # computeMonomialBasis1D before 582264e
+    basisLen = math.getBasisSize(polyDegree, 1)
+    nq = quadPts.shape[0]
+    monomialBasis = np.zeros((basisLen, nq))
+
+    for idx_quad in range(0, nq):
+        for idx_degree in range(0, polyDegree + 1):
+            monomialBasis[idx_degree, idx_quad] = np.power(quadPts[idx_quad], idx_degree)
+    return monomialBasis
+
+
+def oldMonomialBasis2D(quadPts, polyDegree):
+    # computeMonomialBasis2D before 582264e, hard-coded for degree 1
+    basisLen = math.getBasisSize(polyDegree, 2)
+    nq = quadPts.shape[0]
+    monomialBasis = np.zeros((basisLen, nq))
+
+    for idx_quad in range(0, nq):
+        # Hardcoded for degree 1
+        monomialBasis[0, idx_quad] = 1.0
+        monomialBasis[1, idx_quad] = quadPts[idx_quad, 0]
+        monomialBasis[2, idx_quad] = quadPts[idx_quad, 1]
+    return monomialBasis
+
+
+def loopMonomialBasis(quadPts, polyDegree, spatialDim):
+    # by total degree, within one degree by descending exponents of x, then y
+    rows = []
+    for degree in range(0, polyDegree + 1):
+        if spatialDim == 2:
+            for i in range(degree, -1, -1):
+                rows.append(quadPts[:, 0] ** i * quadPts[:, 1] ** (degree - i))
+        else:
+            for i in range(degree, -1, -1):
+                for j in range(degree - i, -1, -1):
+                    rows.append(quadPts[:, 0] ** i * quadPts[:, 1] ** j * quadPts[:, 2] ** (degree - i - j))
+    return np.array(rows)
+
+
+def randomPoints(spatialDim, seed):
+    return np.random.default_rng(seed).uniform(-1.0, 1.0, size=(11, spatialDim))
+
+
+### test definitions ###
+@pytest.mark.parametrize("polyDegree", [1, 2, 3, 4])
+def test_basis1DMatchesOld(polyDegree):
+    quadPts = randomPoints(1, polyDegree)[:, 0]
+    expected = oldMonomialBasis1D(quadPts, polyDegree)
+    np.testing.assert_array_equal(math.computeMonomialBasis1D(quadPts, polyDegree), expected)
+    np.testing.assert_array_equal(math.computeMonomialBasis(quadPts, polyDegree, 1), expected)
+    np.testing.assert_array_equal(math.getMonomialExponents(polyDegree, 1)[:, 0], np.arange(polyDegree + 1))
+
+
+def test_basis2DDegree1MatchesOld():
+    quadPts = randomPoints(2, 0)
+    np.testing.assert_array_equal(math.computeMonomialBasis2D(quadPts, 1), oldMonomialBasis2D(quadPts, 1))
+
+
+@pytest.mark.parametrize("polyDegree", [1, 2, 3, 4])
+@pytest.mark.parametrize("spatialDim", [2, 3])
+def test_basisMatchesLoop(spatialDim, polyDegree):
+    quadPts = randomPoints(spatialDim, polyDegree)
+    basis = math.computeMonomialBasis(quadPts, polyDegree, spatialDim)
+    assert basis.shape == (math.getBasisSize(polyDegree, spatialDim), quadPts.shape[0])
+    np.testing.assert_allclose(basis, loopMonomialBasis(quadPts, polyDegree, spatialDim), rtol=1e-14)
+    wrapper = math.computeMonomialBasis2D if spatialDim == 2 else math.computeMonomialBasis3D
+    np.testing.assert_array_equal(wrapper(quadPts, polyDegree), basis)
+
+
+def test_exponentsDegree2():
+    np.testing.assert_array_equal(math.getMonomialExponents(2, 2), [[0, 0], [1, 0], [0, 1], [2, 0], [1, 1], [0, 2]])
+    np.testing.assert_array_equal(math.getMonomialExponents(2, 3),
+                                  [[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [2, 0, 0], [1, 1, 0], [1, 0, 1],
+                                   [0, 2, 0], [0, 1, 1], [0, 0, 2]])
@@ -0,0 +1,96 @@
+'''
+Checks the batched Newton solvers of the dual entropy problem (numpy and tensorflow version) against
+scipy.optimize.minimize.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+import scipy.optimize
+
+# inpackage imports
+from src import math
+
+
+### helper functions ###
+def dualObjective(alpha, u, mBasis, quadWeights):
+    f_w = np.exp(np.matmul(alpha, mBasis)) * quadWeights
+    return [np.sum(f_w) - np.dot(alpha, u), np.matmul(mBasis, f_w) - u, np.einsum('q,nq,kq->nk', f_w, mBasis, mBasis)]
+
+
+def scipyReference(u, mBasis, quadWeights):
+    alpha = []
+    for sample in u:
+        result = scipy.optimize.minimize(lambda a: dualObjective(a, sample, mBasis, quadWeights)[0],
+                                         x0=np.zeros(sample.size), method="trust-exact",
+                                         jac=lambda a: dualObjective(a, sample, mBasis, quadWeights)[1],
+                                         hess=lambda a: dualObjective(a, sample, mBasis, quadWeights)[2],
+                                         options={"gtol": 1e-10})
+        alpha.append(result.x)
+    return np.array(alpha)
+
+
+def realizableMoments(nS, mBasis, quadWeights, seed):
+    # every alpha defines a realizable moment u = <m exp(alpha * m)>
+    alpha = np.random.default_rng(seed).uniform(-1.5, 1.5, size=(nS, mBasis.shape[0]))
+    return np.matmul(np.exp(np.matmul(alpha, mBasis)) * quadWeights, mBasis.T)
+
+
+def boundaryMoments(mBasis, quadWeights):
+    # diracs at velocities beyond the largest quadrature point: at (or beyond) the boundary of the realizable set,
+    # but not representable by the quadrature. mBasis are the 1D monomials [1, v, v^2, ...]
+    vMax = np.max(mBasis[1])
+    velocities = np.array([0.5 * (vMax + 1.0), 1.0, 1.01])
+    return np.sum(quadWeights) * np.power(velocities[:, np.newaxis], np.arange(mBasis.shape[0]))
+
+
+def isotropicStart(u, quadWeights):
+    alphaStart = np.zeros(u.shape)
+    alphaStart[:, 0] = np.log(u[:, 0] / np.sum(quadWeights))
+    return alphaStart
+
+
+### test definitions ###
+@pytest.mark.parametrize("polyDegree", [1, 2, 3])
+def test_newtonBatchMatchesScipy(polyDegree):
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(1, polyDegree, 20)
+    u = realizableMoments(32, mBasis, quadWeights, seed=polyDegree)
+    tol = 1e-8
+    [alpha, h, converged] = math.minimizeEntropyNewtonBatch(u, isotropicStart(u, quadWeights), mBasis, quadWeights,
+                                                            tol=tol)
+    assert converged.all()
+    residual = np.matmul(np.exp(np.matmul(alpha, mBasis)) * quadWeights, mBasis.T) - u
+    assert np.linalg.norm(residual, axis=1).max() <= tol
+    np.testing.assert_allclose(alpha, scipyReference(u, mBasis, quadWeights), atol=1e-6)
+    # h is the dual objective <exp(alpha*m)> - alpha*u, the negative entropy of the networks
+    hDual = np.sum(np.exp(np.matmul(alpha, mBasis)) * quadWeights, axis=1) - np.sum(alpha * u, axis=1)
+    np.testing.assert_allclose(h, hDual, rtol=1e-12)
+
+
+def test_newtonBatchFlagsBoundaryMoments():
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(1, 2, 20)
+    u = np.concatenate([realizableMoments(4, mBasis, quadWeights, seed=0), boundaryMoments(mBasis, quadWeights)])
+    [_, _, converged] = math.minimizeEntropyNewtonBatch(u, isotropicStart(u, quadWeights), mBasis, quadWeights)
+    np.testing.assert_array_equal(converged, [True] * 4 + [False] * 3)
+
+
+def test_entropyToolsBatchMatchesScipy():
+    entropyTools = math.EntropyTools(2)
+    mBasis = np.asarray(entropyTools.momentBasis, dtype=np.float64)
+    quadWeights = np.reshape(np.asarray(entropyTools.quadWeights, dtype=np.float64), (-1,))
+    u = realizableMoments(16, mBasis, quadWeights, seed=1)
+    tol = 1e-8
+    [alpha, h, converged] = entropyTools.minimize_entropy_batch(u, isotropicStart(u, quadWeights), tol=tol)
+    [alpha, h, converged] = [alpha.numpy(), h.numpy(), converged.numpy()]
+    assert converged.all()
+    residual = np.matmul(np.exp(np.matmul(alpha, mBasis)) * quadWeights, mBasis.T) - u
+    assert np.linalg.norm(residual, axis=1).max() <= tol
+    np.testing.assert_allclose(alpha, scipyReference(u, mBasis, quadWeights), atol=1e-6)
+    hDual = np.sum(np.exp(np.matmul(alpha, mBasis)) * quadWeights, axis=1) - np.sum(alpha * u, axis=1)
+    np.testing.assert_allclose(h[:, 0], hDual, rtol=1e-10)
+
+    u = np.concatenate([u[:4], boundaryMoments(mBasis, quadWeights)])
+    [_, _, converged] = entropyTools.minimize_entropy_batch(u, isotropicStart(u, quadWeights))
+    np.testing.assert_array_equal(converged.numpy(), [True] * 4 + [False] * 3)
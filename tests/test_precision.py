@@ -0,0 +1,27 @@
+'''
+Checks that the precision policy of a closure does not leak into models created later in the same process.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import os
+
+os.environ.setdefault("TF_USE_LEGACY_KERAS", "1")  # the sobolev models are tf_keras models
+
+import tensorflow as tf
+
+# inpackage imports
+from src.neuralClosures.configModel import initNeuralClosure
+
+
+### test definitions ###
+def test_precisionPolicyIsScopedToModel(tmp_path):
+    floatx = tf.keras.backend.floatx()
+    closure64 = initNeuralClosure(modelNumber=11, polyDegree=1, spatialDim=1, folderName=str(tmp_path / "f64"),
+                                  width=8, depth=2, normalized=True, lossCombi=2, precision=2)
+    assert tf.keras.backend.floatx() == floatx
+    closure32 = initNeuralClosure(modelNumber=11, polyDegree=1, spatialDim=1, folderName=str(tmp_path / "f32"),
+                                  width=8, depth=2, normalized=True, lossCombi=2, precision=0)
+    assert all([weight.dtype == tf.float64 for weight in closure64.model.trainable_weights])
+    assert all([weight.dtype == tf.float32 for weight in closure32.model.trainable_weights])
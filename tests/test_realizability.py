@@ -0,0 +1,62 @@
+'''
+Checks the rejection free samplers of the realizable set: every sample passes the realizability check, and the
+stratified mode places its samples in the requested boundary distance bands.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src import math
+from src import realizability
+
+supportedBases = [(1, 1), (2, 1), (3, 1), (4, 1), (1, 2)]  # (polyDegree, spatialDim)
+
+
+### test definitions ###
+@pytest.mark.parametrize("mode", ["uniform", "boundary"])
+@pytest.mark.parametrize("polyDegree, spatialDim", supportedBases)
+def test_samplesAreRealizable(polyDegree, spatialDim, mode):
+    u = realizability.sampleRealizable(500, polyDegree, spatialDim, np.random.default_rng(polyDegree), mode=mode)
+    assert u.shape == (500, math.getBasisSize(polyDegree, spatialDim))
+    np.testing.assert_array_equal(u[:, 0], 1.0)
+    assert realizability.isRealizable(u, polyDegree, spatialDim).all()
+
+
+@pytest.mark.parametrize("polyDegree, spatialDim", supportedBases)
+def test_stratifiedCoversBoundaryBands(polyDegree, spatialDim):
+    strata = np.array([1e-4, 1e-3, 1e-2, 1e-1, 1.0])
+    [u, strataIdx] = realizability.sampleRealizable(400, polyDegree, spatialDim, np.random.default_rng(0),
+                                                    mode="boundary", strata=strata, returnStrata=True)
+    assert realizability.isRealizable(u, polyDegree, spatialDim).all()
+    np.testing.assert_array_equal(np.bincount(strataIdx), [100, 100, 100, 100])
+    # every sample lies in the distance band of its stratum, the bands are sampled up to their edges
+    distance = realizability.boundaryDistance(u, polyDegree, spatialDim)
+    assert np.all(distance >= strata[strataIdx] * (1.0 - 1e-6))
+    assert np.all(distance <= strata[strataIdx + 1] * (1.0 + 1e-6))
+    for i in range(strata.size - 1):
+        bandDistance = distance[strataIdx == i]
+        assert bandDistance.min() < strata[i] + 0.1 * (strata[i + 1] - strata[i])
+        assert bandDistance.max() > strata[i + 1] - 0.1 * (strata[i + 1] - strata[i])
+
+
+@pytest.mark.parametrize("mode", ["uniform", "boundary"])
+def test_samplesInsideQuadratureSupportAreSolvable(mode):
+    # moments restricted to the quadrature support have a solution of the discrete dual problem
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(1, 2, 20)
+    radius = realizability.supportRadius(mBasis, 1)
+    rng = np.random.default_rng(1)
+    if mode == "uniform":
+        u = realizability.sampleRealizable(60, 2, 1, rng, mode=mode, radius=radius)
+    else:
+        [u, strataIdx] = realizability.sampleRealizable(60, 2, 1, rng, mode=mode, radius=radius, returnStrata=True)
+        # the stratum closest to the boundary needs Lagrange multipliers beyond the reach of the Newton solver
+        u = u[strataIdx > 0]
+    u = u * np.sum(quadWeights)
+    alphaStart = np.zeros(u.shape)
+    alphaStart[:, 0] = np.log(u[:, 0] / np.sum(quadWeights))
+    [_, _, converged] = math.minimizeEntropyNewtonBatch(u, alphaStart, mBasis, quadWeights)
+    assert converged.all()
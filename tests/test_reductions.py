@@ -0,0 +1,70 @@
+'''
+Checks the shifted (log-sum-exp) quadrature reductions against the direct float64 reduction <b exp(alpha*m)>,
+unchunked and chunked, and for Lagrange multipliers where the direct exponential overflows.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+import scipy.special
+import tensorflow as tf
+
+# inpackage imports
+from src import math
+from src import reductions
+
+
+### helper functions ###
+def logReference(alpha, mBasis, quadWeights, reductionBasis):
+    # ln|<b exp(alpha*m)>| and its sign in float64, evaluated by scipy's log-sum-exp
+    exponent = np.matmul(alpha, mBasis)
+    logReduction = np.zeros((alpha.shape[0], reductionBasis.shape[0]))
+    sign = np.zeros((alpha.shape[0], reductionBasis.shape[0]))
+    for k in range(reductionBasis.shape[0]):
+        [logReduction[:, k], sign[:, k]] = scipy.special.logsumexp(exponent, b=quadWeights * reductionBasis[k],
+                                                                     axis=1, return_sign=True)
+    return [logReduction, sign]
+
+
+def randomAlpha(nS, mBasis, scale, seed):
+    return np.random.default_rng(seed).uniform(-scale, scale, size=(nS, mBasis.shape[0]))
+
+
+### test definitions ###
+@pytest.mark.parametrize("chunkSize", [None, 1, 7, 1000])
+@pytest.mark.parametrize("dtype", [tf.float32, tf.float64])
+def test_shiftedReductionMatchesDirect(chunkSize, dtype):
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(2, 2, 10)
+    alpha = randomAlpha(16, mBasis, 2.0, seed=0)
+    [reduction, shift] = reductions.shiftedReduction(tf.constant(alpha, dtype=dtype), mBasis, quadWeights, mBasis,
+                                                     chunkSize=chunkSize)
+    assert reduction.dtype == dtype and shift.dtype == dtype
+    direct = np.matmul(np.exp(np.matmul(alpha, mBasis)) * quadWeights, mBasis.T)
+    rtol = 1e-5 if dtype == tf.float32 else 1e-12
+    np.testing.assert_allclose(reduction.numpy() * np.exp(shift.numpy()), direct, rtol=rtol,
+                               atol=rtol * np.abs(direct).max())
+    # the exponent is shifted by its maximum over all quadrature points
+    np.testing.assert_allclose(shift.numpy()[:, 0], np.max(np.matmul(alpha, mBasis), axis=1), rtol=rtol)
+
+
+@pytest.mark.parametrize("chunkSize", [None, 7])
+@pytest.mark.parametrize("dtype, scale", [(tf.float32, 100.0), (tf.float64, 800.0)])
+def test_shiftedReductionLargeAlpha(chunkSize, dtype, scale):
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(2, 2, 10)
+    alpha = randomAlpha(16, mBasis, scale, seed=1)
+    with np.errstate(over="ignore"):
+        assert not np.isfinite(np.exp(np.matmul(alpha, mBasis).astype(dtype.as_numpy_dtype))).all()
+
+    [reduction, shift] = reductions.shiftedReduction(tf.constant(alpha, dtype=dtype), mBasis, quadWeights, mBasis,
+                                                     chunkSize=chunkSize, accumulationDtype=tf.float64)
+    assert np.isfinite(reduction.numpy()).all() and np.isfinite(shift.numpy()).all()
+    [logReduction, sign] = logReference(alpha, mBasis, quadWeights, mBasis)
+    # compare where the reduction is not the result of cancellation
+    relevant = np.abs(reduction.numpy()) > 1e-6 * np.abs(reduction.numpy()).max(axis=1, keepdims=True)
+    np.testing.assert_array_equal(np.sign(reduction.numpy())[relevant], sign[relevant])
+    # float32 exponents of size scale carry an absolute error of about scale * 1e-7
+    atol = 1e-3 if dtype == tf.float32 else 1e-10
+    np.testing.assert_allclose((np.log(np.abs(reduction.numpy())) + shift.numpy())[relevant], logReduction[relevant],
+                               atol=atol)
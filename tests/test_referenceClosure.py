@@ -0,0 +1,65 @@
+'''
+Checks the incremental mode of the reference closure: skipped cells return their cached Lagrange multiplier and
+entropy, changed cells are solved again.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src import math
+from src.solver.referenceClosure import referenceClosure
+
+
+### test definitions ###
+@pytest.fixture
+def moments():
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(1, 2, 20)
+    # every alpha defines a realizable moment u = <m exp(alpha * m)>
+    alpha = np.random.default_rng(0).uniform(-1.5, 1.5, size=(8, mBasis.shape[0]))
+    u = math.reconstructU(alpha=alpha, m=mBasis, w=quadWeights)
+    return [u, mBasis, quadWeights]
+
+
+def isotropicStart(u, quadWeights):
+    alphaStart = np.zeros(u.shape)
+    alphaStart[:, 0] = np.log(u[:, 0] / np.sum(quadWeights))
+    return alphaStart
+
+
+def test_skippedCellsReturnCache(moments):
+    [u, mBasis, quadWeights] = moments
+    closure = referenceClosure(mBasis, quadWeights, nCells=u.shape[0], nWorkers=1, incrementalTol=1e-6)
+    [alphaFirst, hFirst, converged] = closure(u, isotropicStart(u, quadWeights))
+    assert converged.all() and closure.solvedMask.all()
+
+    # perturb the first two cells above the tolerance, all others below
+    uNext = u * (1.0 + 1e-8)
+    uNext[:2] *= 1.01
+    [alpha, h, converged] = closure(uNext, alphaFirst)
+    assert converged.all()
+    np.testing.assert_array_equal(closure.solvedMask, [True] * 2 + [False] * 6)
+    assert closure.skipRates[-1] == 0.75
+    np.testing.assert_array_equal(alpha[2:], alphaFirst[2:])
+    np.testing.assert_array_equal(h[2:], hFirst[2:])
+    [alphaReference, hReference, _] = math.minimizeEntropyNewtonBatch(uNext[:2], alphaFirst[:2], mBasis, quadWeights)
+    np.testing.assert_allclose(alpha[:2], alphaReference, rtol=1e-12)
+    np.testing.assert_allclose(h[:2], hReference, rtol=1e-12)
+
+
+def test_cachedVacuumCellIsSkipped(moments):
+    [u, mBasis, quadWeights] = moments
+    closure = referenceClosure(mBasis, quadWeights, nCells=u.shape[0], nWorkers=1, incrementalTol=1e-6)
+    [alphaFirst, hFirst, _] = closure(u, isotropicStart(u, quadWeights))
+    # a cached vacuum cell (u = 0) must not divide by zero
+    closure.uCache[0] = 0.0
+    uNext = np.copy(u)
+    uNext[0] = 0.0
+    with np.errstate(divide="raise", invalid="raise"):
+        [alpha, h, _] = closure(uNext, alphaFirst)
+    assert not closure.solvedMask.any()
+    np.testing.assert_array_equal(alpha, alphaFirst)
+    np.testing.assert_array_equal(h, hFirst)
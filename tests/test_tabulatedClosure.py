@@ -0,0 +1,51 @@
+'''
+Checks the tabulated M1 closure against the Newton reference, inside and outside of the table.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src import math
+from src.neuralClosures.tabulatedClosure import tabulateClosure, tabulatedClosure, newtonSource
+
+
+### test definitions ###
+@pytest.fixture(scope="module")
+def closure1D():
+    [_, quadWeights, mBasis] = math.getQuadratureBasis(1, 1, 20)
+    params = tabulateClosure(newtonSource(mBasis, quadWeights), mBasis, quadWeights, spatialDim=1, tol=1e-5,
+                             nValidation=1000)
+    return [tabulatedClosure(params), mBasis, quadWeights]
+
+
+def newtonReference(u, mBasis, quadWeights):
+    alphaStart = np.zeros(u.shape)
+    alphaStart[:, 0] = np.log(u[:, 0] / np.sum(quadWeights))
+    [alpha, h, converged] = math.minimizeEntropyNewtonBatch(u, alphaStart, mBasis, quadWeights, tol=1e-7)
+    assert converged.all()
+    return [alpha, -h]
+
+
+def test_outsideMomentsAreSolvedWithNewton(closure1D):
+    [closure, mBasis, quadWeights] = closure1D
+    u1 = np.array([0.0, 0.5 * closure.rMax, 0.995 * closure.rMax / 0.98, -0.99 * closure.rMax / 0.98])
+    u = np.stack([np.ones(u1.size), u1], axis=1) * np.array([[2.0], [1.0], [0.5], [3.0]])
+    [uTable, alpha, h] = closure.call_scaled(u)
+    [alphaRef, hRef] = newtonReference(u, mBasis, quadWeights)
+
+    assert closure.outsideRates[-1] == 0.5
+    np.testing.assert_allclose(uTable[2:], u[2:])
+    # Newton cells are exact, table cells have the interpolation error
+    np.testing.assert_allclose(alpha[2:], alphaRef[2:], atol=1e-6)
+    np.testing.assert_allclose(alpha[:2], alphaRef[:2], atol=1e-3)
+    np.testing.assert_allclose(h[:, 0], hRef, atol=1e-4)
+
+
+def test_nonRealizableMomentsRaise(closure1D):
+    [closure, _, _] = closure1D
+    with pytest.raises(ValueError):
+        closure.call_scaled(np.array([[1.0, 1.5]]))
@@ -0,0 +1,28 @@
+'''
+Checks the training targets of the multi output models, that call_training and the datasets take from
+trainingTargets.
+Run from the repository root: python -m pytest tests
+'''
+
+### imports ###
+# python modules
+import numpy as np
+import pytest
+
+# inpackage imports
+from src.neuralClosures.configModel import initNeuralClosure
+
+
+### test definitions ###
+@pytest.mark.parametrize("modelNumber, layout", [(11, [2, 1, 0]), (13, [2, 1, 1]), (14, [2, 1, 0])])
+def test_trainingTargetsMatchModelOutputs(modelNumber, layout, tmp_path):
+    neuralClosure = initNeuralClosure(modelNumber=modelNumber, polyDegree=2, spatialDim=1, folderName=str(tmp_path),
+                                      width=8, depth=2, normalized=True, lossCombi=2)
+    rng = np.random.default_rng(0)
+    [u, alpha, h] = [rng.random((4, neuralClosure.inputDim)), rng.random((4, neuralClosure.inputDim)),
+                     rng.random((4, 1))]
+    neuralClosure.trainingData = [u, alpha, h]
+    targets = neuralClosure.getTrainingTargets()
+    assert len(targets) == len(neuralClosure.model(u))
+    for target, idx in zip(targets, layout):
+        assert target is neuralClosure.trainingData[idx]